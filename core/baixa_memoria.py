@@ -0,0 +1,212 @@
+"""Execução do watershed com orçamento de memória.
+
+`segment_compact` repete o pipeline de core.segmentacao usando só uint8,
+float32 e int32, reaproveitando buffers sempre que possível e liberando cada
+intermediário assim que ele é consumido. `segment_with_budget` escolhe entre
+ele e o modo pirâmide conforme o orçamento e mede o pico de RSS da execução.
+"""
+import ctypes
+import functools
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+from skimage import morphology, filters
+
+from core.piramide import segment_pyramid
+from core.segmentacao import draw_boundaries, flood, label_overlay, stage_reporter
+
+# Pico aproximado de segment_compact, em bytes por pixel da imagem, por motor
+# (medido com PeakRSSMonitor numa ampliação de 14 MP do img57, imagem de
+# entrada incluída). O caminho original em float64 fica em ~132 B/px.
+COMPACT_BYTES_PER_PIXEL = {"reconstruction32": 96, "seeded": 68}
+# Arrays em escala cheia que o modo pirâmide mantém: entrada BGR, cinza,
+# rótulos int32, faixa e overlay.
+PYRAMID_BYTES_PER_PIXEL = 12
+
+
+def current_rss():
+    """Memória residente do processo, em bytes."""
+    if sys.platform == "win32":
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", ctypes.c_ulong),
+                        ("PageFaultCount", ctypes.c_ulong),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters), counters.cb
+        )
+        return counters.WorkingSetSize
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        # macOS: só há o pico do processo inteiro (em bytes)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PeakRSSMonitor:
+    """Amostra a RSS do processo em uma thread enquanto o bloco `with` roda.
+
+    Ao sair, `peak` é o maior valor observado e `baseline` o valor na entrada.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        return False
+
+
+def segment_compact(image, original=None, capture=None, progress=None,
+                    engine="reconstruction32"):
+    """Mesmo pipeline de segment_watershed com tipos compactos e buffers reusados.
+
+    A transformada de distância em float32 pode mudar alguns pixels do limiar
+    de 0.5·maxD em relação ao caminho em float64. `engine` é o motor de
+    core.segmentacao.flood; "seeded" dispensa a reconstrução, que domina o
+    pico de memória.
+    """
+    if original is None:
+        original = image
+    stage = stage_reporter(capture, progress)
+
+    # 1. escala de cinza
+    if len(image.shape) == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+    stage("1. Imagem em Escala de Cinza", gray, np.copy)
+
+    # 2-4. filtro Gaussiano, Otsu invertido e abertura no mesmo buffer uint8
+    work = cv2.GaussianBlur(gray, (7, 7), 3)
+    stage("2. Filtro Gaussiano", work, np.copy)
+    cv2.threshold(work, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=work)
+    stage("3. Binarização Invertida", work, np.copy)
+    cv2.morphologyEx(work, cv2.MORPH_OPEN, morphology.disk(1).astype(np.uint8), dst=work)
+    stage("4. Abertura Morfológica", work, np.copy)
+
+    # 5. fundo seguro: as 3 dilatações numa única chamada
+    kernel_cv2 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    sure_bg = cv2.dilate(work, kernel_cv2, iterations=3)
+    stage("5. Área de Fundo (Dilatação)", sure_bg, np.copy)
+
+    # 6. transformada de distância em float32 sobre a abertura invertida
+    cv2.bitwise_not(work, dst=work)
+    D = cv2.distanceTransform(work, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    del work
+    stage("6. Transformada de Distância", D,
+          lambda D: cv2.normalize(D, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U))
+    sure_fg = D > 0.5 * D.max()
+    del D
+    stage("7. Foreground Seguro", sure_fg, lambda fg: fg.view(np.uint8) * 255)
+
+    # 7. regiões desconhecidas reaproveitando o buffer do fundo seguro
+    sure_bg[sure_fg] = 0
+    unknown = sure_bg
+    stage("8. Regiões Desconhecidas", unknown)
+
+    # 8. marcadores int32
+    _, markers = cv2.connectedComponents(sure_fg.view(np.uint8), connectivity=8,
+                                         ltype=cv2.CV_32S)
+    del sure_fg
+    markers += 1
+    markers[unknown > 0] = 0
+    del unknown, sure_bg
+    stage("9. Marcadores (Markers)", markers, label_overlay)
+
+    # 9. gradiente em float32
+    gradmag = gray.astype(np.float32)
+    gradmag /= 255
+    gradmag = filters.sobel(gradmag)
+    stage("10. Gradiente da Imagem", gradmag,
+          lambda g: cv2.normalize(g, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U))
+
+    # 10. imposição de mínimos e watershed
+    L_ws = flood(gradmag, markers, engine, gray)
+    del gradmag, markers
+    stage("11. Segmentação via Watershed", L_ws, label_overlay)
+
+    # 11-12. bordas e overlay
+    I_overlay = draw_boundaries(original, L_ws)
+    stage("12. Segmentação por Watershed (Overlay)", I_overlay)
+
+    return {"labels": L_ws, "overlay": I_overlay}
+
+
+def segment_with_budget(image, original=None, budget=None, capture=None,
+                        progress=None, engine="reconstruction32"):
+    """Segmenta respeitando um orçamento de memória (em bytes) e mede o pico.
+
+    Se a estimativa de segment_compact couber no orçamento (ou não houver
+    orçamento), a imagem é segmentada inteira; senão, usa o modo pirâmide com
+    a maior escala reduzida que caiba. Levanta MemoryError se nem os arrays
+    em escala cheia do modo pirâmide couberem.
+
+    Além de `labels` e `overlay`, o resultado traz `mode`, `peak_rss`
+    (pico absoluto do processo) e `run_rss` (acréscimo sobre a RSS inicial).
+    Só os motores com pico medido (COMPACT_BYTES_PER_PIXEL) são aceitos.
+    """
+    if engine not in COMPACT_BYTES_PER_PIXEL:
+        raise ValueError(
+            f"Motor {engine} sem estimativa de memória; use "
+            f"{' ou '.join(COMPACT_BYTES_PER_PIXEL)}"
+        )
+    pixels = image.shape[0] * image.shape[1]
+    bytes_per_pixel = COMPACT_BYTES_PER_PIXEL[engine]
+    with PeakRSSMonitor() as monitor:
+        if budget is None or pixels * bytes_per_pixel <= budget:
+            mode = "compact"
+            result = segment_compact(image, original, capture=capture,
+                                     progress=progress, engine=engine)
+        else:
+            spare = budget - pixels * PYRAMID_BYTES_PER_PIXEL
+            if spare <= 0:
+                raise MemoryError(
+                    f"Orçamento de {budget / 2 ** 20:.0f} MB insuficiente para uma "
+                    f"imagem de {pixels / 1e6:.1f} MP"
+                )
+            # maior lado reduzido cuja segmentação completa caiba no que sobra
+            coarse_pixels = spare / bytes_per_pixel
+            max_side = int(max(image.shape[:2]) * (coarse_pixels / pixels) ** 0.5)
+            max_side = max(max_side, 64)
+            mode = f"pyramid (max_side={max_side})"
+            result = segment_pyramid(image, original, max_side=max_side,
+                                     capture=capture, progress=progress,
+                                     segment=functools.partial(segment_compact,
+                                                               engine=engine))
+    result["mode"] = mode
+    result["peak_rss"] = monitor.peak
+    result["run_rss"] = monitor.peak - monitor.baseline
+    return result
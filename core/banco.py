@@ -0,0 +1,343 @@
+"""Banco local de casos (SQLite): resultados por imagem, sem depender da janela.
+
+Cada análise concluída (velocidade calculada) vira uma linha de `analyses`
+ligada à imagem de origem pelo hash do conteúdo do arquivo (o mesmo de
+core.importacao.file_hash), com a calibração, a deformação, a energia, a
+velocidade, o relatório e os tempos por etapa. O mapa de rótulos vai para
+LABELS_DIR com o nome do hash do seu conteúdo, então a mesma segmentação
+registrada várias vezes ocupa o disco uma vez só.
+
+Reimportar uma foto já analisada, mesmo renomeada, acha a última análise
+pelo hash (índice em image_hash, created_at) e a interface restaura os
+resultados sem refazer nada. As consultas agregadas por classe de veículo
+ou por data usam índices de cobertura, que já contêm todas as colunas
+somadas: a tabela em si não é lida, e milhares de casos se resumem em
+poucos milissegundos.
+
+Uso:
+    python -m core.banco --por mes --desde 2026-01-01
+    python -m core.banco --imagem "Banco de dados PDI/img52.jpg"
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from core.cache import StageCache
+from core.velocidade import STIFFNESS_PRESETS
+
+DATABASE_PATH = os.path.join(os.path.expanduser("~"), ".smashmetrics", "casos.sqlite")
+LABELS_DIR = os.path.join(os.path.expanduser("~"), ".smashmetrics", "rotulos")
+SCHEMA_VERSION = 2
+CUSTOM_CLASS = "Personalizado"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    hash TEXT PRIMARY KEY,
+    path TEXT,
+    width INTEGER,
+    height INTEGER,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    image_hash TEXT NOT NULL REFERENCES images(hash),
+    created_at REAL NOT NULL,
+    vehicle_class TEXT,
+    stiffness REAL,
+    mass_kg REAL,
+    method TEXT,
+    scale_factor REAL,
+    scale_factors TEXT,
+    calibration_target TEXT,
+    deformation_px REAL,
+    deformation_cm REAL NOT NULL,
+    energy_nm REAL NOT NULL,
+    velocity_kmh REAL NOT NULL,
+    crush_profile TEXT,
+    rectified INTEGER NOT NULL DEFAULT 0,
+    labels_path TEXT,
+    report TEXT
+);
+CREATE TABLE IF NOT EXISTS stage_timings (
+    analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total_s REAL NOT NULL,
+    max_s REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_image ON analyses(image_hash, created_at);
+CREATE INDEX IF NOT EXISTS analyses_class ON analyses(
+    vehicle_class, created_at, velocity_kmh, energy_nm, deformation_cm);
+CREATE INDEX IF NOT EXISTS analyses_date ON analyses(
+    created_at, vehicle_class, velocity_kmh, energy_nm, deformation_cm);
+CREATE INDEX IF NOT EXISTS stage_timings_analysis ON stage_timings(analysis_id);
+"""
+
+# Agrupamentos do resumo: expressão SQL da chave de cada grupo
+GROUPINGS = {
+    "classe": "vehicle_class",
+    "dia": "strftime('%Y-%m-%d', created_at, 'unixepoch', 'localtime')",
+    "mes": "strftime('%Y-%m', created_at, 'unixepoch', 'localtime')",
+    "ano": "strftime('%Y', created_at, 'unixepoch', 'localtime')",
+}
+SUMMARY_COLUMNS = ("grupo", "casos", "velocidade_media", "velocidade_min",
+                   "velocidade_max", "energia_media", "deformacao_media")
+JSON_COLUMNS = ("scale_factors", "calibration_target", "crush_profile")
+
+
+def vehicle_class(stiffness):
+    """Classe de STIFFNESS_PRESETS com essa rigidez, CUSTOM_CLASS ou None (método ajustado)."""
+    if stiffness is None:
+        return None
+    for name, value in STIFFNESS_PRESETS.items():
+        if value == stiffness:
+            return name
+    return CUSTOM_CLASS
+
+
+def _to_json(value):
+    if value is None:
+        return None
+    return json.dumps(value, default=lambda item: item.tolist()
+                      if isinstance(item, np.ndarray) else float(item))
+
+
+def parse_date(text):
+    """Data AAAA-MM-DD (hora local) como timestamp Unix."""
+    return datetime.strptime(text, "%Y-%m-%d").timestamp()
+
+
+class CaseIndex:
+    """Banco de casos em SQLite; a conexão só é aberta no primeiro uso.
+
+    Uma única conexão, protegida por uma trava, serve a thread da interface
+    e as tarefas em segundo plano. O modo WAL deixa a linha de comando ler o
+    banco enquanto a interface grava.
+    """
+
+    def __init__(self, path=DATABASE_PATH, labels_dir=LABELS_DIR):
+        self.path = path
+        self.labels_dir = labels_dir
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                connection.close()
+                raise ValueError(f"{self.path} foi criado por uma versão mais nova do "
+                                 "SmashMetrics")
+            with connection:
+                connection.executescript(SCHEMA)
+                columns = {row["name"] for row in
+                           connection.execute("PRAGMA table_info(analyses)")}
+                if "rectified" not in columns:
+                    # versão 1: sem a coluna que marca análises da vista retificada
+                    connection.execute("ALTER TABLE analyses "
+                                       "ADD COLUMN rectified INTEGER NOT NULL DEFAULT 0")
+                connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            self._connection = connection
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def store_labels(self, labels):
+        """Grava o mapa de rótulos em `labels_dir` com o nome do hash do conteúdo.
+
+        Um mapa já gravado não é reescrito. Retorna o caminho do arquivo.
+        """
+        # core.lote puxa scipy/scikit-image; aqui só roda depois de uma segmentação
+        from core.lote import save_labels
+        os.makedirs(self.labels_dir, exist_ok=True)
+        path_base = os.path.join(self.labels_dir, StageCache.image_key(labels))
+        for extension in ("_labels.png", "_labels.npy"):
+            if os.path.exists(path_base + extension):
+                return path_base + extension
+        return save_labels(path_base, labels)
+
+    def record(self, image, analysis, labels=None, timings=None, progress=None):
+        """Registra uma análise e retorna o id dela.
+
+        `image` tem `hash` e, opcionais, `path`, `width` e `height`;
+        `analysis` tem as colunas de `analyses` (deformation_cm, energy_nm e
+        velocity_kmh obrigatórias; vehicle_class sai de `stiffness` se não
+        vier). `timings` é o dicionário de StageAggregator.stages.
+        """
+        now = time.time()
+        row = dict(analysis)
+        row.setdefault("vehicle_class", vehicle_class(row.get("stiffness")))
+        for column in JSON_COLUMNS:
+            row[column] = _to_json(row.get(column))
+        if labels is not None:
+            if progress:
+                progress(1, 2, "Gravando o mapa de rótulos")
+            row["labels_path"] = self.store_labels(labels)
+        row["image_hash"] = image["hash"]
+        row["created_at"] = row.get("created_at") or now
+        columns = list(row)
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT INTO images (hash, path, width, height, first_seen, last_seen) "
+                    "VALUES (:hash, :path, :width, :height, :now, :now) "
+                    "ON CONFLICT(hash) DO UPDATE SET path = excluded.path, "
+                    "width = COALESCE(excluded.width, width), "
+                    "height = COALESCE(excluded.height, height), last_seen = excluded.last_seen",
+                    {"path": None, "width": None, "height": None, **image, "now": now})
+                cursor = connection.execute(
+                    f"INSERT INTO analyses ({', '.join(columns)}) "
+                    f"VALUES ({', '.join(':' + column for column in columns)})", row)
+                analysis_id = cursor.lastrowid
+                if timings:
+                    connection.executemany(
+                        "INSERT INTO stage_timings (analysis_id, stage, count, total_s, max_s) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(analysis_id, stage, entry["count"], entry["total"], entry["max"])
+                         for stage, entry in timings.items()])
+        if progress:
+            progress(2, 2, "Caso registrado")
+        return analysis_id
+
+    @staticmethod
+    def _decode(row):
+        record = dict(row)
+        for column in JSON_COLUMNS:
+            if record.get(column) is not None:
+                record[column] = json.loads(record[column])
+        record["rectified"] = bool(record["rectified"])
+        return record
+
+    def find(self, image_hash):
+        """Análise mais recente da imagem com esse hash (dicionário), ou None."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT * FROM analyses WHERE image_hash = ? "
+                "ORDER BY created_at DESC LIMIT 1", (image_hash,)).fetchone()
+        return None if row is None else self._decode(row)
+
+    def history(self, image_hash):
+        """Todas as análises da imagem, da mais recente para a mais antiga."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT * FROM analyses WHERE image_hash = ? ORDER BY created_at DESC",
+                (image_hash,)).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def stage_timings(self, analysis_id):
+        """{etapa: {"count", "total", "max"}} gravados com a análise."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT stage, count, total_s, max_s FROM stage_timings WHERE analysis_id = ?",
+                (analysis_id,)).fetchall()
+        return {row["stage"]: {"count": row["count"], "total": row["total_s"],
+                               "max": row["max_s"]} for row in rows}
+
+    def summary(self, by="classe", since=None, until=None, vehicle_class=None):
+        """Estatísticas de velocidade, energia e deformação agrupadas por `by` (GROUPINGS).
+
+        `since` e `until` (timestamps Unix) limitam o intervalo de datas e
+        `vehicle_class` filtra uma classe. Retorna uma lista de dicionários
+        com as chaves de SUMMARY_COLUMNS.
+        """
+        if by not in GROUPINGS:
+            raise ValueError(f"Agrupamento desconhecido: {by}")
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at < ?")
+            params.append(until)
+        if vehicle_class is not None:
+            conditions.append("vehicle_class = ?")
+            params.append(vehicle_class)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = (f"SELECT {GROUPINGS[by]} AS grupo, COUNT(*), AVG(velocity_kmh), "
+                 f"MIN(velocity_kmh), MAX(velocity_kmh), AVG(energy_nm), AVG(deformation_cm) "
+                 f"FROM analyses {where} GROUP BY grupo ORDER BY grupo")
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        return [dict(zip(SUMMARY_COLUMNS, row)) for row in rows]
+
+
+def format_summary(rows, by="classe"):
+    """Tabela de texto do resumo, no estilo da tabela de desempenho."""
+    if not rows:
+        return "Nenhum caso registrado."
+    title = {"classe": "Classe", "dia": "Dia", "mes": "Mês", "ano": "Ano"}[by]
+    lines = [f"{title:<16} {'casos':>6} {'v média':>9} {'v mín':>8} {'v máx':>8} "
+             f"{'Edef média (N.m)':>17} {'def. média (cm)':>16}"]
+    for row in rows:
+        group = row["grupo"] if row["grupo"] is not None else "Método ajustado"
+        lines.append(f"{group[:16]:<16} {row['casos']:>6} {row['velocidade_media']:>9.2f} "
+                     f"{row['velocidade_min']:>8.2f} {row['velocidade_max']:>8.2f} "
+                     f"{row['energia_media']:>17.2f} {row['deformacao_media']:>16.2f}")
+    lines.append("(velocidades em km/h)")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Consulta o banco local de casos do SmashMetrics."
+    )
+    parser.add_argument("--banco", default=DATABASE_PATH, help="arquivo SQLite do banco")
+    parser.add_argument("--por", choices=list(GROUPINGS), default="classe",
+                        help="agrupamento do resumo (padrão: classe)")
+    parser.add_argument("--desde", default=None, metavar="AAAA-MM-DD",
+                        help="só casos registrados a partir desta data")
+    parser.add_argument("--ate", default=None, metavar="AAAA-MM-DD",
+                        help="só casos registrados antes desta data")
+    parser.add_argument("--classe", default=None, help="só casos desta classe de veículo")
+    parser.add_argument("--imagem", default=None,
+                        help="lista as análises desta imagem (pelo hash do conteúdo)")
+    args = parser.parse_args(argv)
+
+    index = CaseIndex(args.banco)
+    try:
+        if args.imagem:
+            from core.importacao import file_hash
+            records = index.history(file_hash(args.imagem))
+            if not records:
+                print(f"Nenhuma análise registrada para {args.imagem}")
+            for record in records:
+                when = datetime.fromtimestamp(record["created_at"]).strftime("%Y-%m-%d %H:%M")
+                print(f"#{record['id']} {when}: {record['deformation_cm']:.2f} cm, "
+                      f"{record['energy_nm']:.2f} N.m, {record['velocity_kmh']:.2f} km/h "
+                      f"({record['vehicle_class'] or 'Método ajustado'})")
+            return 0
+        start = time.perf_counter()
+        rows = index.summary(args.por, parse_date(args.desde) if args.desde else None,
+                             parse_date(args.ate) if args.ate else None, args.classe)
+        elapsed = time.perf_counter() - start
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    finally:
+        index.close()
+    print(format_summary(rows, args.por))
+    print(f"Consulta em {elapsed * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
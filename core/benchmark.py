@@ -0,0 +1,279 @@
+"""Suíte de benchmark reprodutível do SmashMetrics, sem janelas.
+
+Mede, para cada imagem do "Banco de dados PDI" e para imagens sintéticas
+grandes (ampliações determinísticas do img57), o tempo e o pico de memória de
+cada etapa do watershed, o tempo de display_image (primeira exibição e
+repintura) e o de Funcionalidades.energy_and_velocity. Os resultados vão para um JSON que pode
+ser comparado com uma linha de base salva.
+
+Uso:
+    python -m core.benchmark -o bench.json
+    python -m core.benchmark --synthetic 4k 8k --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from core.baixa_memoria import PeakRSSMonitor
+from core.lote import list_images
+from core.segmentacao import AUTO_ENGINE, ENGINES, segment_watershed
+
+DEFAULT_IMAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 "Banco de dados PDI")
+SYNTHETIC_SOURCE = "img57.jpg"
+SYNTHETIC_SIZES = {
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+    "50mp": (8660, 5774),
+}
+# Medições abaixo disso são ruído demais para acusar regressão
+MIN_SECONDS = 0.01
+MIN_BYTES = 2 ** 20
+
+
+def synthetic_image(name, image_dir=DEFAULT_IMAGE_DIR):
+    """Ampliação determinística de uma imagem do banco para o tamanho pedido."""
+    source = cv2.imread(os.path.join(image_dir, SYNTHETIC_SOURCE), cv2.IMREAD_COLOR)
+    if source is None:
+        raise FileNotFoundError(f"{SYNTHETIC_SOURCE} não encontrada em {image_dir}")
+    return cv2.resize(source, SYNTHETIC_SIZES[name], interpolation=cv2.INTER_LINEAR)
+
+
+def time_stages(image, engine, repeat):
+    """Menor tempo de cada etapa em `repeat` execuções, e o total."""
+    best = {}
+    best_total = None
+    for _ in range(repeat):
+        marks = []
+        start = time.perf_counter()
+        segment_watershed(image, engine=engine,
+                          progress=lambda step, total, title: marks.append(
+                              (title, time.perf_counter())))
+        total = time.perf_counter() - start
+        previous = start
+        for title, moment in marks:
+            best[title] = min(best.get(title, float("inf")), moment - previous)
+            previous = moment
+        best_total = total if best_total is None else min(best_total, total)
+    return best, best_total
+
+
+def memory_stages(image, engine):
+    """Pico de memória alocada (tracemalloc) em cada etapa e pico de RSS."""
+    peaks = {}
+
+    def progress(step, total, title):
+        current, peak = tracemalloc.get_traced_memory()
+        peaks[title] = peak
+        tracemalloc.reset_peak()
+
+    with PeakRSSMonitor() as monitor:
+        tracemalloc.start()
+        try:
+            segment_watershed(image, engine=engine, progress=progress)
+        finally:
+            tracemalloc.stop()
+    return peaks, monitor.peak - monitor.baseline
+
+
+def time_display(image, repeat):
+    """Tempo de Funcionalidades.display_image num ImageViewer offscreen de 1200x500.
+
+    A primeira exibição monta a pirâmide; as seguintes medem a repintura.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from core.funcionalidades import Funcionalidades
+    from core.visualizador import ImageViewer
+
+    app = QApplication.instance() or QApplication([])
+
+    target = SimpleNamespace(image_label=ImageViewer())
+    target.image_label.resize(1200, 500)
+    target.image_label.show()
+    funcionalidades = Funcionalidades()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        funcionalidades.display_image(target, image)
+        app.processEvents()
+        times.append(time.perf_counter() - start)
+    return times[0], min(times[1:], default=times[0])
+
+
+VELOCITY_CALLS = 10000
+
+
+def time_velocity(calls=VELOCITY_CALLS):
+    """Tempo total de `calls` chamadas de Funcionalidades.energy_and_velocity."""
+    from core.funcionalidades import Funcionalidades
+
+    rng = np.random.default_rng(0)
+    deformations = rng.uniform(5, 80, calls)
+    masses = rng.uniform(800, 3000, calls)
+    start = time.perf_counter()
+    for deformation, mass in zip(deformations, masses):
+        Funcionalidades.energy_and_velocity(deformation, mass)
+    return time.perf_counter() - start
+
+
+def time_velocity_batch(calls=VELOCITY_CALLS):
+    """Tempo de core.velocidade.energy_and_velocity sobre `calls` casos de uma vez."""
+    from core.velocidade import energy_and_velocity
+
+    rng = np.random.default_rng(0)
+    deformations = rng.uniform(5, 80, calls)
+    masses = rng.uniform(800, 3000, calls)
+    classes = rng.choice(np.array(["Sedan", "Caminhonete", ""], dtype=object), calls)
+    start = time.perf_counter()
+    energy_and_velocity(deformations, masses, classes)
+    return time.perf_counter() - start
+
+
+def run_case(name, image, engine, repeat):
+    stage_seconds, total_seconds = time_stages(image, engine, repeat)
+    stage_peaks, run_rss = memory_stages(image, engine)
+    display_seconds, redraw_seconds = time_display(image, max(repeat, 2))
+    return {
+        "shape": list(image.shape),
+        "total_seconds": total_seconds,
+        "run_rss": run_rss,
+        "display_seconds": display_seconds,
+        "redraw_seconds": redraw_seconds,
+        "stages": {
+            title: {"seconds": stage_seconds[title], "peak_bytes": stage_peaks.get(title, 0)}
+            for title in stage_seconds
+        },
+    }
+
+
+def run_suite(image_dir=DEFAULT_IMAGE_DIR, synthetic=(), engine="reconstruction",
+              repeat=3, log=print):
+    # aquecimento: importações sob demanda e caches das bibliotecas não
+    # devem cair na conta da primeira imagem
+    warmup = np.zeros((64, 64, 3), np.uint8)
+    warmup[16:48, 16:48] = 255
+    segment_watershed(warmup, engine=engine)
+    time_display(warmup, 1)
+
+    cases = {}
+    for path in list_images(image_dir):
+        name = os.path.basename(path)
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        log(f"{name} {image.shape[1]}x{image.shape[0]}")
+        cases[name] = run_case(name, image, engine, repeat)
+    for name in synthetic:
+        image = synthetic_image(name, image_dir)
+        log(f"sintética {name} {image.shape[1]}x{image.shape[0]}")
+        # imagens grandes: uma repetição basta e evita minutos de espera
+        cases[name] = run_case(name, image, engine, 1 if image.size > 3e7 else repeat)
+        del image
+
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+            "engine": engine,
+            "repeat": repeat,
+        },
+        "velocity_calls": VELOCITY_CALLS,
+        "velocity_seconds": time_velocity(),
+        "velocity_batch_seconds": time_velocity_batch(),
+        "cases": cases,
+    }
+
+
+def flatten(results):
+    """Métricas comparáveis como {"caso/métrica": (valor, tipo)}."""
+    metrics = {"velocity/seconds": (results["velocity_seconds"], "time")}
+    if "velocity_batch_seconds" in results:
+        metrics["velocity/batch"] = (results["velocity_batch_seconds"], "time")
+    for case, data in results["cases"].items():
+        metrics[f"{case}/total"] = (data["total_seconds"], "time")
+        metrics[f"{case}/display"] = (data["display_seconds"], "time")
+        if "redraw_seconds" in data:
+            metrics[f"{case}/redraw"] = (data["redraw_seconds"], "time")
+        metrics[f"{case}/rss"] = (data["run_rss"], "memory")
+        for title, stage in data["stages"].items():
+            metrics[f"{case}/{title}"] = (stage["seconds"], "time")
+            metrics[f"{case}/{title} (memória)"] = (stage["peak_bytes"], "memory")
+    return metrics
+
+
+def compare(results, baseline, time_threshold=0.15, memory_threshold=0.10):
+    """Lista de (métrica, base, atual, variação) que pioraram além do limite."""
+    current = flatten(results)
+    regressions = []
+    for key, (base_value, kind) in flatten(baseline).items():
+        if key not in current:
+            continue
+        value = current[key][0]
+        if kind == "time":
+            threshold, floor = time_threshold, MIN_SECONDS
+        else:
+            threshold, floor = memory_threshold, MIN_BYTES
+        if max(base_value, value) < floor:
+            continue
+        change = (value - base_value) / base_value if base_value else float("inf")
+        if change > threshold:
+            regressions.append((key, base_value, value, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline do SmashMetrics.")
+    parser.add_argument("--images", default=DEFAULT_IMAGE_DIR,
+                        help="pasta das imagens reais (padrão: Banco de dados PDI)")
+    parser.add_argument("--synthetic", nargs="*", default=[], choices=SYNTHETIC_SIZES,
+                        help="imagens sintéticas a incluir (4k, 8k, 50mp)")
+    parser.add_argument("-e", "--engine", choices=[*ENGINES, AUTO_ENGINE], default="reconstruction")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-o", "--output", default=None, help="grava os resultados em JSON")
+    parser.add_argument("--baseline", default=None,
+                        help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--time-threshold", type=float, default=0.15,
+                        help="piora relativa de tempo tolerada (padrão: 0.15)")
+    parser.add_argument("--memory-threshold", type=float, default=0.10,
+                        help="piora relativa de memória tolerada (padrão: 0.10)")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.images, args.synthetic, args.engine, args.repeat)
+    for case, data in results["cases"].items():
+        print(f"{case:<12} total {data['total_seconds'] * 1000:9.1f} ms  "
+              f"display {data['display_seconds'] * 1000:7.1f} ms  "
+              f"redraw {data['redraw_seconds'] * 1000:6.1f} ms  "
+              f"RSS +{data['run_rss'] / 2 ** 20:7.1f} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Resultados gravados em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_threshold,
+                              args.memory_threshold)
+        for key, base_value, value, change in regressions:
+            print(f"REGRESSÃO {key}: {base_value:.6g} -> {value:.6g} ({change:+.0%})")
+        if regressions:
+            return 1
+        print("Nenhuma regressão em relação à linha de base.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
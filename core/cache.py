@@ -0,0 +1,167 @@
+"""Cache endereçado por conteúdo das etapas do pipeline de segmentação.
+
+As chaves são hashes da imagem de entrada e dos parâmetros de cada etapa e
+das etapas anteriores (ver core.segmentacao.cached_stage). A camada em
+memória é um LRU limitado em bytes; a camada em disco, opcional, guarda cada
+etapa num arquivo .npy para que um caso reaberto não recalcule nada.
+
+O disco é só um acelerador: qualquer falha de leitura ou escrita (disco
+cheio, arquivo removido por outro processo no meio do corte) é ignorada e a
+etapa é recalculada. Vários processos podem dividir o mesmo diretório.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, (bytes, memoryview)) else repr(part).encode())
+    return h.hexdigest()
+
+
+class StageCache:
+    def __init__(self, max_bytes=512 * 2 ** 20, disk_dir=None, disk_max_bytes=4 * 2 ** 30):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = None  # tamanho do diretório, varrido só quando preciso
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def image_key(image):
+        """Hash do conteúdo, da forma e do tipo de um array."""
+        image = np.ascontiguousarray(image)
+        return _digest(image.shape, image.dtype.str, memoryview(image).cast("B"))
+
+    @staticmethod
+    def key(name, deps, params):
+        return _digest(name, list(deps), sorted(params.items()))
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = self._load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._store(key, value)
+        return value
+
+    def put(self, key, value):
+        # os arrays guardados são compartilhados entre execuções: nunca
+        # devem ser alterados no lugar
+        value.setflags(write=False)
+        self._store(key, value)
+        self._save(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _store(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = value
+            self._bytes += value.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + ".npy")
+
+    def _load(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            value = np.load(path, allow_pickle=False)
+            os.utime(path)  # marca como usado recentemente
+        except (OSError, ValueError):
+            return None
+        value.setflags(write=False)
+        return value
+
+    def _save(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        # nome próprio por processo e thread: duas gravações da mesma etapa
+        # não escrevem no mesmo temporário
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, value, allow_pickle=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += size
+            over = self._disk_bytes is None or self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """Varre o diretório e apaga os arquivos menos usados além do limite.
+
+        O total fica guardado e é somado a cada gravação, então a varredura
+        só se repete quando ele passa do limite (ou outro processo mexeu no
+        diretório e a conta ficou alta demais, o que só adianta um corte).
+        """
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.disk_dir) as scan:
+                for entry in scan:
+                    if entry.name.endswith(".npy"):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+        except OSError:
+            return
+        entries.sort()
+        while total > self.disk_max_bytes and entries:
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
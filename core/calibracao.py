@@ -0,0 +1,314 @@
+"""Calibração automática da escala (cm/px) por um alvo de tamanho conhecido na foto.
+
+Alvos aceitos (ver aruco_target e checkerboard_target):
+- marcador ArUco/AprilTag de lado conhecido: cada lado de cada marcador
+  detectado vira uma medição de escala;
+- tabuleiro de xadrez com `pattern` cantos internos e casas de lado
+  conhecido: cada par de cantos vizinhos vira uma medição.
+
+A detecção roda numa cópia reduzida (lado maior DETECT_MAX_SIDE) e só os
+cantos encontrados são refinados na resolução total com cornerSubPix, então
+uma foto de 50 MP custa pouco mais que uma de 2 MP. As medições individuais
+vão para `scale_factors`, como as três da calibração manual, e alimentam a
+propagação de incerteza (core.incerteza).
+
+Os resultados ficam num CalibrationCache em disco, por arquivo (hash do
+conteúdo) e por câmera/sessão (EXIF da câmera, tamanho da imagem e pasta):
+uma foto da mesma sessão em que o alvo não aparece herda a última escala
+detectada ali.
+
+Uso:
+    python -m core.calibracao "Banco de dados PDI" --aruco 10 -o escalas.csv
+    python -m core.calibracao fotos --checkerboard 9x6 --square 2.5
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from core.importacao import as_bgr8, file_hash, fit_preview
+
+CALIBRATION_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".smashmetrics", "cache",
+                                     "calibracao")
+DETECT_MAX_SIDE = 2000
+DEFAULT_DICTIONARY = "DICT_4X4_50"
+DEFAULT_PATTERN = (9, 6)
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 40, 0.01)
+
+
+def aruco_target(size_cm, dictionary=DEFAULT_DICTIONARY):
+    """Alvo ArUco/AprilTag (ex.: "DICT_APRILTAG_36h11") com lado de `size_cm` cm."""
+    if not hasattr(cv2.aruco, dictionary):
+        raise ValueError(f"Dicionário ArUco desconhecido: {dictionary}")
+    return {"kind": "aruco", "dictionary": dictionary, "size_cm": float(size_cm)}
+
+
+def checkerboard_target(size_cm, pattern=DEFAULT_PATTERN):
+    """Tabuleiro com `pattern` = (colunas, linhas) cantos internos e casas de `size_cm` cm."""
+    return {"kind": "checkerboard", "pattern": tuple(int(n) for n in pattern),
+            "size_cm": float(size_cm)}
+
+
+def describe_target(target):
+    if target["kind"] == "aruco":
+        return f"marcador {target['dictionary']} de {target['size_cm']:g} cm"
+    cols, rows = target["pattern"]
+    return f"tabuleiro {cols}x{rows} com casas de {target['size_cm']:g} cm"
+
+
+def _refine(gray, corners, factor):
+    """Leva cantos achados na cópia reduzida à resolução total, com precisão subpixel."""
+    corners = (corners.reshape(-1, 1, 2) + 0.5) * factor - 0.5
+    window = max(3, int(round(2 * factor)) + 2)
+    return cv2.cornerSubPix(gray, corners.astype(np.float32), (window, window), (-1, -1),
+                            SUBPIX_CRITERIA).reshape(-1, 2)
+
+
+def detect_target(image, target, max_side=DETECT_MAX_SIDE):
+    """Procura o alvo em `image` e mede a escala.
+
+    Retorna None se o alvo não for encontrado ou um dicionário com
+    `scale_factor` (média), `scale_factors` (medições individuais),
+    `detections` (marcadores ou tabuleiros achados) e `corners` (cantos
+    refinados, em pixels da imagem).
+    """
+    gray = cv2.cvtColor(as_bgr8(image), cv2.COLOR_BGR2GRAY)
+    small = fit_preview(gray, max_side)
+    factor = gray.shape[1] / small.shape[1]
+
+    if target["kind"] == "aruco":
+        dictionary = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, target["dictionary"]))
+        detector = cv2.aruco.ArucoDetector(dictionary, cv2.aruco.DetectorParameters())
+        found, ids, _ = detector.detectMarkers(small)
+        if ids is None or not len(found):
+            return None
+        corners = _refine(gray, np.concatenate(found), factor).reshape(-1, 4, 2)
+        # os quatro lados de cada marcador
+        sides = np.linalg.norm(np.roll(corners, -1, axis=1) - corners, axis=2)
+        detections = len(ids)
+    elif target["kind"] == "checkerboard":
+        ok, found = cv2.findChessboardCornersSB(small, target["pattern"])
+        if not ok:
+            return None
+        cols, rows = target["pattern"]
+        corners = _refine(gray, found, factor).reshape(rows, cols, 2)
+        sides = np.concatenate([
+            np.linalg.norm(np.diff(corners, axis=1), axis=2).ravel(),
+            np.linalg.norm(np.diff(corners, axis=0), axis=2).ravel(),
+        ])
+        detections = 1
+    else:
+        raise ValueError(f"Tipo de alvo desconhecido: {target['kind']}")
+
+    scale_factors = target["size_cm"] / sides.ravel()
+    return {
+        "scale_factor": float(scale_factors.mean()),
+        "scale_factors": scale_factors.tolist(),
+        "detections": detections,
+        "corners": corners.reshape(-1, 2),
+    }
+
+
+def camera_key(path, shape):
+    """Identifica a câmera/sessão de uma foto: EXIF (se houver), tamanho e pasta."""
+    camera = ()
+    try:
+        from PIL import Image
+        with Image.open(path) as photo:
+            exif = photo.getexif()
+            focal = exif.get_ifd(0x8769).get(0x920A)
+            camera = (exif.get(0x010F), exif.get(0x0110), str(focal) if focal else None)
+    except (ImportError, OSError):
+        pass
+    session = os.path.dirname(os.path.abspath(path))
+    return hashlib.blake2b(repr((camera, tuple(shape[:2]), session)).encode(),
+                           digest_size=16).hexdigest()
+
+
+def _target_key(target):
+    return hashlib.blake2b(repr(sorted(target.items())).encode(), digest_size=8).hexdigest()
+
+
+class CalibrationCache:
+    """Calibrações em JSON no disco, por arquivo e por câmera/sessão."""
+
+    def __init__(self, disk_dir=CALIBRATION_CACHE_DIR):
+        self.disk_dir = disk_dir
+        os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, kind, key, target):
+        return os.path.join(self.disk_dir, f"{kind}_{key}_{_target_key(target)}.json")
+
+    def get(self, kind, key, target):
+        try:
+            with open(self._path(kind, key, target), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, kind, key, target, entry):
+        path = self._path(kind, key, target)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+
+def calibrate(image, target, path=None, cache=None, image_key=None, progress=None):
+    """Calibra `image` pelo alvo, usando e alimentando `cache` quando há `path`.
+
+    `image_key` é o hash do arquivo, se já conhecido (ex.: LazyImage.key).
+    Retorna None se o alvo não for achado nem houver calibração da mesma
+    câmera/sessão; senão, o dicionário de detect_target (sem `corners` quando
+    vem do cache) com `source`: "detectado", "cache" ou "sessão".
+    """
+    use_cache = cache is not None and path is not None
+    if use_cache:
+        image_key = image_key or file_hash(path)
+        entry = cache.get("imagem", image_key, target)
+        if entry is not None:
+            return {**entry, "source": "cache"}
+    if progress:
+        progress(1, 2, "Procurando o alvo de calibração")
+
+    result = detect_target(image, target)
+    if progress:
+        progress(2, 2, "Medindo a escala")
+    if not use_cache:
+        return None if result is None else {**result, "source": "detectado"}
+
+    session_key = camera_key(path, image.shape)
+    if result is None:
+        entry = cache.get("sessao", session_key, target)
+        return None if entry is None else {**entry, "source": "sessão"}
+    entry = {key: result[key] for key in ("scale_factor", "scale_factors", "detections")}
+    cache.put("imagem", image_key, target, entry)
+    cache.put("sessao", session_key, target, entry)
+    return {**result, "source": "detectado"}
+
+
+def detect_file(path, target):
+    """detect_target de um arquivo, sem os cantos; executado nos workers."""
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Falha ao carregar a imagem {path}")
+    result = detect_target(image, target)
+    if result is not None:
+        del result["corners"]
+    return image.shape, result
+
+
+def calibrate_batch(image_paths, target, workers=None, cache=None):
+    """Calibra vários arquivos; retorna uma lista de (caminho, resultado ou None).
+
+    A detecção roda em paralelo e o cache é consultado e gravado só no
+    processo principal, na ordem dos arquivos, para que as fotos sem alvo
+    herdem a escala da foto anterior da mesma sessão.
+    """
+    results = {}
+    pending = []
+    keys = {}
+    for path in image_paths:
+        if cache is not None:
+            keys[path] = file_hash(path)
+            entry = cache.get("imagem", keys[path], target)
+            if entry is not None:
+                results[path] = {**entry, "source": "cache"}
+                continue
+        pending.append(path)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        detected = dict(zip(pending, executor.map(detect_file, pending,
+                                                  [target] * len(pending))))
+
+    session = {}
+    for path in image_paths:
+        if path in results:
+            continue
+        shape, result = detected[path]
+        session_key = camera_key(path, shape)
+        if result is not None:
+            result["source"] = "detectado"
+            session[session_key] = result
+            if cache is not None:
+                entry = {key: result[key] for key in ("scale_factor", "scale_factors",
+                                                      "detections")}
+                cache.put("imagem", keys[path], target, entry)
+                cache.put("sessao", session_key, target, entry)
+        elif session_key in session:
+            result = {**session[session_key], "source": "sessão"}
+        elif cache is not None:
+            entry = cache.get("sessao", session_key, target)
+            result = None if entry is None else {**entry, "source": "sessão"}
+        results[path] = result
+    return [(path, results[path]) for path in image_paths]
+
+
+def main(argv=None):
+    from core.lote import expand_inputs
+
+    parser = argparse.ArgumentParser(
+        description="Calibração automática da escala por um alvo de tamanho conhecido."
+    )
+    parser.add_argument("inputs", nargs="+", help="imagens ou pastas de imagens")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--aruco", type=float, metavar="CM",
+                       help="lado do marcador ArUco/AprilTag, em cm")
+    group.add_argument("--checkerboard", metavar="COLxLIN",
+                       help="cantos internos do tabuleiro, ex.: 9x6")
+    parser.add_argument("--dictionary", default=DEFAULT_DICTIONARY,
+                        help=f"dicionário do marcador (padrão: {DEFAULT_DICTIONARY})")
+    parser.add_argument("--square", type=float, default=None, metavar="CM",
+                        help="lado de cada casa do tabuleiro, em cm")
+    parser.add_argument("-o", "--output", default=None, help="CSV com a escala de cada imagem")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="número de processos (padrão: número de núcleos)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="não consulta nem grava o cache de calibrações")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.aruco:
+            target = aruco_target(args.aruco, args.dictionary)
+        else:
+            if not args.square:
+                parser.error("--checkerboard requer --square")
+            pattern = tuple(int(n) for n in args.checkerboard.lower().split("x"))
+            target = checkerboard_target(args.square, pattern)
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+
+    image_paths = expand_inputs(args.inputs)
+    cache = None if args.no_cache else CalibrationCache()
+    results = calibrate_batch(image_paths, target, args.workers, cache)
+
+    rows = []
+    for path, result in results:
+        if result is None:
+            print(f"{os.path.basename(path)}: alvo não encontrado")
+            rows.append([path, "", "", "", "não encontrado"])
+            continue
+        spread = np.std(result["scale_factors"], ddof=1) if len(result["scale_factors"]) > 1 else 0.0
+        print(f"{os.path.basename(path)}: {result['scale_factor']:.5f} cm/px "
+              f"(desvio {spread:.5f}, {len(result['scale_factors'])} medições, {result['source']})")
+        rows.append([path, f"{result['scale_factor']:.6f}", f"{spread:.6f}",
+                     len(result["scale_factors"]), result["source"]])
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["imagem", "scale_factor", "desvio", "medicoes", "origem"])
+            writer.writerows(rows)
+    found = sum(result is not None for _, result in results)
+    print(f"{found}/{len(results)} imagens calibradas ({describe_target(target)})")
+    return 0 if found == len(results) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
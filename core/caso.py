@@ -0,0 +1,159 @@
+"""Arquivo de caso (.smcase): imagens, etapas, rótulos, calibração e relatório num só arquivo.
+
+Formato:
+- cabeçalho fixo: MAGIC, deslocamento e tamanho do índice;
+- um bloco por array, alinhado a ALIGNMENT bytes;
+- no fim, o índice em JSON com o tipo, a forma e a posição de cada array e
+  os metadados do caso (calibração, perfil, relatório...).
+
+Imagens e etapas ficam sem compressão, para que CaseFile.array as devolva
+como np.memmap: abrir um caso de 50 MP com todas as etapas só lê o índice,
+e cada página da imagem só sai do disco quando é exibida ou processada. O
+mapa de rótulos vai no menor tipo inteiro que comporta o maior rótulo,
+comprimido com zlib em faixas de linhas independentes (comprimidas e
+descomprimidas em paralelo) e só é descomprimido no primeiro acesso.
+"""
+import json
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+CASE_EXTENSION = ".smcase"
+MAGIC = b"SMCASE\x00\x01"
+HEADER = struct.Struct("<8sQQ")
+ALIGNMENT = 64
+BAND_ROWS = 512
+COMPRESSION_LEVEL = 1
+
+
+def compact_labels(labels):
+    """Converte um mapa de rótulos para o menor tipo sem sinal que comporta o maior rótulo."""
+    top = int(labels.max()) if labels.size else 0
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if top <= np.iinfo(dtype).max:
+            return labels.astype(dtype, copy=False)
+    return labels
+
+
+def _write_aligned(f, data):
+    f.write(b"\x00" * (-f.tell() % ALIGNMENT))
+    offset = f.tell()
+    f.write(data)
+    return offset
+
+
+def save_case(path, arrays, meta=None, compressed=("labels",), workers=None,
+              progress=None):
+    """Grava `arrays` (nome -> ndarray) e `meta` (JSON) num arquivo de caso.
+
+    Os arrays em `compressed` são comprimidos em faixas; os demais ficam
+    crus, prontos para mmap. O mesmo objeto passado com dois nomes (ex.: uma
+    etapa que é a própria imagem original) é gravado uma vez só. A gravação
+    vai para um arquivo temporário que só substitui `path` no fim, então um
+    caso existente nunca fica pela metade.
+    """
+    index = {"version": 1, "arrays": {}, "meta": meta or {}}
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f, ThreadPoolExecutor(max_workers=workers) as executor:
+            f.write(HEADER.pack(MAGIC, 0, 0))
+            _write_arrays(f, executor, arrays, compressed, index["arrays"], progress)
+            payload = json.dumps(index).encode("utf-8")
+            index_offset = _write_aligned(f, payload)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, index_offset, len(payload)))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def _write_arrays(f, executor, arrays, compressed, entries, progress):
+    written = {}
+    items = [(name, array) for name, array in arrays.items() if array is not None]
+    for i, (name, original) in enumerate(items, start=1):
+        if id(original) in written:
+            entries[name] = entries[written[id(original)]]
+            continue
+        written[id(original)] = name
+        array = np.ascontiguousarray(original)
+        entry = {"dtype": array.dtype.str, "shape": list(array.shape)}
+        if name in compressed:
+            # o zlib libera o GIL: as faixas são comprimidas em paralelo
+            bands = [array[top:top + BAND_ROWS]
+                     for top in range(0, max(len(array), 1), BAND_ROWS)]
+            chunks = executor.map(
+                lambda band: zlib.compress(memoryview(band).cast("B"), COMPRESSION_LEVEL),
+                bands)
+            entry["codec"] = "zlib"
+            entry["bands"] = [[_write_aligned(f, chunk), len(chunk), len(band)]
+                              for band, chunk in zip(bands, chunks)]
+        else:
+            entry["codec"] = "raw"
+            entry["offset"] = _write_aligned(f, memoryview(array).cast("B"))
+        entries[name] = entry
+        if progress:
+            progress(i, len(items), f"Gravando {name}")
+
+
+class CaseFile:
+    """Caso aberto para leitura: só o índice é lido ao abrir.
+
+    `array(nome)` devolve um np.memmap somente leitura para os arrays crus e
+    o array descomprimido (guardado para os próximos acessos) para os
+    comprimidos.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, index_offset, index_length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} não é um arquivo de caso do SmashMetrics")
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length).decode("utf-8"))
+        self.entries = index["arrays"]
+        self.meta = index["meta"]
+        self._decoded = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    @property
+    def names(self):
+        return list(self.entries)
+
+    def array(self, name):
+        entry = self.entries[name]
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        if entry["codec"] == "raw":
+            if not np.prod(shape):
+                return np.empty(shape, dtype)
+            return np.memmap(self.path, dtype=dtype, mode="r", offset=entry["offset"],
+                             shape=shape)
+        with self._lock:
+            if name not in self._decoded:
+                self._decoded[name] = self._decompress(entry, dtype, shape)
+            return self._decoded[name]
+
+    def _decompress(self, entry, dtype, shape):
+        array = np.empty(shape, dtype)
+        flat = array.reshape(shape[0], -1) if shape else array.reshape(1, -1)
+        starts = np.cumsum([0] + [rows for _, _, rows in entry["bands"]])
+
+        def decode(i):
+            offset, length, rows = entry["bands"][i]
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = zlib.decompress(f.read(length))
+            flat[starts[i]:starts[i] + rows] = np.frombuffer(data, dtype).reshape(rows, -1)
+
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(decode, range(len(entry["bands"]))))
+        return array
@@ -1,16 +1,96 @@
+import functools
+import os
+import sqlite3
+import struct
+from datetime import datetime
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 from PySide6.QtWidgets import QFileDialog, QMessageBox, QInputDialog
-from PySide6.QtGui import QImage, QPixmap, Qt
-from scipy.ndimage import distance_transform_edt
-from skimage import morphology, measure, segmentation, filters, color
-from scipy import ndimage as ndi
+from core.tarefas import Worker
+from core.cache import StageCache
+from core.importacao import ThumbnailCache, open_image
+from core.medicao import pick_points
+from core.incerteza import propagate, format_uncertainty
+from core.velocidade import energy_and_velocity as compute_energy_and_velocity, energy_coefficient
+from core.perfil import crush_profile, draw_crush_profile, format_crush_profile
+from core.calibracao import CalibrationCache, calibrate, describe_target
+from core.retificacao import RectificationCache, rectangle_points, rectify, setup_for
+from core.caso import CASE_EXTENSION, CaseFile, compact_labels, save_case
+from core.relatorio import render_report
+from core.banco import CaseIndex, format_summary
+from core.instrumentacao import instrumentation, StageAggregator, JsonLinesSink, trace_allocations
+
+# Cache persistente das etapas da segmentação (ver core.cache)
+STAGE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".smashmetrics", "cache", "etapas")
+
+# Tempos por etapa acumulados na sessão, exibidos na tela de Relatório
+stage_profile = instrumentation.add_sink(StageAggregator())
+if os.environ.get("SMASHMETRICS_PROFILE_LOG"):
+    instrumentation.add_sink(JsonLinesSink(os.environ["SMASHMETRICS_PROFILE_LOG"]))
+if os.environ.get("SMASHMETRICS_TRACEMALLOC"):
+    trace_allocations()
+# Tempos por etapa da imagem atual, gravados com a análise no banco de casos
+case_profile = instrumentation.add_sink(StageAggregator())
+PROFILE_HEADER = "**Perfil de Desempenho por Etapa**"
+CASES_HEADER = "**Resumo do Banco de Casos**"
+
+
+def segment_image(image, original, cache=None, pyramid=False, engine="reconstruction",
+                  **kwargs):
+    """Watershed (ou pirâmide) importando scipy/scikit-image só na primeira segmentação.
+
+    Roda na thread da tarefa; normalmente core.inicializacao.preload já
+    importou os módulos em segundo plano.
+    """
+    from core.segmentacao import segment_watershed
+    segment = functools.partial(segment_watershed, cache=cache, engine=engine)
+    if pyramid:
+        from core.piramide import segment_pyramid
+        return segment_pyramid(image, original, segment=segment, **kwargs)
+    # marcadores e gradiente ficam para o editor de marcadores
+    return segment(image, original, keep_surface=True, **kwargs)
+
+
+def marker_editor(labels, markers, gradient, original, progress=None):
+    """core.marcadores.MarkerEditor montado na thread da tarefa (desenha o overlay inteiro)."""
+    from core.marcadores import MarkerEditor
+    return MarkerEditor(labels, markers, gradient, original)
+
+
+def stored_overlay(labels_path, load_image, progress=None):
+    """Rótulos gravados no banco de casos e o overlay deles sobre a imagem de `load_image()`.
+
+    Retorna None se o arquivo sumiu ou não tem o tamanho da imagem.
+    """
+    if labels_path.endswith(".npy"):
+        labels = np.load(labels_path) if os.path.exists(labels_path) else None
+    else:
+        labels = cv2.imread(labels_path, cv2.IMREAD_UNCHANGED)
+    image = load_image()
+    if labels is None or labels.shape != image.shape[:2]:
+        return None
+    from core.segmentacao import draw_boundaries
+
+    labels = labels.astype(np.int32)
+    return labels, draw_boundaries(image, labels)
+
+
+def same_file(a, b):
+    """Se os dois caminhos são o mesmo arquivo (False se algum não existe)."""
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
 
 
 class Funcionalidades:
     def __init__(self):
         self.scale_factor = None
+        self.stage_cache = StageCache(disk_dir=STAGE_CACHE_DIR)
+        self.thumbnails = ThumbnailCache()
+        self.calibrations = CalibrationCache()
+        self.rectifications = RectificationCache()
+        self.case_index = CaseIndex()
 
     def import_image(self, ui):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -18,17 +98,89 @@ class Funcionalidades:
             "Imagens (*.png *.jpg *.bmp *.tiff)"
         )
         if file_path:
-            ui.original_image = cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
-            if ui.original_image is not None:
-                self.display_image(ui, ui.original_image)
+            with instrumentation.measure("Importar imagem") as measured:
+                source = open_image(file_path, self.thumbnails)
+                measured.output = source.preview if source is not None else None
+            if source is not None:
+                case_profile.clear()
+                ui.set_image_source(source)
+                ui.image_hash = source.key
+                self.display_image(ui, source.preview)
                 ui.remove_image_button.setEnabled(True)
+                try:
+                    record = self.case_index.find(source.key)
+                except (sqlite3.Error, ValueError, OSError):
+                    # banco de casos travado, corrompido ou de uma versão mais
+                    # nova: a imagem é importada sem procurar análises anteriores
+                    record = None
+                if record is not None:
+                    self.restore_analysis(ui, record, source)
+                    return
                 QMessageBox.information(
                     ui, "Imagem Importada",
                     f"Imagem {file_path} carregada com sucesso."
                 )
+                if ui.rectify_checkbox.isChecked():
+                    self.rectify_image(ui)
             else:
                 QMessageBox.warning(ui, "Erro", "Falha ao carregar a imagem.")
 
+    def restore_analysis(self, ui, record, source):
+        """Mostra a última análise da imagem registrada no banco de casos, sem recalcular.
+
+        Uma análise feita na vista retificada tem escala, medidas e rótulos
+        dessa vista: eles só são restaurados depois que a imagem é
+        retificada de novo.
+        """
+        ui.show_selected_stiffness(record["stiffness"])
+        target = record["calibration_target"]
+        if target is not None and "pattern" in target:
+            target["pattern"] = tuple(target["pattern"])
+        ui.show_calibration_target(target)
+        ui.report_text.setPlainText(record["report"] or "")
+        when = datetime.fromtimestamp(record["created_at"]).strftime("%d/%m/%Y %H:%M")
+        QMessageBox.information(
+            ui, "Imagem Importada",
+            f"Esta imagem já foi analisada em {when}.\n"
+            f"Resultados restaurados do banco de casos: {record['deformation_cm']:.2f} cm, "
+            f"{record['velocity_kmh']:.2f} km/h.\n"
+            "Segmente de novo para refazer a análise."
+            + ("\nA análise foi feita na vista retificada: a imagem será retificada de novo."
+               if record["rectified"] else "")
+        )
+        if record["rectified"]:
+            self.rectify_image(ui, then=lambda: self.restore_measurements(
+                ui, record, lambda image=ui.original_image: image))
+        else:
+            self.restore_measurements(ui, record, source.load)
+
+    def restore_measurements(self, ui, record, load_image):
+        """Escala, deformação, perfil e segmentação de uma análise do banco de casos.
+
+        Numa análise retificada, a escala é a da retificação que acabou de
+        ser refeita (ver restore_analysis).
+        """
+        if not record["rectified"]:
+            ui.scale_factor = record["scale_factor"]
+            ui.scale_factors = record["scale_factors"]
+        ui.deformation_pixels = record["deformation_px"]
+        profile = record["crush_profile"]
+        if profile is not None:
+            profile = {key: np.asarray(value) if isinstance(value, list) else value
+                       for key, value in profile.items()}
+        ui.crush_profile = profile
+        if record["labels_path"]:
+            worker = Worker(stored_overlay, record["labels_path"], load_image)
+            ui.start_task(worker, "Restaurando a segmentação",
+                          lambda result: self.on_overlay_restored(ui, result))
+
+    def on_overlay_restored(self, ui, result):
+        if result is None:
+            return
+        ui.labels, ui.processed_image = result
+        ui.surface = None
+        self.display_image(ui, ui.processed_image, keep_view=True)
+
     def remove_image(self, ui):
         ui.original_image = None
         ui.processed_image = None
@@ -37,34 +189,23 @@ class Funcionalidades:
         ui.remove_image_button.setEnabled(False)
         QMessageBox.information(ui, "Remoção", "Imagem removida com sucesso.")
 
-    def display_image(self, ui, image):
-        if len(image.shape) == 2:
-            height, width = image.shape
-            bytes_per_line = width
-            q_image = QImage(image.data, width, height,
-                             bytes_per_line, QImage.Format_Grayscale8)
-        else:
-            height, width, channel = image.shape
-            bytes_per_line = 3 * width
-            q_image = QImage(image.data, width, height,
-                             bytes_per_line, QImage.Format_BGR888)
-
-        pixmap = QPixmap.fromImage(q_image)
-        ui.image_label.setPixmap(
-            pixmap.scaled(ui.image_label.size(),
-                          Qt.KeepAspectRatio,
-                          Qt.SmoothTransformation)
-        )
-
+    def display_image(self, ui, image, keep_view=False):
+        with instrumentation.measure("Exibir imagem") as measured:
+            ui.image_label.set_image(image, keep_view)
+            ui.image_label.repaint()
+            measured.output = image
 
     def convert_to_gray(self, ui):
         if ui.original_image is not None:
-            if len(ui.original_image.shape) == 3:
-                gray_image = cv2.cvtColor(ui.original_image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray_image = ui.original_image
+            with instrumentation.measure("Converter para cinza") as measured:
+                if len(ui.original_image.shape) == 3:
+                    gray_image = cv2.cvtColor(ui.original_image, cv2.COLOR_BGR2GRAY)
+                else:
+                    gray_image = ui.original_image
 
-            gray_image = cv2.normalize(gray_image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+                gray_image = cv2.normalize(gray_image, None, 0, 255, cv2.NORM_MINMAX,
+                                           dtype=cv2.CV_8U)
+                measured.output = gray_image
 
             ui.processed_image = gray_image
             self.display_image(ui, gray_image)
@@ -75,163 +216,199 @@ class Funcionalidades:
         else:
             QMessageBox.warning(ui, "Erro", "Nenhuma imagem carregada.")
 
+    @staticmethod
     def imposemin(img, minima):
-        marker = np.full(img.shape, np.inf)
-        marker[minima == 1] = 0
-        mask = np.minimum(img + 1, marker)
-        return morphology.reconstruction(marker, mask, method='erosion')
+        from core.segmentacao import imposemin
+        return imposemin(img, minima)
 
     def apply_watershed(self, ui):
         if ui.processed_image is not None:
-            try:
-                ############################################################
-                # 1. carregar a imagem e converter para escala de cinza
-                ############################################################
-                if len(ui.processed_image.shape) == 3:
-                    gray = cv2.cvtColor(ui.processed_image, cv2.COLOR_BGR2GRAY)
-                else:
-                    gray = ui.processed_image.copy()
-                cv2.imshow("1. Imagem em Escala de Cinza", gray)
-                cv2.waitKey(0)
-
-                ############################################################
-                # 2. aplicar filtro Gaussiano (Kernel 3x3, sigma=1)
-                ############################################################
-                blurred = cv2.GaussianBlur(gray, (7, 7), 3)
-                cv2.imshow("2. Filtro Gaussiano", blurred)
-                cv2.waitKey(0)
-
-                ############################################################
-                # 3. binarização com Otsu invertida
-                ############################################################
-                _, binary = cv2.threshold(blurred, 0, 255,
-                                          cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-                cv2.imshow("3. Binarização Invertida", binary)
-                cv2.waitKey(0)
-
-                ############################################################
-                # 4. remoção de ruído com abertura morfológica
-                ############################################################
-                se_disk = morphology.disk(1)
-                opening_bool = morphology.opening(binary.astype(bool), se_disk)
-                opening = opening_bool.astype(np.uint8) * 255
-                cv2.imshow("4. Abertura Morfológica", opening)
-                cv2.waitKey(0)
-
-                ############################################################
-                # 5. determinar área de fundo (sure background) por dilatação (3 iterações)
-                ############################################################
-                opening_uint8 = opening_bool.astype(np.uint8) * 255
-                kernel_cv2 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-                sure_bg = cv2.dilate(opening_uint8, kernel_cv2, iterations=1)
-                sure_bg = cv2.dilate(sure_bg, kernel_cv2, iterations=1)
-                sure_bg = cv2.dilate(sure_bg, kernel_cv2, iterations=1)
-                cv2.imshow("5. Área de Fundo (Dilatação)", sure_bg)
-                cv2.waitKey(0)
-
-                ############################################################
-                # 6. Calcular a transformada de distância e definir o foreground seguro
-                ############################################################
-                D = ndi.distance_transform_edt(np.logical_not(opening_bool))
-                dist_display = cv2.normalize(D, None, 0, 255,
-                                             cv2.NORM_MINMAX).astype(np.uint8)
-                cv2.imshow("6. Transformada de Distância", dist_display)
-                cv2.waitKey(0)
-                maxD = D.max()
-                sure_fg_bool = D > 0.5 * maxD
-                sure_fg = sure_fg_bool.astype(np.uint8) * 255
-                cv2.imshow("7. Foreground Seguro", sure_fg)
-                cv2.waitKey(0)
-
-                ############################################################
-                # 7. Determinar as regiões desconhecidas
-                ############################################################
-                unknown = np.logical_and(sure_bg > 0, sure_fg == 0)
-                unknown_uint8 = (unknown.astype(np.uint8)) * 255
-                cv2.imshow("8. Regiões Desconhecidas", unknown_uint8)
-                cv2.waitKey(0)
-
-                ############################################################
-                # 8. Rotulagem dos marcadores e criação dos marcadores
-                ############################################################
-                markers = measure.label(sure_fg_bool, connectivity=2)
-                markers = markers + 1
-                markers[unknown] = 0
-                markers_vis = color.label2rgb(markers, bg_label=0, bg_color=(1, 1, 1))
-                markers_vis = (markers_vis * 255).astype(np.uint8)
-                cv2.imshow("9. Marcadores (Markers)", markers_vis)
-                cv2.waitKey(0)
-
-                ############################################################
-                # 9. Calcular o gradiente da imagem
-                ############################################################
-                gradmag = filters.sobel(gray.astype(float) / 255)
-                grad_norm = cv2.normalize(gradmag, None, 0, 255,
-                                          cv2.NORM_MINMAX).astype(np.uint8)
-                cv2.imshow("10. Gradiente da Imagem", grad_norm)
-                cv2.waitKey(0)
-
-                ############################################################
-                # Passo 10: Impor mínimos e aplicar o Watershed
-                ############################################################
-                minima = (markers > 0).astype(np.uint8)
-                markers_imposed = Funcionalidades.imposemin(gradmag, minima)
-                L_ws = segmentation.watershed(
-                    markers_imposed,
-                    connectivity=2,
-                    watershed_line=False
-                )
+            stages = []
+            capture = None
+            if ui.capture_stages_checkbox.isChecked():
+                capture = lambda title, image: stages.append((title, image))
+
+            segment = functools.partial(segment_image, cache=self.stage_cache,
+                                        pyramid=ui.pyramid_checkbox.isChecked(),
+                                        engine=ui.engine_combo.currentData())
+            worker = Worker(segment, ui.processed_image, ui.original_image,
+                            capture=capture)
+            ui.start_task(worker, "Segmentando",
+                          lambda result: self.on_watershed_finished(ui, result, stages))
+        else:
+            QMessageBox.warning(ui, "Erro", "Nenhuma imagem processada.")
 
-                L_ws_vis = color.label2rgb(L_ws, bg_label=0, bg_color=(1, 1, 1))
-                L_ws_vis = (L_ws_vis * 255).astype(np.uint8)
+    def on_watershed_finished(self, ui, result, stages):
+        ############################################################
+        # Atualizar a interface com a imagem segmentada
+        ############################################################
+        I_overlay = result["overlay"]
+        ui.stage_gallery.set_stages(stages)
+        ui.processed_image = I_overlay
+        ui.labels = result["labels"]
+        ui.surface = ({"markers": result["markers"], "gradient": result["gradient"]}
+                      if "markers" in result else None)
+        ui.crush_profile = None
+        self.display_image(ui, I_overlay, keep_view=True)
+
+        message = "Segmentação concluída com:\n- Contornos em vermelho"
+        if "engine" in result:
+            message += f"\n- Motor: {result['engine']}"
+        QMessageBox.information(ui, "Watershed", message)
+
+    def edit_markers(self, ui):
+        """Corrige as sementes do watershed no visualizador, reinundando só as bacias afetadas."""
+        if ui.labels is None:
+            QMessageBox.warning(ui, "Erro", "Segmente a deformação primeiro!")
+            return
+        if ui.surface is None:
+            QMessageBox.warning(ui, "Erro",
+                                "Os marcadores desta segmentação não estão disponíveis "
+                                "(modo pirâmide ou caso salvo). Segmente de novo sem o "
+                                "modo pirâmide para editá-los.")
+            return
+        worker = Worker(marker_editor, ui.labels, ui.surface["markers"],
+                        ui.surface["gradient"], ui.original_image)
+        ui.start_task(worker, "Preparando o editor de marcadores",
+                      lambda editor: self.on_marker_editor_ready(ui, editor))
+
+    def on_marker_editor_ready(self, ui, editor):
+        from core.marcadores import MarkerTool
+        QMessageBox.information(
+            ui, "Editar Marcadores",
+            "Sementes em verde, bordas em vermelho.\n"
+            "- Clique: adiciona uma semente (divide a bacia)\n"
+            "- Shift+clique: remove a semente sob o cursor\n"
+            "- Ctrl+clique em duas bacias: une a segunda à primeira\n"
+            "- Botão direito: desfaz a última edição\n"
+            "- Enter ou Esc: encerra a edição"
+        )
+        self.display_image(ui, editor.view, keep_view=True)
+        tool = MarkerTool(ui.image_label, editor, tasks=ui, parent=ui)
+        tool.finished.connect(lambda: self.on_marker_edit_finished(ui, tool))
+        ui.image_label.set_tool(tool)
+
+    def on_marker_edit_finished(self, ui, tool):
+        ui.image_label.set_tool(None)
+        editor = tool.editor
+        ui.processed_image = editor.overlay
+        ui.labels = editor.labels
+        # as sementes editadas passam a ser os marcadores de uma próxima edição
+        ui.surface = {"markers": editor.seeds, "gradient": editor.gradient}
+        ui.crush_profile = None
+        self.display_image(ui, editor.overlay, keep_view=True)
 
-                cv2.imshow("Segmentação via Watershed", L_ws_vis)
-                cv2.waitKey(0)
+    @staticmethod
+    def rectification(image, path, cache, target=None, points=None, progress=None):
+        """Montagem da câmera (core.retificacao.setup_for) e a imagem já retificada."""
+        _, setup = setup_for(image, path, cache, target, points, progress)
+        return setup, None if setup is None else rectify(image, setup)
+
+    def rectify_image(self, ui, points=None, then=None):
+        """Retifica a perspectiva da imagem atual pela montagem da câmera/sessão.
+
+        Sem montagem em cache, ela vem do alvo de calibração escolhido ou,
+        se ele não for achado, de um retângulo de medidas conhecidas
+        marcado à mão. `then()` é chamada depois que a vista retificada
+        estiver na tela.
+        """
+        if ui.original_image is None:
+            QMessageBox.warning(ui, "Erro", "Nenhuma imagem carregada.")
+            return
+        path = ui.image_source.path if ui.image_source is not None else None
+        worker = Worker(Funcionalidades.rectification, ui.original_image, path,
+                        self.rectifications, ui.calibration_target, points)
+        ui.start_task(worker, "Retificando",
+                      lambda result: self.on_rectification_finished(ui, *result, then=then))
+
+    def on_rectification_finished(self, ui, setup, rectified, then=None):
+        if setup is None:
+            QMessageBox.information(
+                ui, "Retificação",
+                "Nenhuma montagem desta câmera/sessão nem alvo encontrado.\n"
+                "Marque os quatro cantos de um retângulo de medidas conhecidas "
+                "(superior esquerdo, superior direito, inferior direito, inferior esquerdo)."
+            )
+            points = Funcionalidades.select_points(ui, ui.original_image, count=4)
+            if len(points) != 4:
+                QMessageBox.warning(ui, "Erro", "Selecione exatamente quatro pontos.")
+                return
+            width, ok_width = QInputDialog.getDouble(ui, "Retificação",
+                                                     "Largura do retângulo (em cm):",
+                                                     decimals=2, minValue=0.01, maxValue=1e5)
+            height, ok_height = QInputDialog.getDouble(ui, "Retificação",
+                                                       "Altura do retângulo (em cm):",
+                                                       decimals=2, minValue=0.01, maxValue=1e5)
+            if not (ok_width and ok_height):
+                QMessageBox.warning(ui, "Erro", "Medidas do retângulo não fornecidas.")
+                return
+            self.rectify_image(ui, rectangle_points(points, width, height), then)
+            return
 
-                ############################################################
-                # Passo 11: Encontrar bordas da segmentação
-                ############################################################
-                boundary = morphology.dilation(L_ws) != morphology.erosion(L_ws)
+        ui.original_image = rectified
+        ui.rectified = True
+        ui.processed_image = None
+        ui.labels = None
+        ui.surface = None
+        ui.crush_profile = None
+        # na vista retificada a escala é a mesma em toda a imagem
+        ui.scale_factor = setup["scale_factor"]
+        ui.scale_factors = [setup["scale_factor"]]
+        self.display_image(ui, rectified)
+        QMessageBox.information(
+            ui, "Retificação",
+            f"Perspectiva corrigida ({setup['size'][0]}x{setup['size'][1]} px).\n"
+            f"Escala da vista retificada: {ui.scale_factor:.4f} cm/px"
+        )
+        if then is not None:
+            then()
 
-                ############################################################
-                # Passo 12: Sobrepor bordas na imagem original
-                ############################################################
-                if len(ui.original_image.shape) == 2:
-                    I_color = cv2.cvtColor(ui.original_image, cv2.COLOR_GRAY2BGR)
-                else:
-                    I_color = ui.original_image.copy()
-
-                I_overlay = I_color.copy()
-                I_overlay[boundary] = [0, 0, 255]
-
-                cv2.imshow("12. Segmentação por Watershed (Overlay)", I_overlay)
-                cv2.waitKey(0)
-                cv2.destroyAllWindows()
-
-                ############################################################
-                # Atualizar a interface com a imagem segmentada
-                ############################################################
-                ui.processed_image = I_overlay
-                self.display_image(ui, I_overlay)
-
-                QMessageBox.information(ui, "Watershed",
-                                        "Segmentação concluída com:\n"
-                                        "- Contornos em vermelho")
-            except Exception as e:
-                QMessageBox.critical(ui, "Erro", f"Erro no processamento:\n{str(e)}")
-        else:
-            QMessageBox.warning(ui, "Erro", "Nenhuma imagem processada.")
+    def calibrate(self, ui):
+        """Calibra pelo alvo escolhido na tela ou, sem alvo, pelas três medições manuais."""
+        if ui.calibration_target is None or ui.original_image is None:
+            self.calibrate_image(ui)
+            return
+        path = key = None
+        if ui.image_source is not None:
+            path, key = ui.image_source.path, ui.image_source.key
+        worker = Worker(calibrate, ui.original_image, ui.calibration_target, path,
+                        self.calibrations, key)
+        ui.start_task(worker, "Calibrando",
+                      lambda result: self.on_auto_calibration_finished(ui, result))
+
+    def on_auto_calibration_finished(self, ui, result):
+        target = describe_target(ui.calibration_target)
+        if result is None:
+            QMessageBox.information(ui, "Calibração",
+                                    f"Alvo ({target}) não encontrado na imagem.\n"
+                                    "Prossiga com a calibração manual.")
+            self.calibrate_image(ui)
+            return
+        ui.scale_factor = result["scale_factor"]
+        ui.scale_factors = result["scale_factors"]
+        origin = {
+            "detectado": f"{result['detections']} alvo(s) detectado(s)",
+            "cache": "calibração já feita para este arquivo",
+            "sessão": "alvo ausente; escala da última foto da mesma câmera/sessão",
+        }[result["source"]]
+        spread = np.std(ui.scale_factors, ddof=1) if len(ui.scale_factors) > 1 else 0.0
+        QMessageBox.information(
+            ui, "Calibração",
+            f"Escala calibrada automaticamente ({target})!\n"
+            f"Fator médio: {ui.scale_factor:.4f} cm/px (desvio {spread:.4f})\n"
+            f"(Baseado em {len(ui.scale_factors)} medições; {origin})"
+        )
 
     @staticmethod
     def calibrate_image(ui):
         if ui.original_image is not None:
-            image_copy = ui.original_image.copy()
+            image = ui.original_image
             scale_factors = []
 
             for i in range(3):
                 QMessageBox.information(ui, "Calibração", f"Selecione os pontos para a calibração {i + 1}/3.")
 
-                points = Funcionalidades.select_points(image_copy)
+                points = Funcionalidades.select_points(ui, image)
                 if len(points) != 2:
                     QMessageBox.warning(ui, "Erro", "Selecione exatamente dois pontos.")
                     return
@@ -254,68 +431,23 @@ class Funcionalidades:
                 scale_factors.append(scale_factor)
 
             ui.scale_factor = np.mean(scale_factors)
+            # o espalhamento das medições entra na propagação de incerteza
+            ui.scale_factors = scale_factors
 
             QMessageBox.information(
                 ui, "Calibração",
                 f"Escala calibrada com sucesso!\n"
-                f"Fator médio: {ui.scale_factor:.4f} cm/px\n"
+                f"Fator médio: {ui.scale_factor:.4f} cm/px "
+                f"(desvio {np.std(scale_factors, ddof=1):.4f})\n"
                 f"(Baseado em 3 medições)"
             )
         else:
             QMessageBox.warning(ui, "Erro", "Nenhuma imagem carregada para calibrar.")
 
     @staticmethod
-    def select_points(image):
-        points = []
-        zoom_scale = 3
-        zoom_size = 100
-
-        draw_image = image.copy()
-        zoom_window = None
-
-        def click_event(event, x, y, flags, param):
-            nonlocal draw_image, zoom_window
-            if event == cv2.EVENT_LBUTTONDOWN:
-                if len(points) == 0:
-                    points.append((x, y))
-                    cv2.circle(draw_image, (x, y), 5, (0, 255, 0), -1)
-                    cv2.imshow("Seleção de Pontos", draw_image)
-                elif len(points) == 1:
-                    points.append((x, y))
-                    cv2.line(draw_image, points[0], points[1], (0, 255, 0), 2)
-                    cv2.imshow("Seleção de Pontos", draw_image)
-            elif event == cv2.EVENT_MOUSEMOVE:
-                x_start = max(x - zoom_size // 2, 0)
-                y_start = max(y - zoom_size // 2, 0)
-                x_end = min(x + zoom_size // 2, image.shape[1])
-                y_end = min(y + zoom_size // 2, image.shape[0])
-                zoom_region = image[y_start:y_end, x_start:x_end].copy()
-                cv2.circle(zoom_region, (zoom_size // 2, zoom_size // 2), 3, (0, 0, 255), -1)
-                zoom_resized = cv2.resize(zoom_region, (zoom_size * zoom_scale, zoom_size * zoom_scale),
-                                          interpolation=cv2.INTER_LINEAR)
-                cv2.imshow("Zoom", zoom_resized)
-                if len(points) == 1:
-                    temp_image = draw_image.copy()
-                    cv2.line(temp_image, points[0], (x, y), (255, 0, 0), 1)
-                    cv2.imshow("Seleção de Pontos", temp_image)
-
-        cv2.imshow("Seleção de Pontos", draw_image)
-        cv2.setMouseCallback("Seleção de Pontos", click_event)
-
-        while len(points) < 2:
-            if cv2.waitKey(100) == 27:
-                break
-
-        cv2.destroyWindow("Zoom")
-        cv2.destroyWindow("Seleção de Pontos")
-        return points
-
-        while len(points) < 2:
-            if cv2.waitKey(100) == 27:
-                break
-
-        cv2.destroyAllWindows()
-        return points
+    def select_points(ui, image, count=2):
+        """Marca `count` pontos em `image` na própria tela de análise (ver core.medicao)."""
+        return pick_points(ui.image_label, image, count, snap=ui.snap_checkbox.isChecked())
 
     @staticmethod
     def calculate_pixel_distance(point1, point2):
@@ -330,8 +462,7 @@ class Funcionalidades:
         return np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
 
     def measure_deformation(self, ui):
-        image_copy = ui.processed_image.copy()
-        points = Funcionalidades.select_points(image_copy)
+        points = Funcionalidades.select_points(ui, ui.processed_image)
         if len(points) != 2:
             QMessageBox.warning(ui, "Erro", "Selecione exatamente dois pontos para medir a deformação.")
             return None
@@ -342,32 +473,285 @@ class Funcionalidades:
             return None
 
         real_distance = pixel_distance * ui.scale_factor
+        ui.deformation_pixels = pixel_distance
         QMessageBox.information(ui, "Medição de Deformação",
                                 f"Deformação medida: {real_distance:.2f} cm")
         return real_distance
 
+    @staticmethod
+    def energy_and_velocity(deformation_cm, mass, stiffness=None, progress=None):
+        """Um caso de core.velocidade.energy_and_velocity (sem rigidez: método ajustado)."""
+        Edef, velocity_kmh = compute_energy_and_velocity(deformation_cm, mass, stiffness)
+        return deformation_cm, float(Edef), float(velocity_kmh)
+
+    @staticmethod
+    def velocity_analysis(deformation_cm, mass, stiffness=None, scale_factors=None,
+                          deformation_px=None, progress=None):
+        """energy_and_velocity e, se houver calibração e medição, a incerteza (core.incerteza)."""
+        result = Funcionalidades.energy_and_velocity(deformation_cm, mass, stiffness)
+        uncertainty = None
+        if scale_factors is not None and deformation_px is not None:
+            uncertainty = propagate(scale_factors, deformation_px, mass,
+                                    F_eff=float(energy_coefficient(stiffness)),
+                                    progress=progress)
+        return (*result, uncertainty)
+
     def calculate_energy_and_velocity(self, ui, deformation_cm):
         mass, ok_mass = QInputDialog.getDouble(ui, "Massa", "Insira a massa do veículo (kg):", decimals=2)
         if not ok_mass or mass <= 0:
             QMessageBox.warning(ui, "Erro", "Massa inválida.")
             return
-        deformation_m = deformation_cm / 100.0
-        F_eff = 2.621e6
-        Edef = F_eff * (deformation_m ** 2)
-
-        velocity = np.sqrt((2 * Edef) / mass)
-        velocity_kmh = velocity * 3.6
-
+        stiffness = ui.selected_stiffness
+        worker = Worker(Funcionalidades.velocity_analysis, deformation_cm, mass, stiffness,
+                        ui.scale_factors, ui.deformation_pixels)
+        ui.start_task(worker, "Calculando velocidade",
+                      lambda result: self.on_velocity_finished(ui, *result, stiffness=stiffness,
+                                                               mass=mass))
+
+    def on_velocity_finished(self, ui, deformation_cm, Edef, velocity_kmh, uncertainty=None,
+                             stiffness=None, mass=None):
+        if stiffness is None:
+            method = "Método Ajustado"
+        else:
+            method = f"Modelo de Campbell, k={stiffness:.0f} N/m"
         report_content = (
-            f"**Resultados da Análise (Método Ajustado)**\n"
+            f"**Resultados da Análise ({method})**\n"
             f"- Deformação medida: {deformation_cm:.2f} cm\n"
             f"- Energia de deformação (Edef): {Edef:.2f} N.m\n"
             f"- Velocidade estimada: {velocity_kmh:.2f} km/h\n"
         )
+        if ui.crush_profile is not None:
+            report_content += "\n" + format_crush_profile(ui.crush_profile)
+        if uncertainty is not None:
+            report_content += "\n" + format_uncertainty(uncertainty)
         ui.report_text.setPlainText(report_content)
-        return velocity_kmh
+        self.register_case(ui, deformation_cm, Edef, velocity_kmh, stiffness, mass, method)
+
+    def register_case(self, ui, deformation_cm, Edef, velocity_kmh, stiffness, mass, method):
+        """Grava a análise concluída no banco de casos (core.banco), em segundo plano."""
+        if ui.image_hash is None:
+            return
+        image = {"hash": ui.image_hash}
+        if ui.image_source is not None:
+            image["path"] = ui.image_source.path
+        profile = ui.crush_profile
+        if profile is not None:
+            profile = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                       for key, value in profile.items()}
+        analysis = {
+            "stiffness": stiffness,
+            "mass_kg": mass,
+            "method": method,
+            "scale_factor": None if ui.scale_factor is None else float(ui.scale_factor),
+            "scale_factors": None if ui.scale_factors is None else
+            [float(value) for value in ui.scale_factors],
+            "calibration_target": ui.calibration_target,
+            "deformation_px": None if ui.deformation_pixels is None else
+            float(ui.deformation_pixels),
+            "deformation_cm": float(deformation_cm),
+            "energy_nm": float(Edef),
+            "velocity_kmh": float(velocity_kmh),
+            "crush_profile": profile,
+            "rectified": ui.rectified,
+            "report": ui.report_text.toPlainText(),
+        }
+        timings = {stage: dict(entry) for stage, entry in case_profile.stages.items()}
+        worker = Worker(self.case_index.record, image, analysis, ui.labels, timings)
+        ui.start_task(worker, "Registrando no banco de casos", lambda _: None)
+
+    def save_case(self, ui):
+        """Grava imagens, etapas, rótulos, calibração e relatório num arquivo de caso."""
+        if ui.original_image is None:
+            QMessageBox.warning(ui, "Erro", "Nenhuma imagem carregada.")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(
+            ui, "Salvar Caso", "", f"Casos SmashMetrics (*{CASE_EXTENSION})"
+        )
+        if not file_path:
+            return
+        if not file_path.endswith(CASE_EXTENSION):
+            file_path += CASE_EXTENSION
+        overwrite_open_case = ui.case is not None and same_file(file_path, ui.case.path)
+        if overwrite_open_case:
+            self.release_case_file(ui)
+
+        stages = ui.stage_gallery.stages()
+        arrays = {"original": ui.original_image, "processed": ui.processed_image}
+        if ui.labels is not None:
+            arrays["labels"] = compact_labels(ui.labels)
+        arrays.update((f"etapa/{i:02d}", image) for i, (_, image) in enumerate(stages))
+        profile = ui.crush_profile
+        if profile is not None:
+            profile = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                       for key, value in profile.items()}
+        meta = {
+            "source": ui.image_source.path if ui.image_source is not None else None,
+            "scale_factor": None if ui.scale_factor is None else float(ui.scale_factor),
+            "scale_factors": None if ui.scale_factors is None else
+            [float(value) for value in ui.scale_factors],
+            "deformation_pixels": None if ui.deformation_pixels is None else
+            float(ui.deformation_pixels),
+            "selected_stiffness": ui.selected_stiffness,
+            "calibration_target": ui.calibration_target,
+            "crush_profile": profile,
+            "stage_titles": [title for title, _ in stages],
+            "image_hash": ui.image_hash,
+            "rectified": ui.rectified,
+            "report": ui.report_text.toPlainText(),
+        }
+        worker = Worker(save_case, file_path, arrays, meta)
+        ui.start_task(worker, "Salvando o caso",
+                      lambda _: self.on_case_saved(ui, file_path, overwrite_open_case))
+
+    def on_case_saved(self, ui, file_path, overwrite_open_case):
+        if overwrite_open_case and ui.case is not None:
+            # o índice antigo aponta para posições do arquivo substituído
+            try:
+                ui.case = CaseFile(file_path)
+            except (OSError, ValueError, KeyError, struct.error):
+                ui.case = None
+        QMessageBox.information(ui, "Caso", f"Caso salvo em {file_path}.")
+
+    def release_case_file(self, ui):
+        """Troca os arrays mapeados do caso aberto por cópias em memória.
+
+        Um arquivo mapeado não pode ser substituído no Windows, então gravar o
+        caso por cima dele mesmo falharia no os.replace de core.caso.save_case.
+        """
+        case, rectified = ui.case, ui.rectified
+        labels = ui.labels  # descomprime os rótulos enquanto o índice ainda vale
+        ui.original_image = np.array(ui.original_image)
+        ui.case, ui.rectified, ui.labels = case, rectified, labels
+        if isinstance(ui.processed_image, np.memmap):
+            ui.processed_image = np.array(ui.processed_image)
+        ui.stage_gallery.set_stages([
+            (title, np.array(image) if isinstance(image, np.memmap) else image)
+            for title, image in ui.stage_gallery.stages()
+        ])
+        self.display_image(ui, ui.processed_image if ui.processed_image is not None
+                           else ui.original_image, keep_view=True)
+        ui.image_label.forget_cached()
+
+    def open_case(self, ui):
+        """Abre um arquivo de caso; as imagens são mapeadas do disco, não lidas."""
+        file_path, _ = QFileDialog.getOpenFileName(
+            ui, "Abrir Caso", "", f"Casos SmashMetrics (*{CASE_EXTENSION})"
+        )
+        if not file_path:
+            return
+        # tudo o que vem do arquivo é lido antes de mexer na tela: um caso
+        # truncado ou com o índice inconsistente não deixa a tela pela metade
+        try:
+            with instrumentation.measure("Abrir caso"):
+                case = CaseFile(file_path)
+                meta = case.meta
+                original = case.array("original")
+                processed = case.array("processed") if "processed" in case else None
+                stages = [(title, case.array(f"etapa/{i:02d}"))
+                          for i, title in enumerate(meta.get("stage_titles", []))]
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            QMessageBox.warning(ui, "Erro", f"Falha ao abrir o caso:\n{e}")
+            return
+
+        case_profile.clear()
+        ui.original_image = original
+        ui.image_hash = meta.get("image_hash")
+        ui.rectified = meta.get("rectified", False)
+        ui.processed_image = processed
+        ui.labels = None
+        ui.surface = None
+        ui.case = case  # os rótulos só são descomprimidos quando usados
+        ui.scale_factor = meta.get("scale_factor")
+        ui.scale_factors = meta.get("scale_factors")
+        ui.deformation_pixels = meta.get("deformation_pixels")
+        profile = meta.get("crush_profile")
+        if profile is not None:
+            profile = {key: np.asarray(value) if isinstance(value, list) else value
+                       for key, value in profile.items()}
+        ui.crush_profile = profile
+        ui.show_selected_stiffness(meta.get("selected_stiffness"))
+        target = meta.get("calibration_target")
+        if target is not None and "pattern" in target:
+            target["pattern"] = tuple(target["pattern"])
+        ui.show_calibration_target(target)
+        ui.stage_gallery.set_stages(stages)
+        ui.report_text.setPlainText(meta.get("report", ""))
+        self.display_image(ui, ui.processed_image if ui.processed_image is not None
+                           else ui.original_image)
+        ui.remove_image_button.setEnabled(True)
+
+    def export_pdf(self, ui):
+        """Exporta o relatório, a imagem segmentada e as etapas para PDF, em segundo plano."""
+        report = ui.report_text.toPlainText()
+        image = ui.processed_image if ui.processed_image is not None else ui.original_image
+        if not report and image is None:
+            QMessageBox.warning(ui, "Erro", "Não há relatório nem imagem para exportar.")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(ui, "Exportar para PDF", "", "PDF (*.pdf)")
+        if not file_path:
+            return
+        if not file_path.lower().endswith(".pdf"):
+            file_path += ".pdf"
+        source = None
+        if ui.image_source is not None:
+            source = ui.image_source.path
+        elif ui.case is not None:
+            source = ui.case.meta.get("source")
+        worker = Worker(render_report, file_path, report, image, ui.stage_gallery.stages(),
+                        source=source)
+        ui.start_task(worker, "Exportando PDF",
+                      lambda _: QMessageBox.information(ui, "Exportação",
+                                                        f"Relatório salvo em {file_path}."))
+
+    @staticmethod
+    def show_profile(ui):
+        """Acrescenta ao relatório a tabela de tempos por etapa da sessão."""
+        report = ui.report_text.toPlainText().split(PROFILE_HEADER)[0].rstrip()
+        sections = [report] if report else []
+        sections.append(f"{PROFILE_HEADER}\n{stage_profile.format_table()}")
+        ui.report_text.setPlainText("\n\n".join(sections))
+
+    @staticmethod
+    def set_allocation_tracing(ui, enabled):
+        """Liga ou desliga a medição de alocações por etapa (tracemalloc)."""
+        trace_allocations(enabled)
+
+    def show_case_summary(self, ui):
+        """Acrescenta ao relatório o resumo do banco de casos por classe de veículo e por mês."""
+        report = ui.report_text.toPlainText().split(CASES_HEADER)[0].rstrip()
+        sections = [report] if report else []
+        try:
+            with instrumentation.measure("Resumo do banco de casos"):
+                by_class = self.case_index.summary("classe")
+                by_month = self.case_index.summary("mes")
+        except (sqlite3.Error, ValueError, OSError) as e:
+            QMessageBox.warning(ui, "Erro", f"Falha ao ler o banco de casos: {e}")
+            return
+        sections.append(f"{CASES_HEADER}\n{format_summary(by_class, 'classe')}\n\n"
+                        f"{format_summary(by_month, 'mes')}")
+        ui.report_text.setPlainText("\n\n".join(sections))
+
+    def extract_crush_profile(self, ui):
+        """Mede o perfil C1…CN da região segmentada e calcula a velocidade com a média."""
+        if ui.labels is None:
+            QMessageBox.warning(ui, "Erro", "Segmente a deformação primeiro!")
+            return
+        if ui.scale_factor is None:
+            QMessageBox.warning(ui, "Erro", "Calibre a imagem primeiro!")
+            return
+        worker = Worker(crush_profile, ui.labels, stations=ui.stations_spinbox.value(),
+                        scale=ui.scale_factor)
+        ui.start_task(worker, "Medindo o perfil de deformação",
+                      lambda profile: self.on_crush_profile_finished(ui, profile))
+
+    def on_crush_profile_finished(self, ui, profile):
+        ui.crush_profile = profile
+        ui.deformation_pixels = profile["mean_px"]
+        self.display_image(ui, draw_crush_profile(ui.processed_image, profile), keep_view=True)
+        self.calculate_energy_and_velocity(ui, profile["mean_cm"])
 
     def handle_velocity_calculation(self, ui):
+        ui.crush_profile = None
         deformation = self.measure_deformation(ui)
 
         if deformation is not None:
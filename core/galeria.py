@@ -0,0 +1,111 @@
+from PySide6.QtWidgets import QWidget, QHBoxLayout, QScrollArea, QSizePolicy
+from PySide6.QtGui import QImage, QPixmap, QPainter, QColor
+from PySide6.QtCore import Qt, Signal
+import cv2
+import numpy as np
+
+
+def to_qimage(image):
+    """Cria um QImage a partir de um array cinza, BGR ou BGRA.
+
+    Arrays que não são de 8 bits são normalizados para 0..255 e o canal alfa
+    é descartado. O QImage aponta para os dados do array (sem cópia) e guarda
+    uma referência a ele, para que o buffer não seja liberado antes da hora.
+    """
+    if image.dtype != np.uint8:
+        image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    if len(image.shape) == 3 and image.shape[2] == 4:
+        image = image[:, :, :3]
+    image = np.ascontiguousarray(image)
+    if len(image.shape) == 2:
+        height, width = image.shape
+        qimage = QImage(image.data, width, height,
+                        image.strides[0], QImage.Format_Grayscale8)
+    else:
+        height, width, _ = image.shape
+        qimage = QImage(image.data, width, height,
+                        image.strides[0], QImage.Format_BGR888)
+    qimage._array = image
+    return qimage
+
+
+class StageThumbnail(QWidget):
+    """Miniatura de uma etapa do pipeline.
+
+    O QPixmap só é criado no primeiro paintEvent, ou seja, quando a miniatura
+    entra na área visível da galeria.
+    """
+
+    clicked = Signal(str, object)
+
+    def __init__(self, title, image, size=160, parent=None):
+        super().__init__(parent)
+        self.title = title
+        self.image = image
+        self.thumb_size = size
+        self._pixmap = None
+        self.setFixedSize(size, size + 24)
+        self.setCursor(Qt.PointingHandCursor)
+        self.setToolTip(title)
+
+    def paintEvent(self, event):
+        if self._pixmap is None:
+            self._pixmap = QPixmap.fromImage(to_qimage(self.image)).scaled(
+                self.thumb_size, self.thumb_size,
+                Qt.KeepAspectRatio, Qt.SmoothTransformation
+            )
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("#2c3e50"))
+        x = (self.thumb_size - self._pixmap.width()) // 2
+        y = (self.thumb_size - self._pixmap.height()) // 2
+        painter.drawPixmap(x, y, self._pixmap)
+        painter.setPen(QColor("#ecf0f1"))
+        painter.drawText(0, self.thumb_size, self.thumb_size, 24,
+                         Qt.AlignCenter | Qt.TextSingleLine,
+                         painter.fontMetrics().elidedText(self.title, Qt.ElideRight, self.thumb_size))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        self.clicked.emit(self.title, self.image)
+
+
+class StageGallery(QScrollArea):
+    """Filmstrip horizontal com as imagens intermediárias da segmentação."""
+
+    stage_selected = Signal(str, object)
+
+    def __init__(self, thumb_size=160, parent=None):
+        super().__init__(parent)
+        self.thumb_size = thumb_size
+        self.setWidgetResizable(True)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setFixedHeight(thumb_size + 50)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+
+        self.container = QWidget()
+        self.strip_layout = QHBoxLayout(self.container)
+        self.strip_layout.setContentsMargins(5, 5, 5, 5)
+        self.strip_layout.setSpacing(10)
+        self.strip_layout.addStretch()
+        self.setWidget(self.container)
+
+    def clear(self):
+        while self.strip_layout.count() > 1:
+            item = self.strip_layout.takeAt(0)
+            item.widget().deleteLater()
+
+    def stages(self):
+        """Lista de (título, imagem) exibida na galeria."""
+        count = self.strip_layout.count() - 1  # o último item é o espaçador
+        thumbs = (self.strip_layout.itemAt(i).widget() for i in range(count))
+        return [(thumb.title, thumb.image) for thumb in thumbs]
+
+    def set_stages(self, stages):
+        """Substitui o conteúdo da galeria por uma lista de (título, imagem)."""
+        self.clear()
+        for title, image in stages:
+            thumb = StageThumbnail(title, image, self.thumb_size)
+            thumb.clicked.connect(self.stage_selected)
+            self.strip_layout.insertWidget(self.strip_layout.count() - 1, thumb)
+        self.setVisible(bool(stages))
@@ -0,0 +1,258 @@
+"""Importação rápida de imagens: prévia reduzida imediata e decodificação sob demanda.
+
+Para JPEG a prévia sai da decodificação com escala no DCT do OpenCV
+(IMREAD_REDUCED_COLOR_2/4/8), que não chega a montar a imagem inteira; a
+imagem em resolução total só é decodificada quando uma etapa de
+processamento a pede (ver LazyImage). Para os demais formatos o OpenCV não
+reduz na decodificação, então a imagem é lida uma vez e a prévia sai dela.
+
+As prévias ficam num cache em disco indexado pelo hash do conteúdo do
+arquivo: reabrir a mesma evidência, mesmo renomeada, mostra a prévia sem
+decodificar nada.
+"""
+import hashlib
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from core.instrumentacao import instrumentation
+
+THUMBNAIL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".smashmetrics", "cache",
+                                   "miniaturas")
+# Lado maior da prévia: um pouco acima da área de exibição da tela de análise
+PREVIEW_MAX_SIDE = 1600
+JPEG_EXTENSIONS = (".jpg", ".jpeg", ".jpe")
+# A decodificação em resolução total (IMREAD_UNCHANGED) não aplica a
+# orientação EXIF; a prévia também não pode aplicar, senão uma foto de
+# celular seria exibida numa orientação e medida na outra
+REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8 | cv2.IMREAD_IGNORE_ORIENTATION),
+    (4, cv2.IMREAD_REDUCED_COLOR_4 | cv2.IMREAD_IGNORE_ORIENTATION),
+    (2, cv2.IMREAD_REDUCED_COLOR_2 | cv2.IMREAD_IGNORE_ORIENTATION),
+    (1, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION),
+)
+# Muda quando a geometria das prévias muda, para não reaproveitar as antigas
+PREVIEW_VERSION = 2
+# Final dos arquivos temporários das prévias (ignorados no corte por tamanho)
+TMP_SUFFIX = ".tmp.jpg"
+
+
+def file_hash(path, chunk_size=2 ** 20):
+    """Hash blake2b do conteúdo do arquivo, lido em blocos."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fit_preview(image, max_side=PREVIEW_MAX_SIDE):
+    """Reduz `image` (INTER_AREA) até o lado maior caber em `max_side`."""
+    h, w = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def as_bgr8(image):
+    """Converte uma imagem lida com IMREAD_UNCHANGED para BGR de 8 bits."""
+    if image.dtype != np.uint8:
+        image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(path):
+    """(altura, largura) lidas do cabeçalho SOF de um JPEG, sem decodificar; ou None."""
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return None
+            if byte != b"\xff":
+                continue
+            marker = f.read(1)
+            while marker == b"\xff":
+                marker = f.read(1)
+            if not marker:
+                return None
+            code = marker[0]
+            if code == 0x01 or 0xD0 <= code <= 0xD9:
+                continue
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            if code in SOF_MARKERS:
+                header = f.read(5)
+                if len(header) < 5:
+                    return None
+                return (int.from_bytes(header[1:3], "big"),
+                        int.from_bytes(header[3:5], "big"))
+            f.seek(int.from_bytes(length, "big") - 2, os.SEEK_CUR)
+
+
+def decode_jpeg_preview(path, max_side=PREVIEW_MAX_SIDE):
+    """Prévia de um JPEG pela maior redução no DCT que ainda cobre `max_side`.
+
+    O tamanho da imagem vem do cabeçalho (jpeg_size); se ele não puder ser
+    lido, a decodificação em 1/8 serve para estimá-lo.
+    """
+    size = jpeg_size(path)
+    smallest = None
+    if size is None:
+        smallest = cv2.imread(path, REDUCED_FLAGS[0][1])
+        if smallest is None:
+            return None
+        size = [side * 8 for side in smallest.shape[:2]]
+    full_side = max(size)
+    for factor, flag in REDUCED_FLAGS:
+        if full_side / factor >= max_side or factor == 1:
+            break
+    if factor == 8 and smallest is not None:
+        preview = smallest
+    else:
+        preview = cv2.imread(path, flag)
+    if preview is None:
+        return None
+    return fit_preview(preview, max_side)
+
+
+class ThumbnailCache:
+    """Prévias em JPEG no disco, indexadas pelo hash do arquivo de origem.
+
+    JPEG e não PNG: a prévia só serve para exibição e gravar/ler PNG desse
+    tamanho custaria mais do que a própria decodificação reduzida.
+    """
+
+    def __init__(self, disk_dir=THUMBNAIL_CACHE_DIR, max_bytes=256 * 2 ** 20):
+        self.disk_dir = disk_dir
+        self.max_bytes = max_bytes
+        try:
+            os.makedirs(disk_dir, exist_ok=True)
+        except OSError:
+            pass  # sem cache em disco: toda importação decodifica a prévia
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.v{PREVIEW_VERSION}.jpg")
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        preview = cv2.imread(path, cv2.IMREAD_COLOR)
+        if preview is not None:
+            try:
+                os.utime(path)  # marca como usado recentemente
+            except OSError:
+                pass
+        return preview
+
+    def put(self, key, preview):
+        """Grava a prévia; o disco é só um acelerador, então falhas são ignoradas."""
+        path = self._path(key)
+        # nome próprio por processo e thread (como em core.cache.StageCache),
+        # terminado em .jpg para o cv2.imwrite escolher o codificador
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+        try:
+            if not cv2.imwrite(tmp_path, preview, [cv2.IMWRITE_JPEG_QUALITY, 90]):
+                return
+            os.replace(tmp_path, path)
+        except (OSError, cv2.error):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._trim()
+
+    def _trim(self):
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.disk_dir) as scan:
+                for entry in scan:
+                    # só prévias prontas: temporários de outras gravações ficam de fora
+                    if entry.name.endswith(".jpg") and not entry.name.endswith(TMP_SUFFIX):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+        except OSError:
+            return
+        entries.sort()
+        while total > self.max_bytes and entries:
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class LazyImage:
+    """Arquivo importado: `preview` (BGR de 8 bits) já decodificada e `load()` sob demanda.
+
+    `load()` decodifica a resolução total (IMREAD_UNCHANGED, como antes) na
+    primeira chamada e guarda o resultado; é seguro chamá-la de várias threads.
+    """
+
+    def __init__(self, path, preview, full=None, key=None):
+        self.path = path
+        self.preview = preview
+        self.key = key
+        self._full = full
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._full is not None
+
+    def load(self):
+        with self._lock:
+            if self._full is None:
+                with instrumentation.measure("Decodificar resolução total") as measured:
+                    self._full = cv2.imread(self.path, cv2.IMREAD_UNCHANGED)
+                    measured.output = self._full
+                if self._full is None:
+                    raise ValueError(f"Falha ao carregar a imagem {self.path}")
+            return self._full
+
+
+def open_image(path, thumbnails=None, max_side=PREVIEW_MAX_SIDE):
+    """Abre `path` mostrando o mínimo possível: retorna um LazyImage ou None.
+
+    Com um ThumbnailCache em `thumbnails`, uma prévia já guardada dispensa
+    qualquer decodificação.
+    """
+    key = file_hash(path) if thumbnails is not None else None
+    if key is not None:
+        preview = thumbnails.get(key)
+        if preview is not None:
+            return LazyImage(path, preview, key=key)
+
+    full = None
+    if path.lower().endswith(JPEG_EXTENSIONS):
+        preview = decode_jpeg_preview(path, max_side)
+    else:
+        full = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        preview = None if full is None else fit_preview(as_bgr8(full), max_side)
+    if preview is None:
+        return None
+
+    if key is not None:
+        thumbnails.put(key, preview)
+    return LazyImage(path, preview, full, key)
@@ -0,0 +1,142 @@
+"""Propagação de incerteza por Monte Carlo da calibração até a velocidade.
+
+Fontes amostradas em cada sorteio:
+- escala (cm/px): normal em torno da média das calibrações, com o erro
+  padrão da média das medições (o espalhamento que a média descartava);
+- marcação dos pontos: erro normal de `pick_sigma_px` em cada extremidade,
+  ou seja, sqrt(2)·sigma na distância medida em pixels;
+- massa e coeficiente de energia (F_eff, ou ½·k no modelo de Campbell, ver
+  core.velocidade): log-normais com desvio relativo `mass_rel` e
+  `stiffness_rel`.
+
+Os sorteios são feitos em blocos de `chunk` com expressões vetorizadas do
+NumPy e acumulados em histogramas finos (StreamingPercentiles), então a
+memória não cresce com o número de sorteios. Cada bloco chama `progress`,
+o que permite rodar dentro de um core.tarefas.Worker e cancelar.
+"""
+import numpy as np
+
+from core.velocidade import F_EFF
+
+DEFAULT_DRAWS = 1_000_000
+DEFAULT_CHUNK = 100_000
+PICK_SIGMA_PX = 1.0
+MASS_REL_SIGMA = 0.05
+STIFFNESS_REL_SIGMA = 0.10
+REPORT_PERCENTILES = (2.5, 5, 50, 95, 97.5)
+
+
+class StreamingPercentiles:
+    """Média, desvio e percentis aproximados de valores recebidos em blocos.
+
+    A faixa do histograma é fixada pelo primeiro bloco (com folga); valores
+    fora dela caem nas classes das pontas, o que só afeta percentis extremos.
+    """
+
+    def __init__(self, bins=4096):
+        self.bins = bins
+        self.low = None
+        self.width = None
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def add(self, values):
+        if self.low is None:
+            low, high = np.percentile(values, [0.01, 99.99])
+            pad = (high - low) * 0.5 or max(abs(high), 1.0) * 1e-6
+            self.low = low - pad
+            self.width = (high - low + 2 * pad) / self.bins
+        index = ((values - self.low) / self.width).astype(np.int64)
+        np.clip(index, 0, self.bins - 1, out=index)
+        self.counts += np.bincount(index, minlength=self.bins)
+        self.count += values.size
+        self.total += float(values.sum(dtype=np.float64))
+        self.total_sq += float(np.square(values, dtype=np.float64).sum())
+
+    @property
+    def mean(self):
+        return self.total / self.count
+
+    @property
+    def std(self):
+        return float(np.sqrt(max(self.total_sq / self.count - self.mean ** 2, 0.0)))
+
+    def percentile(self, q):
+        cumulative = np.cumsum(self.counts)
+        target = q / 100 * self.count
+        i = int(np.searchsorted(cumulative, target))
+        i = min(i, self.bins - 1)
+        before = cumulative[i - 1] if i > 0 else 0
+        fraction = (target - before) / self.counts[i] if self.counts[i] else 0.0
+        return self.low + (i + fraction) * self.width
+
+    def summary(self, percentiles=REPORT_PERCENTILES):
+        return {
+            "mean": self.mean,
+            "std": self.std,
+            "percentiles": {q: self.percentile(q) for q in percentiles},
+        }
+
+
+def propagate(scale_factors, deformation_px, mass, F_eff=F_EFF,
+              pick_sigma_px=PICK_SIGMA_PX, mass_rel=MASS_REL_SIGMA,
+              stiffness_rel=STIFFNESS_REL_SIGMA, draws=DEFAULT_DRAWS,
+              chunk=DEFAULT_CHUNK, seed=None, progress=None):
+    """Distribuições de deformação (cm), energia (N.m) e velocidade (km/h).
+
+    `scale_factors` são os fatores cm/px das calibrações e `deformation_px`
+    a deformação medida em pixels. Retorna um dicionário com o resumo
+    (média, desvio, percentis) de cada grandeza e o número de sorteios.
+    """
+    scale_factors = np.asarray(scale_factors, dtype=np.float64)
+    scale_mean = scale_factors.mean()
+    scale_sem = (scale_factors.std(ddof=1) / np.sqrt(scale_factors.size)
+                 if scale_factors.size > 1 else 0.0)
+    distance_sigma = np.sqrt(2) * pick_sigma_px
+
+    rng = np.random.default_rng(seed)
+    deformation = StreamingPercentiles()
+    energy = StreamingPercentiles()
+    velocity = StreamingPercentiles()
+    chunks = -(-draws // chunk)
+    for i in range(chunks):
+        n = min(chunk, draws - i * chunk)
+        deformation_cm = (np.abs(deformation_px + distance_sigma * rng.standard_normal(n))
+                          * (scale_mean + scale_sem * rng.standard_normal(n)))
+        Edef = (F_eff * np.exp(stiffness_rel * rng.standard_normal(n))
+                * (deformation_cm / 100.0) ** 2)
+        velocity_kmh = np.sqrt(2 * Edef / (mass * np.exp(mass_rel * rng.standard_normal(n)))) * 3.6
+        deformation.add(deformation_cm)
+        energy.add(Edef)
+        velocity.add(velocity_kmh)
+        if progress:
+            progress(i + 1, chunks, "Propagando incerteza")
+
+    return {
+        "draws": draws,
+        "deformation_cm": deformation.summary(),
+        "energy": energy.summary(),
+        "velocity_kmh": velocity.summary(),
+    }
+
+
+def format_uncertainty(result):
+    """Linhas de texto do relatório com os intervalos de cada grandeza."""
+    def interval(summary, unit, digits=2):
+        p = summary["percentiles"]
+        return (f"mediana {p[50]:.{digits}f} {unit}, "
+                f"IC 95% [{p[2.5]:.{digits}f}; {p[97.5]:.{digits}f}] {unit}, "
+                f"desvio {summary['std']:.{digits}f} {unit}")
+
+    velocity = result["velocity_kmh"]["percentiles"]
+    return (
+        f"**Incerteza (Monte Carlo, {result['draws']} sorteios)**\n"
+        f"- Deformação: {interval(result['deformation_cm'], 'cm')}\n"
+        f"- Energia: {interval(result['energy'], 'N.m', 0)}\n"
+        f"- Velocidade: {interval(result['velocity_kmh'], 'km/h')}\n"
+        f"- Percentis da velocidade: "
+        + ", ".join(f"P{q:g} = {velocity[q]:.2f}" for q in REPORT_PERCENTILES)
+        + " km/h\n"
+    )
@@ -0,0 +1,85 @@
+"""Tempo de inicialização da interface e pré-carregamento das bibliotecas científicas.
+
+A janela não depende de scipy nem de scikit-image: core.segmentacao,
+core.piramide e core.marcadores só são importados no primeiro uso, e
+core.perfil só importa scipy/scikit-image dentro de crush_profile.
+Para que a primeira segmentação não pague essa importação, `preload` os
+importa numa thread em segundo plano logo depois que a janela aparece.
+
+StartupTimer marca as fases da inicialização a partir de um instante
+inicial (tomado em main.py antes de importar o Qt) e emite cada uma em
+`instrumentation` como "Inicialização: <fase>", com o tempo acumulado desde
+o início. Assim elas aparecem na tabela de desempenho da tela de Relatório
+e, com SMASHMETRICS_PROFILE_LOG definida, ficam registradas em JSON para
+acompanhar o tempo até a primeira janela entre versões.
+"""
+import importlib
+import threading
+import time
+
+from PySide6.QtCore import QEvent, QObject, QTimer
+
+from core.instrumentacao import instrumentation
+
+# Módulos que puxam scipy/scikit-image, carregados depois da primeira janela
+SCIENTIFIC_MODULES = ("core.segmentacao", "core.piramide", "core.marcadores")
+STAGE_PREFIX = "Inicialização: "
+FIRST_WINDOW = "primeira janela"
+
+
+class StartupTimer:
+    """Fases da inicialização, em segundos desde `started` (time.perf_counter)."""
+
+    def __init__(self, started):
+        self.started = started
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        seconds = time.perf_counter() - self.started
+        with self._lock:
+            self.phases[phase] = seconds
+        instrumentation.emit(STAGE_PREFIX + phase, seconds)
+        return seconds
+
+    def format_report(self):
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: item[1])
+        lines = [f"{'Fase':<32} {'desde o início (ms)':>20}"]
+        lines += [f"{phase:<32} {seconds * 1000:>20.1f}" for phase, seconds in phases]
+        return "\n".join(lines)
+
+
+class FirstPaint(QObject):
+    """Chama `callback` uma vez, no primeiro evento de pintura do widget observado."""
+
+    def __init__(self, widget, callback):
+        super().__init__(widget)
+        self.callback = callback
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint and self.callback is not None:
+            callback, self.callback = self.callback, None
+            watched.removeEventFilter(self)
+            # o callback roda depois que esta pintura termina
+            QTimer.singleShot(0, callback)
+        return False
+
+
+def preload(modules=SCIENTIFIC_MODULES, timer=None):
+    """Importa `modules` numa thread daemon; marca "bibliotecas carregadas" em `timer`.
+
+    Se o usuário pedir uma segmentação antes do fim, o import feito pela
+    tarefa simplesmente espera o que já está em andamento (a trava de import
+    do Python é por módulo).
+    """
+    def run():
+        for name in modules:
+            importlib.import_module(name)
+        if timer is not None:
+            timer.mark("bibliotecas carregadas")
+
+    thread = threading.Thread(target=run, name="preload", daemon=True)
+    thread.start()
+    return thread
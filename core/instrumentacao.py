@@ -0,0 +1,184 @@
+"""Instrumentação por etapa do pipeline e das operações da interface.
+
+Cada etapa medida gera um evento (dicionário) com o nome, o tempo, a forma,
+o tipo e o tamanho do array de saída e, se o tracemalloc estiver ativo, o
+pico de bytes alocados durante a etapa (acima do que já estava alocado). Os eventos vão para os sinks
+registrados em `instrumentation`; sem nenhum sink, medir não custa nada além
+de um `perf_counter`.
+
+Sinks incluídos: StageAggregator (em memória, usado na tela de Relatório) e
+JsonLinesSink (um evento JSON por linha). Definir a variável de ambiente
+SMASHMETRICS_PROFILE_LOG com um caminho liga o JsonLinesSink na interface.
+
+O tracemalloc deixa cada alocação mais lenta, então fica desligado por
+padrão: trace_allocations o liga (na interface, pela caixa "Medir
+alocações" da tela de Relatório ou pela variável SMASHMETRICS_TRACEMALLOC).
+"""
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def array_info(array):
+    """Forma, tipo e bytes de um array (ou Nones, se não for um array)."""
+    if isinstance(array, np.ndarray):
+        return list(array.shape), array.dtype.name, int(array.nbytes)
+    return None, None, None
+
+
+class Instrumentation:
+    def __init__(self):
+        self.sinks = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def add_sink(self, sink):
+        with self._lock:
+            self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        with self._lock:
+            self.sinks.remove(sink)
+
+    def emit(self, name, seconds, output=None, allocated=None):
+        shape, dtype, nbytes = array_info(output)
+        event = {
+            "stage": name,
+            "seconds": seconds,
+            "shape": shape,
+            "dtype": dtype,
+            "output_bytes": nbytes,
+            "allocated_bytes": allocated,
+            "timestamp": time.time(),
+        }
+        with self._lock:
+            sinks = list(self.sinks)
+        for sink in sinks:
+            sink(event)
+
+    def stage_timer(self):
+        """StageTimer ligado a esta instrumentação (ver core.segmentacao.stage_reporter)."""
+        return StageTimer(self)
+
+    @contextmanager
+    def measure(self, name):
+        """Mede um bloco `with`; atribua `resultado.output` ao array produzido."""
+        result = _Measurement()
+        timer = self.stage_timer()
+        yield result
+        timer.mark(name, result.output)
+
+
+class _Measurement:
+    output = None
+
+
+def trace_allocations(enabled=True):
+    """Liga (ou desliga) o tracemalloc, para que os eventos tragam os bytes alocados."""
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+class StageTimer:
+    """Mede etapas consecutivas: cada `mark` fecha o intervalo aberto no último `restart`.
+
+    O trabalho feito entre `mark` e `restart` (gerar imagens de visualização,
+    atualizar a barra de progresso) fica fora da conta.
+    """
+
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+        self.restart()
+
+    def restart(self):
+        self.start = time.perf_counter()
+        self.base = 0
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+
+    def mark(self, name, output=None):
+        seconds = time.perf_counter() - self.start
+        if not self.instrumentation.enabled:
+            return
+        allocated = None
+        if tracemalloc.is_tracing():
+            allocated = tracemalloc.get_traced_memory()[1] - self.base
+        self.instrumentation.emit(name, seconds, output, allocated)
+
+
+class StageAggregator:
+    """Acumula contagem, tempo total/máximo e última saída de cada etapa."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            entry = self.stages.setdefault(event["stage"], {
+                "count": 0, "total": 0.0, "max": 0.0, "allocated": None,
+            })
+            entry["count"] += 1
+            entry["total"] += event["seconds"]
+            entry["max"] = max(entry["max"], event["seconds"])
+            entry["shape"] = event["shape"]
+            entry["dtype"] = event["dtype"]
+            entry["output_bytes"] = event["output_bytes"]
+            if event["allocated_bytes"] is not None:
+                entry["allocated"] = max(entry["allocated"] or 0, event["allocated_bytes"])
+
+    def clear(self):
+        with self._lock:
+            self.stages.clear()
+
+    def format_table(self):
+        with self._lock:
+            stages = {name: dict(entry) for name, entry in self.stages.items()}
+        if not stages:
+            return "Nenhuma etapa medida ainda."
+        lines = [f"{'Etapa':<42} {'n':>4} {'média (ms)':>11} {'máx (ms)':>10} "
+                 f"{'saída':>18} {'MB':>8} {'alocado (MB)':>13}"]
+        for name, entry in stages.items():
+            shape = "x".join(str(n) for n in entry["shape"]) if entry["shape"] else "-"
+            size = entry["output_bytes"] / 2 ** 20 if entry["output_bytes"] else 0.0
+            allocated = ("-" if entry["allocated"] is None
+                         else f"{entry['allocated'] / 2 ** 20:.1f}")
+            lines.append(f"{name[:42]:<42} {entry['count']:>4} "
+                         f"{entry['total'] / entry['count'] * 1000:>11.1f} "
+                         f"{entry['max'] * 1000:>10.1f} "
+                         f"{shape + ' ' + (entry['dtype'] or ''):>18} {size:>8.1f} "
+                         f"{allocated:>13}")
+        total = sum(entry["total"] for entry in stages.values())
+        lines.append(f"Tempo total medido: {total * 1000:.1f} ms")
+        if all(entry["allocated"] is None for entry in stages.values()):
+            lines.append("Alocações não medidas: ligue \"Medir alocações\" "
+                         "(ou SMASHMETRICS_TRACEMALLOC) antes de processar.")
+        return "\n".join(lines)
+
+
+class JsonLinesSink:
+    """Grava cada evento como uma linha JSON em `path` (modo append)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,206 @@
+"""Segmentação em lote, sem interface gráfica.
+
+Uso:
+    python -m core.lote "Banco de dados PDI" saida --workers 4
+"""
+import argparse
+import csv
+import functools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from core.baixa_memoria import COMPACT_BYTES_PER_PIXEL, segment_with_budget
+from core.cache import StageCache
+from core.perfil import crush_profile
+from core.piramide import segment_pyramid
+from core.segmentacao import AUTO_ENGINE, ENGINES, segment_watershed
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+def list_images(input_dir):
+    return sorted(
+        os.path.join(input_dir, name)
+        for name in os.listdir(input_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def expand_inputs(paths):
+    """Troca cada pasta em `paths` pelas imagens que ela contém."""
+    image_paths = []
+    for path in paths:
+        image_paths.extend(list_images(path) if os.path.isdir(path) else [path])
+    return image_paths
+
+
+def save_labels(path_base, labels):
+    """Salva o mapa de rótulos como PNG de 16 bits (ou .npy se não couber)."""
+    if labels.max() <= np.iinfo(np.uint16).max:
+        path = path_base + "_labels.png"
+        cv2.imwrite(path, labels.astype(np.uint16))
+    else:
+        path = path_base + "_labels.npy"
+        np.save(path, labels)
+    return path
+
+
+def save_crush_profiles(path, results, stations):
+    """Grava um CSV com uma linha por imagem: rótulo, face, C1…CN, largura e média (px)."""
+    header = (["imagem", "rotulo", "face"] + [f"C{i}_px" for i in range(1, stations + 1)]
+              + ["largura_px", "media_px"])
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for image_path, info in sorted(results):
+            profile = info["crush_profile"]
+            writer.writerow([os.path.basename(image_path), profile["label"], profile["side"]]
+                            + [f"{depth:.2f}" for depth in profile["depths_px"]]
+                            + [f"{profile['width_px']:.2f}", f"{profile['mean_px']:.2f}"])
+
+
+def init_worker():
+    # cada processo já é um núcleo; evita que o OpenCV crie threads extras
+    cv2.setNumThreads(1)
+
+
+def segment_file(image_path, output_dir, engine=None, max_side=None,
+                 memory_budget=None, cache_dir=None, crush_stations=None):
+    """Segmenta um arquivo e grava rótulos e overlay. Executado nos workers.
+
+    Retorna um dicionário com os caminhos gravados e, no modo com orçamento de
+    memória, o modo escolhido e o pico de RSS medido. Com `crush_stations`,
+    inclui o perfil de deformação (core.perfil) em pixels. Sem `engine`, usa
+    "reconstruction32" no modo com orçamento e "reconstruction" nos outros.
+    """
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Falha ao carregar a imagem {image_path}")
+
+    if memory_budget:
+        result = segment_with_budget(image, budget=memory_budget,
+                                     engine=engine or "reconstruction32")
+    else:
+        # cada processo só vê uma imagem por vez: basta a camada em disco
+        cache = StageCache(max_bytes=0, disk_dir=cache_dir) if cache_dir else None
+        segment = functools.partial(segment_watershed, engine=engine or "reconstruction",
+                                    cache=cache)
+        if max_side:
+            result = segment_pyramid(image, max_side=max_side, segment=segment)
+        else:
+            result = segment(image)
+
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    path_base = os.path.join(output_dir, name)
+    labels_path = save_labels(path_base, result["labels"])
+    overlay_path = path_base + "_overlay.png"
+    cv2.imwrite(overlay_path, result["overlay"])
+
+    info = {"labels": labels_path, "overlay": overlay_path}
+    for key in ("mode", "peak_rss", "run_rss"):
+        if key in result:
+            info[key] = result[key]
+    if crush_stations:
+        info["crush_profile"] = crush_profile(result["labels"], stations=crush_stations)
+    return info
+
+
+def run_batch(image_paths, output_dir, workers=None, engine=None,
+              max_side=None, memory_budget=None, cache_dir=None, crush_stations=None):
+    """Segmenta vários arquivos em paralelo.
+
+    Retorna (resultados, falhas, segundos), onde `resultados` é uma lista de
+    (caminho, dicionário de segment_file) e `falhas` uma lista de
+    (caminho, mensagem de erro).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    failures = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker) as executor:
+        futures = {executor.submit(segment_file, path, output_dir, engine, max_side,
+                                   memory_budget, cache_dir, crush_stations): path
+                   for path in image_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                results.append((path, future.result()))
+            except Exception as e:
+                failures.append((path, str(e)))
+    return results, failures, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Segmentação watershed em lote de uma pasta de imagens."
+    )
+    parser.add_argument("input_dir", help="pasta com as imagens de entrada")
+    parser.add_argument("output_dir", help="pasta onde rótulos e overlays serão gravados")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="número de processos (padrão: número de núcleos)")
+    parser.add_argument("-e", "--engine", choices=[*ENGINES, AUTO_ENGINE], default=None,
+                        help="motor de imposição de mínimos (padrão: reconstruction, ou "
+                             "reconstruction32 com --memory-budget); auto escolhe o mais "
+                             "rápido que concorda com ele (ver core.selecao_motor)")
+    parser.add_argument("--max-side", type=int, default=None,
+                        help="modo pirâmide: segmenta com o maior lado reduzido a este "
+                             "valor e refina as bordas em escala cheia (não combina "
+                             "com --memory-budget)")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="modo de baixa memória: tipos float32/uint8/int32 e pico "
+                             "limitado a este orçamento por imagem (em MB); aceita "
+                             f"os motores {', '.join(COMPACT_BYTES_PER_PIXEL)}")
+    parser.add_argument("--cache-dir", default=None,
+                        help="pasta do cache em disco das etapas; reprocessar as "
+                             "mesmas imagens reaproveita os resultados")
+    parser.add_argument("--crush-stations", type=int, default=None, metavar="N",
+                        help="mede também o perfil de deformação C1…CN da maior região "
+                             "sem contato com a borda e grava perfil.csv (em pixels)")
+    args = parser.parse_args(argv)
+    if (args.memory_budget and args.engine is not None
+            and args.engine not in COMPACT_BYTES_PER_PIXEL):
+        parser.error(f"--memory-budget não tem estimativa de memória para o motor "
+                     f"{args.engine}; use {', '.join(COMPACT_BYTES_PER_PIXEL)}")
+    if args.memory_budget and args.max_side:
+        parser.error("--memory-budget escolhe sozinho o modo pirâmide e a escala; "
+                     "não use junto com --max-side")
+    if args.memory_budget and args.cache_dir:
+        parser.error("--memory-budget não usa o cache de etapas; não use junto com "
+                     "--cache-dir")
+
+    image_paths = list_images(args.input_dir)
+    if not image_paths:
+        print(f"Nenhuma imagem encontrada em {args.input_dir}", file=sys.stderr)
+        return 1
+
+    memory_budget = args.memory_budget * 2 ** 20 if args.memory_budget else None
+    results, failures, elapsed = run_batch(image_paths, args.output_dir, args.workers,
+                                           args.engine, args.max_side, memory_budget,
+                                           args.cache_dir, args.crush_stations)
+
+    for path, info in sorted(results):
+        if "peak_rss" in info:
+            print(f"{os.path.basename(path)}: {info['mode']}, pico de RSS "
+                  f"{info['peak_rss'] / 2 ** 20:.0f} MB "
+                  f"(+{info['run_rss'] / 2 ** 20:.0f} MB na execução)")
+    if args.crush_stations:
+        profile_path = os.path.join(args.output_dir, "perfil.csv")
+        save_crush_profiles(profile_path, results, args.crush_stations)
+        print(f"Perfis de deformação -> {profile_path}")
+    for path, message in failures:
+        print(f"Erro em {path}: {message}", file=sys.stderr)
+    done = len(results)
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"{done}/{len(image_paths)} imagens em {elapsed:.2f} s "
+          f"({rate:.2f} imagens/s, {args.workers} workers)")
+    return 0 if not failures else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+"""Edição interativa dos marcadores do watershed com reinundação incremental.
+
+Quando a segmentação sai quase certa, o operador corrige as sementes sobre
+o overlay em vez de refazer o pipeline inteiro:
+
+- adicionar uma semente divide a bacia clicada entre as sementes que ela já
+  tinha e a nova;
+- remover uma semente reinunda a bacia dela a partir das sementes que
+  sobraram e das bacias vizinhas (um anel de 1 pixel em volta), então a
+  área pode passar para as vizinhas;
+- unir duas bacias só troca o rótulo de uma delas, sem inundar nada.
+
+Em todos os casos só o retângulo envolvente das bacias afetadas é lido e
+escrito: o gradiente da segmentação original é reaproveitado (recortado), o
+mapa de rótulos é atualizado no lugar e o overlay é redesenhado só nesse
+retângulo. As bordas das outras bacias ficam como estavam, então uma
+correção custa o tamanho da bacia, não o da foto. A exceção é a bacia do
+fundo, que costuma cobrir boa parte da imagem: numa bacia maior que
+TASK_PIXELS, o MarkerTool roda a edição em segundo plano, com a barra de
+progresso, em vez de travar a interface.
+
+As sementes começam como os marcadores da segmentação (core.segmentacao,
+`keep_surface=True`), cada uma com o rótulo da bacia em que caiu, de modo
+que o rótulo de toda bacia é o da sua semente.
+"""
+import cv2
+import numpy as np
+from PySide6.QtGui import QColor, QPen
+from PySide6.QtCore import QObject, QPointF, QRectF, Qt, Signal
+from scipy import ndimage as ndi
+
+from core.instrumentacao import instrumentation
+from core.tarefas import Worker
+from core.segmentacao import BOUNDARY_COLOR, label_boundaries, reflood
+
+SEED_RADIUS = 4
+SEED_COLOR = (0, 255, 0)
+RING_KERNEL = np.ones((3, 3), np.uint8)
+# Memória máxima guardada para desfazer edições
+UNDO_BYTES = 256 * 2 ** 20
+# Bacias com retângulo maior que isto (o fundo, numa foto grande) são
+# reinundadas numa tarefa em segundo plano, para não travar a interface
+TASK_PIXELS = 2 ** 18
+
+
+def _bbox(mask, y0=0, x0=0):
+    """Retângulo (y0, y1, x0, x1) dos pixels verdadeiros de `mask`, deslocado por (y0, x0)."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not rows.size:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return (y0 + rows[0], y0 + rows[-1] + 1, x0 + cols[0], x0 + cols[-1] + 1)
+
+
+def _union(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3]))
+
+
+class MarkerEditor:
+    """Sementes, rótulos e overlay editáveis de uma segmentação já feita.
+
+    `labels` e `markers` são copiados (podem ser os arrays guardados no
+    core.cache.StageCache); `gradient` só é lido. `original` é a imagem sobre
+    a qual as bordas são desenhadas. `overlay` é o resultado limpo (bordas
+    em vermelho) e `view` o mesmo overlay com o contorno das sementes em
+    verde, exibido durante a edição.
+
+    Cada edição devolve o retângulo redesenhado (x0, y0, x1, y1), ou None se
+    nada mudou.
+    """
+
+    def __init__(self, labels, markers, gradient, original):
+        self.labels = np.array(labels, dtype=np.int32)
+        self.gradient = gradient
+        self.original = original
+        self.seeds = np.where(np.asarray(markers) > 0, self.labels, 0).astype(np.int32)
+        self.boxes = {
+            label: (found[0].start, found[0].stop, found[1].start, found[1].stop)
+            for label, found in enumerate(ndi.find_objects(self.labels), start=1)
+            if found is not None
+        }
+        self.next_label = int(self.labels.max()) + 1
+        self._undo = []
+        self._undo_bytes = 0
+
+        height, width = self.labels.shape
+        self.overlay = np.empty((height, width, 3), np.uint8)
+        self.view = np.empty_like(self.overlay)
+        self._render((0, height, 0, width))
+
+    ############################################################
+    # Edições
+    ############################################################
+    def add_seed(self, x, y, radius=SEED_RADIUS):
+        """Nova semente em (x, y); divide a bacia clicada."""
+        basin = self._basin_at(x, y)
+        if basin is None:
+            return None
+        with instrumentation.measure("Marcadores: adicionar semente") as measured:
+            box = self.boxes[basin]
+            self._push_undo(box)
+            y0, y1, x0, x1 = box
+            region = self.labels[y0:y1, x0:x1] == basin
+            rows, cols = np.ogrid[y0:y1, x0:x1]
+            disk = region & ((rows - y) ** 2 + (cols - x) ** 2 <= radius ** 2)
+            seeds = self.seeds[y0:y1, x0:x1]
+            seeds[disk] = self.next_label
+            self.next_label += 1
+            measured.output = self._reflood(box, region, seeds * region, basin)
+        return self._rectangle(self._grow(box, 1))
+
+    def remove_seed(self, x, y):
+        """Apaga a semente (componente conexa) sob (x, y) e reinunda a bacia dela."""
+        x, y = int(round(x)), int(round(y))
+        if not self._inside(x, y) or not self.seeds[y, x]:
+            return None
+        basin = int(self.labels[y, x])
+        with instrumentation.measure("Marcadores: remover semente") as measured:
+            # a bacia mais um anel de 1 pixel com os rótulos das vizinhas
+            box = self._grow(self.boxes[basin], 1)
+            y0, y1, x0, x1 = box
+            labels = self.labels[y0:y1, x0:x1]
+            seeds = self.seeds[y0:y1, x0:x1]
+            region = labels == basin
+            components, _ = ndi.label(seeds == seeds[y - y0, x - x0],
+                                      structure=np.ones((3, 3)))
+            removed = components == components[y - y0, x - x0]
+            ring = cv2.dilate(region.view(np.uint8), RING_KERNEL).view(bool) & ~region
+            flood_seeds = np.where(region & ~removed, seeds, 0)
+            flood_seeds[ring] = labels[ring]
+            if not flood_seeds.any():
+                # a única semente da imagem: não sobraria nada para inundar
+                return None
+            self._push_undo(box)
+            seeds[removed] = 0
+            measured.output = self._reflood(box, region, flood_seeds, basin,
+                                            mask=region | ring)
+        return self._rectangle(self._grow(box, 1))
+
+    def merge(self, point_a, point_b):
+        """Une a bacia sob `point_b` à bacia sob `point_a`, sem inundar de novo."""
+        keep = self._basin_at(*point_a)
+        drop = self._basin_at(*point_b)
+        if keep is None or drop is None or keep == drop:
+            return None
+        with instrumentation.measure("Marcadores: unir bacias") as measured:
+            box = self.boxes[drop]
+            self._push_undo(box)
+            y0, y1, x0, x1 = box
+            for array in (self.labels, self.seeds):
+                crop = array[y0:y1, x0:x1]
+                crop[crop == drop] = keep
+            self.boxes[keep] = _union(self.boxes[keep], box)
+            del self.boxes[drop]
+            self._render(box)
+            measured.output = self.labels[y0:y1, x0:x1]
+        return self._rectangle(self._grow(box, 1))
+
+    def undo(self):
+        """Desfaz a última edição; devolve o retângulo restaurado."""
+        if not self._undo:
+            return None
+        box, labels, seeds, boxes = self._undo.pop()
+        self._undo_bytes -= labels.nbytes + seeds.nbytes
+        y0, y1, x0, x1 = box
+        self.labels[y0:y1, x0:x1] = labels
+        self.seeds[y0:y1, x0:x1] = seeds
+        self.boxes = boxes
+        self._render(box)
+        return self._rectangle(self._grow(box, 1))
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    def basin_at(self, x, y):
+        """Rótulo da bacia em (x, y) e o seu retângulo (x0, y0, x1, y1), ou None."""
+        basin = self._basin_at(x, y)
+        return None if basin is None else (basin, self._rectangle(self.boxes[basin]))
+
+    ############################################################
+    # Reinundação e desenho restritos a um retângulo
+    ############################################################
+    def _reflood(self, box, region, seeds, basin, mask=None):
+        """Watershed das `seeds` dentro de `mask` (por padrão, `region`, a bacia `basin`).
+
+        Só `region` é gravada no mapa de rótulos.
+
+        A inundação é semeada direto sobre o gradiente, sem impor os mínimos
+        por reconstrução: a bacia de cada pixel é a mesma, e só o desempate
+        em platôs pode diferir, como no motor "seeded" de core.segmentacao.
+        A reconstrução custaria mais que o resto da edição.
+        """
+        if mask is None:
+            mask = region
+        y0, y1, x0, x1 = box
+        flooded = reflood(self.gradient[y0:y1, x0:x1], seeds, mask)
+
+        labels = self.labels[y0:y1, x0:x1]
+        labels[region] = flooded[region]
+        self._update_boxes(box, region, basin, np.unique(seeds[seeds > 0]), labels)
+        self._render(box)
+        return labels
+
+    def _update_boxes(self, box, region, basin, present, labels):
+        """Retângulos da bacia reinundada (inteira no recorte) e das que ganharam área nela."""
+        y0, _, x0, _ = box
+        found = _bbox(labels == basin, y0, x0)
+        if found is None:
+            del self.boxes[basin]
+        else:
+            self.boxes[basin] = found
+        for label in present:
+            if label != basin:
+                self.boxes[label] = _union(self.boxes.get(label),
+                                           _bbox(region & (labels == label), y0, x0))
+
+    def _render(self, box):
+        """Redesenha overlay e vista no retângulo alterado mais 1 pixel em volta.
+
+        Um pixel logo fora de `box` pode deixar de ser (ou passar a ser) borda
+        quando o rótulo do vizinho de dentro muda, então ele também é
+        redesenhado, lendo os rótulos com mais 1 pixel de contexto.
+        """
+        box = self._grow(box, 1)
+        y0, y1, x0, x1 = box
+        gy0, gy1, gx0, gx1 = self._grow(box, 1)
+        inner = (slice(y0 - gy0, y1 - gy0), slice(x0 - gx0, x1 - gx0))
+        boundary = label_boundaries(self.labels[gy0:gy1, gx0:gx1])[inner]
+        seed_edges = label_boundaries(self.seeds[gy0:gy1, gx0:gx1])[inner]
+
+        overlay = self.overlay[y0:y1, x0:x1]
+        original = self.original[y0:y1, x0:x1]
+        if original.ndim == 2:
+            overlay[:] = original[:, :, None]
+        else:
+            overlay[:] = original[:, :, :3]
+        overlay[boundary] = BOUNDARY_COLOR
+        view = self.view[y0:y1, x0:x1]
+        view[:] = overlay
+        view[seed_edges] = SEED_COLOR
+
+    ############################################################
+    # Auxiliares
+    ############################################################
+    def _inside(self, x, y):
+        return 0 <= y < self.labels.shape[0] and 0 <= x < self.labels.shape[1]
+
+    def _basin_at(self, x, y):
+        x, y = int(round(x)), int(round(y))
+        if not self._inside(x, y) or not self.labels[y, x]:
+            return None
+        return int(self.labels[y, x])
+
+    def _grow(self, box, margin):
+        height, width = self.labels.shape
+        y0, y1, x0, x1 = box
+        return (max(y0 - margin, 0), min(y1 + margin, height),
+                max(x0 - margin, 0), min(x1 + margin, width))
+
+    @staticmethod
+    def _rectangle(box):
+        y0, y1, x0, x1 = box
+        return (int(x0), int(y0), int(x1), int(y1))
+
+    def _push_undo(self, box):
+        y0, y1, x0, x1 = box
+        entry = (box, self.labels[y0:y1, x0:x1].copy(), self.seeds[y0:y1, x0:x1].copy(),
+                 dict(self.boxes))
+        self._undo.append(entry)
+        self._undo_bytes += entry[1].nbytes + entry[2].nbytes
+        while len(self._undo) > 1 and self._undo_bytes > UNDO_BYTES:
+            _, labels, seeds, _ = self._undo.pop(0)
+            self._undo_bytes -= labels.nbytes + seeds.nbytes
+
+
+def _run_edit(edit, *args, progress=None):
+    """Executa uma edição do MarkerEditor como função de core.tarefas.Worker."""
+    return edit(*args)
+
+
+class MarkerTool(QObject):
+    """Edita as sementes de um MarkerEditor num ImageViewer (ver ImageViewer.set_tool).
+
+    Clique esquerdo adiciona uma semente, Shift+clique remove a semente sob
+    o cursor, Ctrl+clique em duas bacias une a segunda à primeira, botão
+    direito desfaz e Enter/Esc encerram. Emite `edited(retângulo)` a cada
+    edição e `finished()` ao encerrar.
+
+    Com `tasks` (um objeto com `start_task` e `current_task`, como a
+    SmashMetricsUI), adicionar ou remover sementes numa bacia maior que
+    TASK_PIXELS roda em segundo plano; enquanto houver uma tarefa em
+    andamento, cliques e teclas são ignorados.
+    """
+
+    edited = Signal(tuple)
+    finished = Signal()
+
+    def __init__(self, viewer, editor, tasks=None, parent=None):
+        super().__init__(parent)
+        self.viewer = viewer
+        self.editor = editor
+        self.tasks = tasks
+        self.selected = None
+
+    def image_point(self, pos):
+        point = self.viewer.map_to_image(pos)
+        return point.x() - 0.5, point.y() - 0.5
+
+    def cursor_moved(self, pos):
+        pass
+
+    def mouse_press(self, event):
+        if self.viewer.pyramid is None:
+            return False
+        if self._busy():
+            return True
+        if event.button() == Qt.RightButton:
+            self._select(None)
+            self._apply(self.editor.undo())
+            return True
+        if event.button() != Qt.LeftButton:
+            return False
+        point = self.image_point(event.position())
+        modifiers = event.modifiers()
+        if modifiers & Qt.ControlModifier:
+            if self.selected is None:
+                self._select(point)
+            else:
+                first = self.selected[0]
+                self._select(None)
+                self._apply(self.editor.merge(first, point))
+        elif modifiers & Qt.ShiftModifier:
+            self._edit(self.editor.remove_seed, point, "Removendo a semente")
+        else:
+            self._edit(self.editor.add_seed, point, "Adicionando a semente")
+        return True
+
+    def key_press(self, event):
+        if self._busy():
+            return True
+        if event.key() in (Qt.Key_Escape, Qt.Key_Return, Qt.Key_Enter):
+            self.finished.emit()
+            return True
+        return False
+
+    def _busy(self):
+        return self.tasks is not None and self.tasks.current_task is not None
+
+    def _edit(self, edit, point, description):
+        """Aplica `edit(x, y)` na hora ou, numa bacia grande, numa tarefa em segundo plano."""
+        basin = self.editor.basin_at(*point)
+        if self.tasks is not None and basin is not None:
+            x0, y0, x1, y1 = basin[1]
+            if (x1 - x0) * (y1 - y0) > TASK_PIXELS:
+                self.tasks.start_task(Worker(_run_edit, edit, *point), description,
+                                      self._apply)
+                return
+        self._apply(edit(*point))
+
+    def _apply(self, rectangle):
+        if rectangle is None:
+            return
+        self.viewer.refresh_region(*rectangle)
+        self.edited.emit(rectangle)
+
+    def _select(self, point):
+        """Guarda a primeira bacia de uma união (ponto, retângulo) e repinta o destaque."""
+        previous = self.selected
+        basin = None if point is None else self.editor.basin_at(*point)
+        self.selected = None if basin is None else (point, basin[1])
+        for selection in (previous, self.selected):
+            if selection is not None:
+                self.viewer.update(self._widget_rect(selection[1]).toAlignedRect()
+                                   .adjusted(-3, -3, 3, 3))
+
+    def _widget_rect(self, rectangle):
+        x0, y0, x1, y1 = rectangle
+        return QRectF(self.viewer.map_from_image(QPointF(x0, y0)),
+                      self.viewer.map_from_image(QPointF(x1, y1)))
+
+    def paint(self, painter):
+        if self.selected is None:
+            return
+        painter.setPen(QPen(QColor(255, 255, 0), 2, Qt.DashLine))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawRect(self._widget_rect(self.selected[1]))
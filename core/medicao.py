@@ -0,0 +1,243 @@
+"""Ferramenta de medição sobre o core.visualizador.ImageViewer.
+
+Substitui as janelas do OpenCV de Funcionalidades.select_points: os pontos
+são marcados direto na tela de análise. A cada movimento do mouse só os
+retângulos alterados (lupa, cursor, linha elástica) são repintados, e a lupa
+sai da MipPyramid já usada na exibição, então nada proporcional ao tamanho
+da imagem é copiado ou reescalado.
+
+Com `snap`, o ponto é atraído para a borda mais forte (magnitude do Sobel)
+num raio pequeno em volta do cursor, com precisão subpixel. O Sobel é
+calculado só nessa janela, a cada movimento, em vez de um mapa de bordas da
+imagem inteira.
+"""
+import math
+
+import cv2
+import numpy as np
+from PySide6.QtGui import QColor, QPen, QRegion
+from PySide6.QtCore import QObject, QEventLoop, QPointF, QRectF, Qt, Signal
+
+from core.galeria import to_qimage
+
+SNAP_RADIUS = 6
+MAGNIFIER_SIZE = 160
+MAGNIFIER_ZOOM = 4
+
+
+def snap_to_edge(image, x, y, radius=SNAP_RADIUS):
+    """Ponto de maior gradiente (Sobel) a até `radius` pixels de (x, y).
+
+    As coordenadas são índices de pixel (o centro do pixel i é i). O máximo é
+    refinado com uma parábola em x e em y. Sem borda na janela, devolve o
+    próprio (x, y).
+    """
+    h, w = image.shape[:2]
+    cx, cy = int(round(x)), int(round(y))
+    x0, x1 = max(cx - radius - 1, 0), min(cx + radius + 2, w)
+    y0, y1 = max(cy - radius - 1, 0), min(cy + radius + 2, h)
+    if x1 - x0 < 3 or y1 - y0 < 3:
+        return x, y
+    window = image[y0:y1, x0:x1]
+    if window.ndim == 3:
+        window = cv2.cvtColor(window[:, :, :3], cv2.COLOR_BGR2GRAY)
+    window = window.astype(np.float32)
+    magnitude = cv2.magnitude(cv2.Sobel(window, cv2.CV_32F, 1, 0, ksize=3),
+                              cv2.Sobel(window, cv2.CV_32F, 0, 1, ksize=3))
+
+    # só o disco em volta do cursor, sem a moldura onde o Sobel extrapola
+    rows, cols = np.ogrid[y0:y1, x0:x1]
+    outside = (rows - cy) ** 2 + (cols - cx) ** 2 > radius ** 2
+    magnitude[outside] = 0
+    magnitude[[0, -1], :] = 0
+    magnitude[:, [0, -1]] = 0
+    peak = magnitude.max()
+    if peak <= 0:
+        return x, y
+    # ao longo de uma borda reta o gradiente empata: fica o ponto mais próximo
+    distance2 = (rows - y) ** 2 + (cols - x) ** 2
+    row, col = np.unravel_index(np.argmax(magnitude - 1e-3 * peak * distance2),
+                                magnitude.shape)
+
+    def refine(before, center, after):
+        denominator = before - 2 * center + after
+        return 0.5 * (before - after) / denominator if denominator < 0 else 0.0
+
+    dx = refine(magnitude[row, col - 1], magnitude[row, col], magnitude[row, col + 1])
+    dy = refine(magnitude[row - 1, col], magnitude[row, col], magnitude[row + 1, col])
+    return x0 + col + dx, y0 + row + dy
+
+
+class MeasurementTool(QObject):
+    """Marca `count` pontos num ImageViewer (ver ImageViewer.set_tool).
+
+    Botão esquerdo marca, botão direito desfaz o último ponto, Esc cancela.
+    Emite `finished(pontos)` com os pontos em índices de pixel da imagem
+    exibida, ou `cancelled(pontos)` com os que já tinham sido marcados.
+    """
+
+    finished = Signal(list)
+    cancelled = Signal(list)
+
+    def __init__(self, viewer, count=2, snap=False, parent=None):
+        super().__init__(parent)
+        self.viewer = viewer
+        self.count = count
+        self.snap = snap
+        self.points = []
+        self.cursor = None
+        self._dirty = QRegion()
+
+    def image_point(self, pos):
+        """Ponto da imagem sob `pos` (coordenadas do widget), já com o ajuste à borda."""
+        point = self.viewer.map_to_image(pos)
+        x, y = point.x() - 0.5, point.y() - 0.5
+        if self.snap:
+            x, y = snap_to_edge(self.viewer.pyramid.image, x, y)
+        return QPointF(x, y)
+
+    def widget_point(self, point):
+        return self.viewer.map_from_image(QPointF(point.x() + 0.5, point.y() + 0.5))
+
+    def cursor_moved(self, pos):
+        if self.viewer.pyramid is None:
+            return
+        self.cursor = None if pos is None else self.image_point(pos)
+        self._refresh()
+
+    def mouse_press(self, event):
+        if self.viewer.pyramid is None:
+            return False
+        if event.button() == Qt.LeftButton:
+            self.points.append(self.image_point(event.position()))
+            self._refresh()
+            if len(self.points) == self.count:
+                self.finished.emit(self.result())
+            return True
+        if event.button() == Qt.RightButton:
+            if self.points:
+                self.points.pop()
+                self._refresh()
+            return True
+        return False
+
+    def key_press(self, event):
+        if event.key() == Qt.Key_Escape:
+            self.cancelled.emit(self.result())
+            return True
+        return False
+
+    def result(self):
+        return [(point.x(), point.y()) for point in self.points]
+
+    def _refresh(self):
+        """Repinta a área ocupada antes e a ocupada agora pelos desenhos."""
+        region = self._overlay_region()
+        self.viewer.update(self._dirty.united(region))
+        self._dirty = region
+
+    def _overlay_region(self):
+        region = QRegion()
+        marks = list(self.points)
+        if self.cursor is not None:
+            marks.append(self.cursor)
+            region = region.united(self._magnifier_rect().toAlignedRect().adjusted(-2, -2, 2, 2))
+        screen = [self.widget_point(point) for point in marks]
+        for point in screen:
+            region = region.united(QRectF(point.x() - 8, point.y() - 8, 16, 16).toAlignedRect())
+        for start, end in zip(screen, screen[1:]):
+            region = region.united(QRectF(start, end).normalized()
+                                   .adjusted(-3, -3, 3, 3).toAlignedRect())
+        return region
+
+    def _magnifier_rect(self):
+        """Lupa ao lado do cursor, trocando de lado perto das bordas do widget."""
+        pos = self.widget_point(self.cursor)
+        viewport = self.viewer.viewport()
+        x = pos.x() + 24
+        y = pos.y() + 24
+        if x + MAGNIFIER_SIZE > viewport.right():
+            x = pos.x() - 24 - MAGNIFIER_SIZE
+        if y + MAGNIFIER_SIZE > viewport.bottom():
+            y = pos.y() - 24 - MAGNIFIER_SIZE
+        return QRectF(x, y, MAGNIFIER_SIZE, MAGNIFIER_SIZE)
+
+    def paint(self, painter):
+        marks = list(self.points)
+        if self.cursor is not None and len(self.points) < self.count:
+            marks.append(self.cursor)
+        screen = [self.widget_point(point) for point in marks]
+
+        painter.setRenderHint(painter.RenderHint.Antialiasing, True)
+        painter.setPen(QPen(QColor(0, 255, 0), 2))
+        for start, end in zip(screen, screen[1:]):
+            painter.drawLine(start, end)
+        painter.setBrush(QColor(0, 255, 0))
+        for point in screen[:len(self.points)]:
+            painter.drawEllipse(point, 5, 5)
+        painter.setBrush(Qt.NoBrush)
+        if self.cursor is not None:
+            painter.setPen(QPen(QColor(255, 0, 0), 1))
+            painter.drawEllipse(self.widget_point(self.cursor), 4, 4)
+            self.paint_magnifier(painter)
+
+    def paint_magnifier(self, painter):
+        """Região em volta do cursor, ampliada a partir do nível adequado da pirâmide."""
+        pyramid = self.viewer.pyramid
+        scale = min(self.viewer.view_scale() * MAGNIFIER_ZOOM, self.viewer.MAX_PIXEL_SCALE)
+        level = pyramid.level_for(scale)
+        array = pyramid.array(level)
+        factor = array.shape[1] / pyramid.width
+
+        half = MAGNIFIER_SIZE / (2 * scale)
+        cx, cy = self.cursor.x() + 0.5, self.cursor.y() + 0.5
+        source = QRectF((cx - half) * factor, (cy - half) * factor,
+                        2 * half * factor, 2 * half * factor)
+        x0 = max(int(math.floor(source.left())), 0)
+        y0 = max(int(math.floor(source.top())), 0)
+        x1 = min(int(math.ceil(source.right())), array.shape[1])
+        y1 = min(int(math.ceil(source.bottom())), array.shape[0])
+
+        rect = self._magnifier_rect()
+        painter.fillRect(rect, QColor("#2c3e50"))
+        if x1 > x0 and y1 > y0:
+            visible = source.intersected(QRectF(x0, y0, x1 - x0, y1 - y0))
+            target = QRectF(rect.left() + (visible.left() - source.left()) / factor * scale,
+                            rect.top() + (visible.top() - source.top()) / factor * scale,
+                            visible.width() / factor * scale,
+                            visible.height() / factor * scale)
+            painter.setRenderHint(painter.RenderHint.SmoothPixmapTransform, False)
+            painter.drawImage(target, to_qimage(array[y0:y1, x0:x1]),
+                              visible.translated(-x0, -y0))
+        painter.setPen(QPen(QColor(255, 0, 0), 1))
+        middle = rect.center()
+        painter.drawLine(QPointF(middle.x() - 8, middle.y()), QPointF(middle.x() + 8, middle.y()))
+        painter.drawLine(QPointF(middle.x(), middle.y() - 8), QPointF(middle.x(), middle.y() + 8))
+        painter.setPen(QPen(QColor("#ecf0f1"), 1))
+        painter.drawRect(rect)
+
+
+def pick_points(viewer, image, count=2, snap=False):
+    """Exibe `image` no visualizador e espera o usuário marcar `count` pontos.
+
+    Bloqueia como um diálogo modal (QEventLoop local). Retorna a lista de
+    pontos (x, y) em índices de pixel de `image`; com Esc, retorna os pontos
+    marcados até ali.
+    """
+    viewer.set_image(image)
+    tool = MeasurementTool(viewer, count, snap)
+    points = []
+    loop = QEventLoop()
+
+    def done(result):
+        points.extend(result)
+        loop.quit()
+
+    tool.finished.connect(done)
+    tool.cancelled.connect(done)
+    viewer.set_tool(tool)
+    try:
+        loop.exec()
+    finally:
+        viewer.set_tool(None)
+    return points
@@ -0,0 +1,236 @@
+"""Perfil de deformação (crush profile) de Campbell a partir do mapa de rótulos do watershed.
+
+A região de deformação é um rótulo de `labels`: o informado ou, por padrão,
+o maior que não toca a borda da foto (select_region). O recorte da região é
+girado para que o seu eixo maior (regionprops) fique na horizontal; a face
+amassada é o lado desse eixo onde a região mais se afasta do fecho convexo.
+
+A borda do fecho convexo nesse lado faz o papel da linha original, não
+deformada, do veículo. Uma transformada de distância a partir dela dá, para
+cada pixel, a profundidade perpendicular até essa linha; as estações C1…CN
+são colunas igualmente espaçadas entre as pontas da largura danificada (C1 e
+CN nas pontas, como no protocolo de Campbell), e a profundidade de cada uma
+é a distância no ponto da superfície amassada naquela coluna. Tudo é feito
+com operações vetorizadas sobre o recorte, sem laços por pixel.
+
+Uso:
+    python -m core.perfil saida/img52_labels.png --stations 6 --scale 0.05
+"""
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+DEFAULT_STATIONS = 6
+SIDES = ("auto", "top", "bottom")
+
+
+def select_region(labels):
+    """Rótulo mais provável da deformação: o de maior área sem contato com a borda.
+
+    Se todos tocam a borda, fica o de maior área. O rótulo 0 (fundo) é ignorado.
+    """
+    areas = np.bincount(labels.ravel())
+    areas[0] = 0
+    if not areas.any():
+        raise ValueError("O mapa de rótulos não tem nenhuma região")
+    border = np.unique(np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]]))
+    interior = areas.copy()
+    interior[border] = 0
+    return int(interior.argmax() if interior.any() else areas.argmax())
+
+
+def _upright(region, orientation):
+    """Gira a máscara recortada `region` deixando o eixo maior na horizontal.
+
+    Retorna a máscara girada e a matriz afim que leva as coordenadas (x, y)
+    da máscara girada de volta às do recorte.
+    """
+    h, w = region.shape
+    side = int(np.ceil(np.hypot(h, w))) + 2
+    # regionprops mede o ângulo do eixo maior a partir do eixo das linhas;
+    # aqui ele é convertido para o ângulo a partir do eixo x (y para baixo)
+    angle = 90.0 - np.degrees(orientation)
+    forward = cv2.getRotationMatrix2D(((w - 1) / 2, (h - 1) / 2), angle, 1.0)
+    forward[:, 2] += ((side - w) / 2, (side - h) / 2)
+    rotated = cv2.warpAffine(region.astype(np.uint8), forward, (side, side),
+                             flags=cv2.INTER_NEAREST)
+    return rotated.astype(bool), cv2.invertAffineTransform(forward)
+
+
+def _convex_fill(mask):
+    hull = np.zeros(mask.shape, dtype=np.uint8)
+    cv2.fillConvexPoly(hull, cv2.convexHull(cv2.findNonZero(mask.astype(np.uint8))), 1)
+    return hull.astype(bool) | mask
+
+
+def _top_rows(mask):
+    """Primeira linha ocupada de cada coluna (o tamanho da máscara nas vazias)."""
+    return np.where(mask.any(axis=0), mask.argmax(axis=0), mask.shape[0])
+
+
+def crush_profile(labels, label=None, stations=DEFAULT_STATIONS, side="auto",
+                  scale=None, progress=None):
+    """Profundidades de deformação C1…C`stations` de uma região de `labels`.
+
+    `side` escolhe a face amassada em relação ao eixo maior ("top" ou
+    "bottom" na região girada); "auto" fica com a de maior área entre a
+    região e o fecho convexo. Com `scale` (cm/px), acrescenta os valores em
+    cm. Retorna um dicionário com o rótulo, a face, as profundidades em
+    pixels (`depths_px`), a largura danificada, a deformação média pela
+    regra dos trapézios de Campbell, a máxima e, em `segments`, os pares
+    (ponto na linha original, ponto na superfície) de cada estação em
+    coordenadas (x, y) da imagem.
+    """
+    if stations < 2:
+        raise ValueError("O perfil precisa de pelo menos duas estações")
+    if side not in SIDES:
+        raise ValueError(f"Face desconhecida: {side}")
+    if label is None:
+        label = select_region(labels)
+    # importados aqui para não pesar na abertura da interface
+    from scipy import ndimage as ndi
+    from skimage import measure
+
+    ############################################################
+    # 1. propriedades da região e recorte alinhado ao eixo maior
+    ############################################################
+    props = measure.regionprops((labels == label).astype(np.uint8))
+    if not props:
+        raise ValueError(f"Rótulo {label} ausente do mapa de rótulos")
+    props = props[0]
+    row0, col0 = props.bbox[:2]
+    region, back = _upright(props.image, props.orientation)
+    if progress:
+        progress(1, 3, "Alinhando a região")
+
+    ############################################################
+    # 2. face amassada: lado com maior área fora do fecho convexo
+    ############################################################
+    hull = _convex_fill(region)
+    columns = np.flatnonzero(region.any(axis=0))
+    first, last = columns[0], columns[-1]
+    span = slice(first, last + 1)
+    gaps = {
+        "top": int((_top_rows(region) - _top_rows(hull))[span].sum()),
+        "bottom": int((_top_rows(region[::-1]) - _top_rows(hull[::-1]))[span].sum()),
+    }
+    if side == "auto":
+        side = max(gaps, key=gaps.get)
+    if side == "bottom":
+        region, hull = region[::-1], hull[::-1]
+    surface = _top_rows(region)
+    reference = _top_rows(hull)
+    if progress:
+        progress(2, 3, "Identificando a face amassada")
+
+    ############################################################
+    # 3. transformada de distância a partir da linha original
+    ############################################################
+    depth = int(surface[span].max()) + 1
+    line = np.ones((depth, region.shape[1]), dtype=bool)
+    line[reference[span], np.arange(first, last + 1)] = False
+    distance, (near_rows, near_cols) = ndi.distance_transform_edt(line, return_indices=True)
+
+    station_cols = np.round(np.linspace(first, last, stations)).astype(np.intp)
+    station_rows = surface[station_cols]
+    depths_px = distance[station_rows, station_cols]
+    if progress:
+        progress(3, 3, "Medindo as estações")
+
+    ############################################################
+    # 4. pontos das estações de volta às coordenadas da imagem
+    ############################################################
+    points = np.stack([
+        np.stack([near_cols[station_rows, station_cols],
+                  near_rows[station_rows, station_cols]], axis=-1),
+        np.stack([station_cols, station_rows], axis=-1),
+    ], axis=1).astype(np.float64)
+    if side == "bottom":
+        points[..., 1] = region.shape[0] - 1 - points[..., 1]
+    segments = points @ back[:, :2].T + back[:, 2] + (col0, row0)
+
+    width_px = float(np.hypot(*(segments[-1, 0] - segments[0, 0])))
+    mean_px = float((depths_px.sum() - (depths_px[0] + depths_px[-1]) / 2) / (stations - 1))
+    profile = {
+        "label": label,
+        "side": side,
+        "depths_px": depths_px,
+        "width_px": width_px,
+        "mean_px": mean_px,
+        "max_px": float(depths_px.max()),
+        "segments": segments,
+    }
+    if scale is not None:
+        profile.update(
+            scale=scale,
+            depths_cm=depths_px * scale,
+            width_cm=width_px * scale,
+            mean_cm=mean_px * scale,
+            max_cm=float(depths_px.max()) * scale,
+        )
+    return profile
+
+
+def draw_crush_profile(image, profile, color=(0, 255, 255)):
+    """Cópia de `image` (BGR) com as estações C1…CN desenhadas."""
+    canvas = image.copy() if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    thickness = max(1, round(max(canvas.shape[:2]) / 800))
+    for i, (reference, surface) in enumerate(profile["segments"], start=1):
+        start = tuple(int(v) for v in np.round(reference))
+        end = tuple(int(v) for v in np.round(surface))
+        cv2.line(canvas, start, end, color, thickness, cv2.LINE_AA)
+        cv2.circle(canvas, end, 2 * thickness, color, -1, cv2.LINE_AA)
+        cv2.putText(canvas, f"C{i}", (start[0] + 2 * thickness, start[1] - 2 * thickness),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.4 * thickness, color, thickness, cv2.LINE_AA)
+    return canvas
+
+
+def format_crush_profile(profile):
+    """Linhas de texto do relatório com as profundidades de cada estação."""
+    unit = "cm" if "depths_cm" in profile else "px"
+    depths = profile["depths_cm"] if unit == "cm" else profile["depths_px"]
+    width = profile["width_cm"] if unit == "cm" else profile["width_px"]
+    mean = profile["mean_cm"] if unit == "cm" else profile["mean_px"]
+    return (
+        f"**Perfil de Deformação ({len(depths)} estações, região {profile['label']})**\n"
+        + "".join(f"- C{i}: {depth:.2f} {unit}\n" for i, depth in enumerate(depths, start=1))
+        + f"- Largura danificada: {width:.2f} {unit}\n"
+        f"- Deformação média (Campbell): {mean:.2f} {unit}\n"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Perfil de deformação de Campbell a partir de um mapa de rótulos."
+    )
+    parser.add_argument("labels", help="mapa de rótulos gravado por core.lote (_labels.png ou .npy)")
+    parser.add_argument("-n", "--stations", type=int, default=DEFAULT_STATIONS,
+                        help=f"número de estações (padrão: {DEFAULT_STATIONS}, C1…C6)")
+    parser.add_argument("-l", "--label", type=int, default=None,
+                        help="rótulo da região (padrão: maior região sem contato com a borda)")
+    parser.add_argument("--side", choices=SIDES, default="auto",
+                        help="face amassada em relação ao eixo maior da região")
+    parser.add_argument("--scale", type=float, default=None,
+                        help="fator de escala em cm/px")
+    args = parser.parse_args(argv)
+
+    if args.labels.endswith(".npy"):
+        labels = np.load(args.labels)
+    else:
+        labels = cv2.imread(args.labels, cv2.IMREAD_UNCHANGED)
+    if labels is None:
+        print(f"Falha ao carregar {args.labels}", file=sys.stderr)
+        return 1
+    try:
+        profile = crush_profile(labels, args.label, args.stations, args.side, args.scale)
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    print(format_crush_profile(profile), end="")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
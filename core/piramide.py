@@ -0,0 +1,128 @@
+"""Segmentação multirresolução para fotografias muito grandes.
+
+O watershed completo roda sobre uma versão reduzida da imagem. Na resolução
+original só é refeita uma faixa estreita em volta das bordas grosseiras, em
+blocos sobrepostos; o resto da imagem herda os rótulos ampliados. Assim a
+memória fica limitada ao tamanho do bloco e o tempo acompanha o comprimento
+das bordas, e não a área da foto.
+"""
+import functools
+import math
+
+import cv2
+import numpy as np
+from skimage import segmentation, filters
+
+from core.segmentacao import BOUNDARY_COLOR, label_boundaries, segment_watershed
+
+
+def pyramid_scale(shape, max_side):
+    """Fator inteiro de redução para que o maior lado caiba em `max_side`."""
+    return max(1, math.ceil(max(shape[:2]) / max_side))
+
+
+def iter_tiles(shape, tile, overlap):
+    """Gera (bloco com margem, bloco útil) como pares de fatias (linhas, colunas)."""
+    height, width = shape[:2]
+    for y in range(0, height, tile):
+        for x in range(0, width, tile):
+            core = (slice(y, min(y + tile, height)), slice(x, min(x + tile, width)))
+            outer = (slice(max(y - overlap, 0), min(y + tile + overlap, height)),
+                     slice(max(x - overlap, 0), min(x + tile + overlap, width)))
+            yield outer, core
+
+
+def inner_slices(outer, core):
+    """Posição do bloco útil `core` dentro do bloco com margem `outer`."""
+    return tuple(slice(c.start - o.start, c.stop - o.start) for o, c in zip(outer, core))
+
+
+def segment_pyramid(image, original=None, max_side=1500, band=2, tile=1024,
+                    capture=None, progress=None, engine="reconstruction",
+                    segment=None):
+    """Segmenta `image` em uma escala reduzida e refina as bordas em escala cheia.
+
+    `max_side` é o maior lado da imagem reduzida e `band` a meia largura, em
+    pixels da escala reduzida, da faixa refeita em volta de cada borda.
+    `capture` e `engine` valem para a segmentação reduzida, feita por
+    `segment` (por padrão, segment_watershed); `progress` recebe as 12 etapas
+    dela e depois um passo por bloco refinado.
+
+    Retorna o mesmo dicionário que core.segmentacao.segment_watershed.
+    """
+    if original is None:
+        original = image
+    if segment is None:
+        segment = functools.partial(segment_watershed, engine=engine)
+
+    scale = pyramid_scale(image.shape, max_side)
+    if scale == 1:
+        return segment(image, original, capture=capture, progress=progress)
+
+    if len(image.shape) == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+    height, width = gray.shape
+
+    ############################################################
+    # 1. Watershed completo na escala reduzida
+    ############################################################
+    small = cv2.resize(gray, (math.ceil(width / scale), math.ceil(height / scale)),
+                       interpolation=cv2.INTER_AREA)
+    coarse = segment(small, capture=capture,
+                     progress=progress)["labels"].astype(np.int32)
+    del small
+
+    ############################################################
+    # 2. Faixa de incerteza em volta das bordas grosseiras
+    ############################################################
+    coarse_boundary = label_boundaries(coarse)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * band + 1, 2 * band + 1))
+    coarse_band = cv2.dilate(coarse_boundary.astype(np.uint8), kernel)
+    del coarse_boundary
+
+    labels = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_NEAREST)
+    band_mask = cv2.resize(coarse_band, (width, height),
+                           interpolation=cv2.INTER_NEAREST).astype(bool)
+    del coarse, coarse_band
+
+    ############################################################
+    # 3. Refinamento em escala cheia, bloco a bloco, só dentro da faixa
+    ############################################################
+    if len(original.shape) == 2:
+        I_overlay = cv2.cvtColor(original, cv2.COLOR_GRAY2BGR)
+    else:
+        I_overlay = original.copy()
+
+    overlap = (band + 2) * scale
+    ring = np.ones((3, 3), np.uint8)
+    tiles = [(outer, core) for outer, core in iter_tiles(gray.shape, tile, overlap)
+             if band_mask[core].any()]
+    for i, (outer, core) in enumerate(tiles, start=1):
+        tile_band = band_mask[outer]
+        seeds = labels[outer].copy()
+        seeds[tile_band] = 0
+        if seeds.any():
+            # A inundação fica restrita à faixa mais um anel de sementes em volta
+            flood_mask = cv2.dilate(tile_band.astype(np.uint8), ring).astype(bool)
+            gradmag = filters.sobel(gray[outer].astype(float) / 255)
+            refined = segmentation.watershed(gradmag, markers=seeds, mask=flood_mask,
+                                             connectivity=2, watershed_line=False)
+            # Só o miolo do bloco é gravado; a margem serve de contexto
+            refined = refined[inner_slices(outer, core)]
+            update = band_mask[core] & (refined > 0)
+            labels[core][update] = refined[update]
+
+        if progress:
+            progress(i, len(tiles), "Refinando bordas")
+
+    ############################################################
+    # 4. Bordas finais sobre a imagem original (também só na faixa)
+    ############################################################
+    for outer, core in tiles:
+        tile_labels = labels[outer]
+        boundary = label_boundaries(tile_labels)[inner_slices(outer, core)] & band_mask[core]
+        I_overlay[core][boundary] = BOUNDARY_COLOR
+
+    return {"labels": labels, "overlay": I_overlay}
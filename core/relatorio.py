@@ -0,0 +1,296 @@
+"""Exportação do relatório para PDF, na interface ou em lote a partir de arquivos de caso.
+
+O PDF é escrito diretamente, sem bibliotecas de PDF: texto em Helvetica
+(fontes padrão do PDF, codificação WinAnsi) e imagens como JPEG embutido
+(DCTDecode), que o leitor de PDF decodifica sozinho. Cada imagem é reduzida
+(INTER_AREA) à resolução de impressão (PRINT_DPI) do espaço que ocupa na
+página antes de ser codificada, então uma foto de 50 MP vira algumas
+centenas de kB. Sem Qt, o modo em lote roda num pool de processos.
+
+Uso:
+    python -m core.relatorio casos/ -o relatorios --workers 8
+"""
+import argparse
+import datetime
+import ntpath
+import os
+import sys
+import textwrap
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from core.importacao import as_bgr8
+
+PRINT_DPI = 150
+JPEG_QUALITY = 85
+PAGE_SIZE = (595.0, 842.0)  # A4, em pontos
+MARGIN = 50.0
+FONT_SIZE = 10.0
+LINE_HEIGHT = 14.0
+# Helvetica tem em média ~0,5 em por caractere
+WRAP_COLUMNS = int((PAGE_SIZE[0] - 2 * MARGIN) / (0.5 * FONT_SIZE))
+THUMBNAIL_COLUMNS = 3
+DEFAULT_TITLE = "SmashMetrics - Relatório de Análise"
+
+
+def print_image(image, width_pt, height_pt, dpi=PRINT_DPI, quality=JPEG_QUALITY):
+    """JPEG de `image` reduzida para caber em `width_pt` x `height_pt` a `dpi`.
+
+    Retorna (bytes, largura, altura, cinza).
+    """
+    gray = image.ndim == 2 and image.dtype == np.uint8
+    if not gray:
+        image = as_bgr8(image)
+    h, w = image.shape[:2]
+    scale = min(width_pt * dpi / 72 / w, height_pt * dpi / 72 / h, 1.0)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Falha ao codificar a imagem em JPEG")
+    return encoded.tobytes(), image.shape[1], image.shape[0], gray
+
+
+def _pdf_text(text):
+    data = text.encode("cp1252", errors="replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+class PdfDocument:
+    """Documento PDF mínimo: páginas com texto em Helvetica e imagens JPEG."""
+
+    def __init__(self, page_size=PAGE_SIZE):
+        self.page_size = page_size
+        self.pages = []  # (operadores de conteúdo, nomes das imagens usadas)
+        self.images = []  # (jpeg, largura, altura, cinza)
+
+    def new_page(self):
+        self.pages.append(([], []))
+
+    def text(self, x, y, text, size=FONT_SIZE, bold=False):
+        ops, _ = self.pages[-1]
+        font = b"/F2" if bold else b"/F1"
+        ops.append(b"BT %s %.1f Tf %.2f %.2f Td %s Tj ET"
+                   % (font, size, x, y, _pdf_text(text)))
+
+    def image(self, x, y, width, height, encoded):
+        """Desenha um resultado de print_image em (x, y), canto inferior esquerdo."""
+        ops, names = self.pages[-1]
+        self.images.append(encoded)
+        name = b"/Im%d" % len(self.images)
+        names.append(len(self.images))
+        ops.append(b"q %.2f 0 0 %.2f %.2f %.2f cm %s Do Q" % (width, height, x, y, name))
+
+    def write(self, path):
+        objects = []
+
+        def add(body):
+            objects.append(body)
+            return len(objects)
+
+        catalog = add(None)
+        pages_id = add(None)
+        fonts = b"<< /F1 %d 0 R /F2 %d 0 R >>" % (
+            add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+                b"/Encoding /WinAnsiEncoding >>"),
+            add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold "
+                b"/Encoding /WinAnsiEncoding >>"),
+        )
+        image_ids = []
+        for data, width, height, gray in self.images:
+            image_ids.append(add(
+                b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+                b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n%s\nendstream"
+                % (width, height, b"/DeviceGray" if gray else b"/DeviceRGB", len(data), data)))
+        page_ids = []
+        for ops, names in self.pages:
+            content = b"\n".join(ops)
+            content_id = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+            xobjects = b" ".join(b"/Im%d %d 0 R" % (n, image_ids[n - 1]) for n in names)
+            page_ids.append(add(
+                b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.0f %.0f] "
+                b"/Resources << /Font %s /XObject << %s >> >> /Contents %d 0 R >>"
+                % (pages_id, self.page_size[0], self.page_size[1], fonts, xobjects, content_id)))
+        objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+        objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b" ".join(b"%d 0 R" % page for page in page_ids), len(page_ids))
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+            offsets = []
+            for number, body in enumerate(objects, start=1):
+                offsets.append(f.tell())
+                f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+            xref = f.tell()
+            f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+            f.writelines(b"%010d 00000 n \n" % offset for offset in offsets)
+            f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (len(objects) + 1, catalog, xref))
+        os.replace(tmp_path, path)
+
+
+class _Layout:
+    """Cursor de escrita de cima para baixo, abrindo páginas novas quando precisa."""
+
+    def __init__(self, document):
+        self.document = document
+        self.width = document.page_size[0] - 2 * MARGIN
+        self.y = None
+
+    def need(self, height):
+        if self.y is None or self.y - height < MARGIN:
+            self.document.new_page()
+            self.y = self.document.page_size[1] - MARGIN
+
+    def line(self, text, size=FONT_SIZE, bold=False):
+        self.need(LINE_HEIGHT)
+        self.y -= LINE_HEIGHT * size / FONT_SIZE
+        self.document.text(MARGIN, self.y, text, size, bold)
+
+    def image(self, encoded, width, height, x=MARGIN):
+        self.document.image(x, self.y - height, width, height, encoded)
+
+
+def _fit(image, max_width, max_height):
+    h, w = image.shape[:2]
+    scale = min(max_width / w, max_height / h)
+    return w * scale, h * scale
+
+
+def render_report(path, report, overlay=None, stages=(), title=DEFAULT_TITLE,
+                  source=None, dpi=PRINT_DPI, progress=None):
+    """Grava em `path` o PDF com o texto do relatório, o overlay e as miniaturas das etapas.
+
+    `report` segue o formato do report_text (linhas **em negrito** viram
+    títulos); `stages` é uma lista de (título, imagem). De `source` só o
+    nome do arquivo vai para o PDF, nunca a pasta local.
+    """
+    document = PdfDocument()
+    layout = _Layout(document)
+    total = 2 + len(stages)
+
+    ############################################################
+    # 1. cabeçalho e texto do relatório
+    ############################################################
+    layout.line(title, size=16, bold=True)
+    layout.line(f"Gerado em {datetime.datetime.now():%d/%m/%Y %H:%M}")
+    if source:
+        # ntpath separa tanto / quanto \ (casos gravados no Windows)
+        layout.line(f"Imagem: {ntpath.basename(source)}")
+    layout.y -= LINE_HEIGHT / 2
+    for paragraph in (report or "").splitlines():
+        bold = paragraph.startswith("**") and paragraph.endswith("**") and len(paragraph) > 4
+        if bold:
+            paragraph = paragraph[2:-2]
+            layout.y -= LINE_HEIGHT / 2
+        for line in textwrap.wrap(paragraph, WRAP_COLUMNS) or [""]:
+            layout.line(line, bold=bold)
+    if progress:
+        progress(1, total, "Texto do relatório")
+
+    ############################################################
+    # 2. imagem segmentada, na largura útil da página
+    ############################################################
+    if overlay is not None:
+        width, height = _fit(overlay, layout.width, layout.width)
+        layout.y -= LINE_HEIGHT
+        layout.need(height + LINE_HEIGHT)
+        layout.line("Imagem segmentada", bold=True)
+        layout.y -= 4
+        layout.image(print_image(overlay, width, height, dpi), width, height)
+        layout.y -= height
+    if progress:
+        progress(2, total, "Imagem segmentada")
+
+    ############################################################
+    # 3. miniaturas das etapas, em grade
+    ############################################################
+    if stages:
+        gap = 12.0
+        cell = (layout.width - gap * (THUMBNAIL_COLUMNS - 1)) / THUMBNAIL_COLUMNS
+        layout.y -= LINE_HEIGHT
+        layout.need(2 * LINE_HEIGHT + cell)
+        layout.line("Etapas da segmentação", bold=True)
+        layout.y -= 4
+        done = 2
+        for first in range(0, len(stages), THUMBNAIL_COLUMNS):
+            row = stages[first:first + THUMBNAIL_COLUMNS]
+            sizes = [_fit(image, cell, cell) for _, image in row]
+            row_height = max(height for _, height in sizes)
+            layout.need(row_height + LINE_HEIGHT)
+            for column, ((stage_title, image), (width, height)) in enumerate(zip(row, sizes)):
+                x = MARGIN + column * (cell + gap)
+                document.image(x + (cell - width) / 2, layout.y - height, width, height,
+                               print_image(image, width, height, dpi))
+                caption = textwrap.shorten(stage_title, int(cell / (0.45 * 8)),
+                                           placeholder="...")
+                document.text(x, layout.y - row_height - 10, caption, size=8)
+                done += 1
+                if progress:
+                    progress(done, total, stage_title)
+            layout.y -= row_height + LINE_HEIGHT + gap
+
+    document.write(path)
+    return path
+
+
+def render_case(case_path, output_dir, dpi=PRINT_DPI):
+    """PDF de um arquivo de caso (core.caso), com o mesmo nome; executado nos workers."""
+    from core.caso import CaseFile
+
+    case = CaseFile(case_path)
+    meta = case.meta
+    overlay = case.array("processed") if "processed" in case else case.array("original")
+    stages = [(title, case.array(f"etapa/{i:02d}"))
+              for i, title in enumerate(meta.get("stage_titles", []))]
+    name = os.path.splitext(os.path.basename(case_path))[0]
+    return render_report(os.path.join(output_dir, name + ".pdf"), meta.get("report", ""),
+                         overlay, stages, source=meta.get("source"), dpi=dpi)
+
+
+def main(argv=None):
+    from core.caso import CASE_EXTENSION
+
+    parser = argparse.ArgumentParser(
+        description="Exporta para PDF o relatório de vários arquivos de caso, em paralelo."
+    )
+    parser.add_argument("inputs", nargs="+", help=f"arquivos {CASE_EXTENSION} ou pastas com eles")
+    parser.add_argument("-o", "--output-dir", default=".", help="pasta dos PDFs gerados")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="número de processos (padrão: número de núcleos)")
+    parser.add_argument("--dpi", type=int, default=PRINT_DPI,
+                        help=f"resolução das imagens no PDF (padrão: {PRINT_DPI})")
+    args = parser.parse_args(argv)
+
+    case_paths = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            case_paths.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                     if name.endswith(CASE_EXTENSION)))
+        else:
+            case_paths.append(path)
+    if not case_paths:
+        print("Nenhum arquivo de caso encontrado", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(render_case, path, args.output_dir, args.dpi): path
+                   for path in case_paths}
+        for future in as_completed(futures):
+            try:
+                print(future.result())
+            except Exception as e:
+                print(f"Erro em {futures[future]}: {e}", file=sys.stderr)
+                failures += 1
+    print(f"{len(case_paths) - failures}/{len(case_paths)} relatórios exportados")
+    return 0 if not failures else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
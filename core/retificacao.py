@@ -0,0 +1,346 @@
+"""Retificação de perspectiva por homografia, com tabelas de remapeamento em cache.
+
+A homografia leva o plano do alvo (core.calibracao) ou de um retângulo de
+medidas conhecidas, marcado à mão, a uma vista de frente com escala
+uniforme: na imagem retificada, 1 px vale `scale_factor` cm em qualquer
+direção e em qualquer ponto do plano.
+
+Ela é estimada uma vez por montagem de câmera (core.calibracao.camera_key:
+EXIF, tamanho da imagem e pasta da sessão). Para cada montagem, as tabelas
+do cv2.remap são calculadas uma vez e guardadas no formato compacto de ponto
+fixo do OpenCV (CV_16SC2 + índice de interpolação CV_16UC1, 6 bytes por
+pixel em vez dos 8 dos mapas float32), em memória e no disco. Retificar as
+fotos seguintes da mesma montagem custa um único remap. O disco é limitado
+por RectificationCache.disk_max_bytes (as montagens menos usadas saem
+primeiro) e é só um acelerador: uma falha de escrita perde a cópia em disco,
+não a retificação.
+
+Uso:
+    python -m core.retificacao fotos saida --aruco 10
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from core.calibracao import (aruco_target, camera_key, checkerboard_target,
+                             describe_target, detect_target, DEFAULT_DICTIONARY)
+from core.instrumentacao import instrumentation
+
+RECTIFICATION_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".smashmetrics", "cache",
+                                       "retificacao")
+# A vista retificada fica limitada a este múltiplo do tamanho original, para
+# que um plano que se estende até o horizonte não gere uma imagem gigante
+MAX_OUTPUT_FACTOR = 2
+MAP_BAND_ROWS = 256
+
+
+def target_points(image, target):
+    """Pares (pixels na imagem, coordenadas no plano em cm) do alvo, ou None.
+
+    Para marcadores ArUco só o maior detectado é usado: marcadores soltos
+    não têm posição conhecida entre si.
+    """
+    result = detect_target(image, target)
+    if result is None:
+        return None
+    corners = result["corners"]
+    size = target["size_cm"]
+    if target["kind"] == "aruco":
+        markers = corners.reshape(-1, 4, 2)
+        perimeters = np.linalg.norm(np.roll(markers, -1, axis=1) - markers, axis=2).sum(axis=1)
+        source = markers[perimeters.argmax()]
+        plane = np.array([[0, 0], [size, 0], [size, size], [0, size]], dtype=np.float64)
+    else:
+        cols, rows = target["pattern"]
+        source = corners
+        plane = np.stack(np.meshgrid(np.arange(cols), np.arange(rows)), axis=-1) \
+            .reshape(-1, 2) * size
+    return source.astype(np.float64), plane.astype(np.float64)
+
+
+def rectangle_points(points, width_cm, height_cm):
+    """Pares para um retângulo marcado à mão (sup. esq., sup. dir., inf. dir., inf. esq.)."""
+    plane = np.array([[0, 0], [width_cm, 0], [width_cm, height_cm], [0, height_cm]],
+                     dtype=np.float64)
+    return np.asarray(points, dtype=np.float64), plane
+
+
+def estimate_setup(source, plane, shape):
+    """Homografia e tamanho da vista retificada a partir dos pares de pontos.
+
+    A escala de saída mantém o tamanho médio, em pixels, que o alvo tinha na
+    foto. Retorna um dicionário com `H` (pixels da foto -> pixels da vista),
+    `size` (largura, altura) e `scale_factor` (cm/px da vista).
+    """
+    # pixels por cm: razão entre os perímetros do alvo na foto e no plano
+    hull = cv2.convexHull(source.astype(np.float32)).reshape(-1, 2)
+    plane_hull = cv2.convexHull(plane.astype(np.float32)).reshape(-1, 2)
+    px_per_cm = (np.linalg.norm(np.roll(hull, -1, axis=0) - hull, axis=1).sum()
+                 / np.linalg.norm(np.roll(plane_hull, -1, axis=0) - plane_hull, axis=1).sum())
+    H, _ = cv2.findHomography(source, plane * px_per_cm, 0 if len(source) == 4 else cv2.RANSAC)
+    if H is None:
+        raise ValueError("Não foi possível estimar a homografia com esses pontos")
+
+    ############################################################
+    # enquadramento: a foto inteira, limitada em volta do alvo
+    ############################################################
+    h, w = shape[:2]
+    corners = np.array([[0, 0, 1], [w, 0, 1], [w, h, 1], [0, h, 1]], dtype=np.float64)
+    mapped = corners @ H.T
+    center = plane.mean(axis=0) * px_per_cm
+    half = np.array([w, h], dtype=np.float64) * MAX_OUTPUT_FACTOR / 2
+    low, high = center - half, center + half
+    if np.all(mapped[:, 2] > 0):
+        mapped = mapped[:, :2] / mapped[:, 2:]
+        low = np.maximum(low, mapped.min(axis=0))
+        high = np.minimum(high, mapped.max(axis=0))
+    low = np.floor(low)
+    size = np.maximum(np.ceil(high - low), 1).astype(int)
+    shift = np.array([[1, 0, -low[0]], [0, 1, -low[1]], [0, 0, 1]], dtype=np.float64)
+    return {
+        "H": shift @ H,
+        "size": (int(size[0]), int(size[1])),
+        "scale_factor": float(1 / px_per_cm),
+    }
+
+
+def build_maps(H, size, band_rows=MAP_BAND_ROWS):
+    """Tabelas de ponto fixo do cv2.remap para a homografia `H` e a vista `size`.
+
+    Calculadas em faixas de linhas, para que os mapas float32 temporários
+    nunca ocupem mais que uma faixa.
+    """
+    width, height = size
+    inverse = np.linalg.inv(H)
+    map1 = np.empty((height, width, 2), dtype=np.int16)
+    map2 = np.empty((height, width), dtype=np.uint16)
+    xs = np.arange(width, dtype=np.float64)
+    for top in range(0, height, band_rows):
+        ys = np.arange(top, min(top + band_rows, height), dtype=np.float64)
+        # coordenadas na foto de cada pixel da faixa: inverse · (x, y, 1)
+        sx = inverse[0, 0] * xs + (inverse[0, 1] * ys + inverse[0, 2])[:, None]
+        sy = inverse[1, 0] * xs + (inverse[1, 1] * ys + inverse[1, 2])[:, None]
+        sw = inverse[2, 0] * xs + (inverse[2, 1] * ys + inverse[2, 2])[:, None]
+        band1, band2 = cv2.convertMaps((sx / sw).astype(np.float32),
+                                       (sy / sw).astype(np.float32), cv2.CV_16SC2)
+        map1[top:top + len(ys)] = band1
+        map2[top:top + len(ys)] = band2
+    return map1, map2
+
+
+class RectificationCache:
+    """Montagens (homografia + tabelas de remap) por chave de câmera/sessão.
+
+    Guarda as `max_setups` mais recentes em memória; no disco, cada montagem
+    é um JSON com a homografia e dois .npy com as tabelas, lidos com mmap.
+    Passando de `disk_max_bytes`, as montagens usadas há mais tempo (pela
+    data do JSON, renovada a cada leitura) são apagadas.
+    """
+
+    def __init__(self, disk_dir=RECTIFICATION_CACHE_DIR, max_setups=2,
+                 disk_max_bytes=2 * 2 ** 30):
+        self.disk_dir = disk_dir
+        self.max_setups = max_setups
+        self.disk_max_bytes = disk_max_bytes
+        self._setups = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _paths(self, key):
+        base = os.path.join(self.disk_dir, key)
+        return base + ".json", base + "_map1.npy", base + "_map2.npy"
+
+    def get(self, key):
+        with self._lock:
+            setup = self._setups.get(key)
+            if setup is not None:
+                self._setups.move_to_end(key)
+                return setup
+        if not self.disk_dir:
+            return None
+        info_path, map1_path, map2_path = self._paths(key)
+        try:
+            with open(info_path, encoding="utf-8") as f:
+                info = json.load(f)
+            setup = {
+                "H": np.array(info["H"]),
+                "size": tuple(info["size"]),
+                "scale_factor": info["scale_factor"],
+                "maps": (np.load(map1_path, mmap_mode="r"), np.load(map2_path, mmap_mode="r")),
+            }
+            os.utime(info_path)  # marca como usada recentemente
+        except (OSError, ValueError, KeyError):
+            return None
+        self._remember(key, setup)
+        return setup
+
+    def put(self, key, setup):
+        if "maps" not in setup:
+            setup = {**setup, "maps": build_maps(setup["H"], setup["size"])}
+        self._remember(key, setup)
+        if self.disk_dir:
+            self._save(key, setup)
+            self._trim_disk(keep=key)
+        return setup
+
+    def _save(self, key, setup):
+        """Grava a montagem no disco; sem espaço ou permissão, fica só em memória."""
+        info_path, map1_path, map2_path = self._paths(key)
+        # temporários por processo e thread, como em core.cache.StageCache
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        written = []
+        try:
+            for path, array in ((map1_path, setup["maps"][0]), (map2_path, setup["maps"][1])):
+                with open(path + suffix, "wb") as f:
+                    written.append(path + suffix)
+                    np.save(f, array)
+            with open(info_path + suffix, "w", encoding="utf-8") as f:
+                written.append(info_path + suffix)
+                json.dump({"H": setup["H"].tolist(), "size": list(setup["size"]),
+                           "scale_factor": setup["scale_factor"]}, f)
+            os.replace(map1_path + suffix, map1_path)
+            os.replace(map2_path + suffix, map2_path)
+            os.replace(info_path + suffix, info_path)  # o JSON por último: só então a montagem vale
+        except OSError:
+            for path in written:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _trim_disk(self, keep=None):
+        """Apaga as montagens menos usadas até o diretório caber em `disk_max_bytes`."""
+        setups = {}
+        try:
+            with os.scandir(self.disk_dir) as scan:
+                for entry in scan:
+                    for ending in (".json", "_map1.npy", "_map2.npy"):
+                        if entry.name.endswith(ending):
+                            break
+                    else:
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    key = entry.name[:-len(ending)]
+                    used, size, paths = setups.get(key, (0.0, 0, []))
+                    # sem o JSON (gravação interrompida), vale a data das tabelas
+                    used = stat.st_mtime if ending == ".json" else max(used, stat.st_mtime)
+                    setups[key] = (used, size + stat.st_size, paths + [entry.path])
+        except OSError:
+            return
+        total = sum(size for _, size, _ in setups.values())
+        for used, size, paths in sorted(value for key, value in setups.items() if key != keep):
+            if total <= self.disk_max_bytes:
+                break
+            # o JSON primeiro: sem ele a montagem já não é lida
+            for path in sorted(paths, key=lambda path: not path.endswith(".json")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def _remember(self, key, setup):
+        with self._lock:
+            self._setups[key] = setup
+            self._setups.move_to_end(key)
+            while len(self._setups) > self.max_setups:
+                self._setups.popitem(last=False)
+
+
+def rectify(image, setup):
+    """Aplica a montagem a `image`: um único cv2.remap com as tabelas em cache."""
+    with instrumentation.measure("Retificar perspectiva") as measured:
+        map1, map2 = setup["maps"]
+        rectified = cv2.remap(image, np.asarray(map1), np.asarray(map2), cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT)
+        measured.output = rectified
+    return rectified
+
+
+def setup_for(image, path, cache, target=None, points=None, progress=None):
+    """Montagem da câmera/sessão de `path`: do cache ou estimada.
+
+    Sem montagem em cache, ela é estimada pelos pares `points` (ex.:
+    rectangle_points) ou, na falta deles, pelo alvo `target`. Sem `path`
+    nada é guardado no cache. Retorna (chave, montagem); a montagem é None
+    se não houver como estimá-la (alvo ausente ou não encontrado).
+    """
+    key = camera_key(path, image.shape) if path is not None else None
+    setup = cache.get(key) if key is not None and points is None else None
+    if setup is not None:
+        return key, setup
+    if points is None and target is not None:
+        if progress:
+            progress(1, 2, "Procurando o alvo de calibração")
+        points = target_points(image, target)
+    if points is None:
+        return key, None
+    if progress:
+        progress(2, 2, "Calculando as tabelas de retificação")
+    setup = estimate_setup(*points, image.shape)
+    if key is None:
+        return key, {**setup, "maps": build_maps(setup["H"], setup["size"])}
+    return key, cache.put(key, setup)
+
+
+def main(argv=None):
+    from core.lote import expand_inputs
+
+    parser = argparse.ArgumentParser(
+        description="Retifica a perspectiva de fotos pelo alvo de calibração da sessão."
+    )
+    parser.add_argument("input_dir", help="pasta com as imagens de entrada")
+    parser.add_argument("output_dir", help="pasta onde as imagens retificadas serão gravadas")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--aruco", type=float, metavar="CM",
+                       help="lado do marcador ArUco/AprilTag, em cm")
+    group.add_argument("--checkerboard", metavar="COLxLIN",
+                       help="cantos internos do tabuleiro, ex.: 9x6")
+    parser.add_argument("--dictionary", default=DEFAULT_DICTIONARY,
+                        help=f"dicionário do marcador (padrão: {DEFAULT_DICTIONARY})")
+    parser.add_argument("--square", type=float, default=None, metavar="CM",
+                        help="lado de cada casa do tabuleiro, em cm")
+    args = parser.parse_args(argv)
+
+    if args.aruco:
+        target = aruco_target(args.aruco, args.dictionary)
+    else:
+        if not args.square:
+            parser.error("--checkerboard requer --square")
+        target = checkerboard_target(
+            args.square, [int(n) for n in args.checkerboard.lower().split("x")])
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache = RectificationCache()
+    failures = 0
+    for path in expand_inputs([args.input_dir]):
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            print(f"Falha ao carregar a imagem {path}", file=sys.stderr)
+            failures += 1
+            continue
+        _, setup = setup_for(image, path, cache, target)
+        if setup is None:
+            print(f"{os.path.basename(path)}: sem montagem ({describe_target(target)} "
+                  "não encontrado nesta sessão)", file=sys.stderr)
+            failures += 1
+            continue
+        output = os.path.join(args.output_dir, os.path.basename(path))
+        cv2.imwrite(output, rectify(image, setup))
+        print(f"{os.path.basename(path)}: {setup['size'][0]}x{setup['size'][1]}, "
+              f"{setup['scale_factor']:.5f} cm/px")
+    return 0 if not failures else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+import cv2
+import numpy as np
+from scipy import ndimage as ndi
+from skimage import morphology, measure, segmentation, filters, color
+
+from core.instrumentacao import instrumentation
+
+
+def imposemin(img, minima, dtype=np.float64):
+    marker = np.full(img.shape, np.inf, dtype=dtype)
+    marker[minima == 1] = 0
+    mask = np.minimum(img.astype(dtype, copy=False) + 1, marker)
+    return morphology.reconstruction(marker, mask, method='erosion')
+
+
+# Motores de imposição de mínimos + inundação, registrados em ENGINES com
+# register_engine. Todos cumprem o mesmo contrato: recebem o gradiente, os
+# marcadores do passo 8 e a imagem em cinza e devolvem rótulos int32 do
+# tamanho da imagem, sem pixel 0 ou -1, numerados como
+# measure.label(marcadores > 0, connectivity=2). Assim dois motores podem
+# ser comparados pixel a pixel (ver core.selecao_motor).
+# - "reconstruction": reconstrução morfológica em float64 e watershed sem
+#   marcadores (comportamento original);
+# - "reconstruction32": mesma reconstrução em float32 e watershed semeado com
+#   os rótulos dos mínimos, o que evita a busca de mínimos locais. Gera o mesmo
+#   mapa de rótulos com metade da memória nos buffers de ponto flutuante;
+# - "seeded": watershed semeado direto sobre o gradiente, sem reconstrução.
+#   É o mais rápido do scikit-image, mas em platôs o desempate pode mover
+#   algumas bordas;
+# - "compact": watershed compacto do scikit-image (compactness pequena), que
+#   regulariza o desempate em platôs; outro perfil de tempo e memória;
+# - "opencv": cv2.watershed com marcadores int32 sobre a imagem em cinza. A
+#   fila por níveis de 8 bits é bem mais rápida, mas a prioridade vem da
+#   diferença de intensidade entre vizinhos (e não do Sobel), então as bordas
+#   concordam menos com as do motor original.
+# "auto" não é um motor: segment_watershed escolhe o mais rápido que
+# concorda com o original (core.selecao_motor).
+ENGINES = {}
+# Motores que precisam da imagem em cinza além do gradiente
+IMAGE_ENGINES = set()
+AUTO_ENGINE = "auto"
+COMPACTNESS = 1e-5
+
+
+def register_engine(name, needs_image=False):
+    """Decorador que registra `fn(gradmag, markers, gray)` como motor de inundação."""
+    def register(fn):
+        ENGINES[name] = fn
+        if needs_image:
+            IMAGE_ENGINES.add(name)
+        return fn
+    return register
+
+
+def seed_labels(markers):
+    """Mínimos rotulados, na numeração que todos os motores devolvem."""
+    return measure.label(markers > 0, connectivity=2)
+
+
+@register_engine("reconstruction")
+def _flood_reconstruction(gradmag, markers, gray=None):
+    surface = imposemin(gradmag, (markers > 0).astype(np.uint8))
+    return segmentation.watershed(surface, connectivity=2, watershed_line=False)
+
+
+@register_engine("reconstruction32")
+def _flood_reconstruction32(gradmag, markers, gray=None):
+    minima = (markers > 0).astype(np.uint8)
+    surface = imposemin(gradmag, minima, dtype=np.float32)
+    seeds = measure.label(minima, connectivity=2)
+    del minima
+    return segmentation.watershed(surface, markers=seeds, connectivity=2,
+                                  watershed_line=False)
+
+
+@register_engine("seeded")
+def _flood_seeded(gradmag, markers, gray=None):
+    return segmentation.watershed(gradmag, markers=seed_labels(markers), connectivity=2,
+                                  watershed_line=False)
+
+
+@register_engine("compact")
+def _flood_compact(gradmag, markers, gray=None):
+    return segmentation.watershed(gradmag, markers=seed_labels(markers), connectivity=2,
+                                  compactness=COMPACTNESS)
+
+
+@register_engine("opencv", needs_image=True)
+def _flood_opencv(gradmag, markers, gray=None):
+    if gray is None:
+        raise ValueError('O motor "opencv" precisa da imagem em cinza')
+    if gray.dtype != np.uint8:
+        gray = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    seeds = seed_labels(markers).astype(np.int32)
+    cv2.watershed(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), seeds)
+    return fill_watershed_lines(seeds)
+
+
+def fill_watershed_lines(labels):
+    """Troca as linhas -1 do cv2.watershed (e a moldura da imagem) pelo maior rótulo vizinho.
+
+    Pixels 0, que o cv2.watershed às vezes deixa sem inundar, também são
+    tratados como linha, para cumprir o contrato dos motores.
+    """
+    lines = labels <= 0
+    if lines.all():
+        return labels
+    kernel = np.ones((3, 3), np.uint8)
+    while lines.any():
+        # rótulos até 2**24 são exatos em float32 (o cv2.dilate não aceita int32)
+        grown = cv2.dilate(labels.astype(np.float32), kernel).astype(np.int32)
+        labels[lines] = grown[lines]
+        lines = labels <= 0
+    return labels
+
+
+def flood(gradmag, markers, engine="reconstruction", gray=None):
+    """Impõe os marcadores como mínimos de `gradmag` e aplica o watershed.
+
+    `gray` (a imagem em cinza) só é usada pelos motores que inundam a
+    própria imagem, como "opencv".
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Motor de watershed desconhecido: {engine}")
+    return ENGINES[engine](gradmag, markers, gray)
+
+
+def label_overlay(labels):
+    """Converte um mapa de rótulos em imagem colorida uint8 para visualização."""
+    vis = color.label2rgb(labels, bg_label=0, bg_color=(1, 1, 1))
+    return (vis * 255).astype(np.uint8)
+
+
+# Cor (BGR) das bordas entre regiões em todos os overlays
+BOUNDARY_COLOR = (0, 0, 255)
+
+
+def label_boundaries(labels):
+    """Pixels com algum vizinho (cruz) de rótulo diferente.
+
+    Equivale a `dilation(labels) != erosion(labels)` com o elemento
+    estruturante padrão, mas compara fatias e só aloca máscaras booleanas
+    em vez de duas cópias do mapa de rótulos.
+    """
+    boundary = np.zeros(labels.shape, dtype=bool)
+    diff = labels[1:, :] != labels[:-1, :]
+    boundary[1:, :] |= diff
+    boundary[:-1, :] |= diff
+    diff = labels[:, 1:] != labels[:, :-1]
+    boundary[:, 1:] |= diff
+    boundary[:, :-1] |= diff
+    return boundary
+
+
+def draw_boundaries(image, labels):
+    """Cópia BGR de `image` com as bordas de `labels` em BOUNDARY_COLOR."""
+    if image.ndim == 2:
+        overlay = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    else:
+        overlay = image.copy()
+    overlay[label_boundaries(labels)] = BOUNDARY_COLOR
+    return overlay
+
+
+def reflood(gradient, seeds, mask=None):
+    """Watershed das `seeds` (rótulos > 0) direto sobre `gradient`, dentro de `mask`.
+
+    É a inundação incremental do editor de marcadores (core.marcadores) e
+    dos quadros acompanhados (core.sequencia): só a orla das sementes
+    (vizinha de pixel ainda sem rótulo) entra na fila do watershed, e o
+    miolo delas é copiado com o próprio rótulo. Sem `mask`, inunda a imagem
+    toda; fora dela o resultado é 0.
+    """
+    seeded = seeds > 0
+    pending = ~seeded if mask is None else mask & ~seeded
+    rim = seeded & cv2.dilate(pending.view(np.uint8), np.ones((3, 3), np.uint8)).view(bool)
+    flooded = segmentation.watershed(gradient, markers=np.where(rim, seeds, 0),
+                                     mask=pending | rim, connectivity=2)
+    flooded[seeded] = seeds[seeded]
+    return flooded
+
+
+STAGE_COUNT = 12
+
+
+def stage_reporter(capture=None, progress=None, total=STAGE_COUNT):
+    """Cria a função `stage(titulo, output, preview)` chamada ao fim de cada etapa.
+
+    `output` é o array produzido pela etapa, cuja forma e tipo vão para os
+    sinks de core.instrumentacao junto com o tempo da etapa. A imagem de
+    visualização é `preview(output)` (ou o próprio `output`, sem `preview`)
+    e só é gerada quando há `capture`. Como ela sai do argumento, a etapa
+    pode liberar os seus arrays com `del` logo depois.
+    """
+    completed = 0
+    timer = instrumentation.stage_timer()
+
+    def stage(title, output, preview=None):
+        nonlocal completed
+        completed += 1
+        timer.mark(title, output)
+        if capture:
+            capture(title, preview(output) if preview else output)
+        if progress:
+            progress(completed, total, title)
+        timer.restart()
+
+    return stage
+
+
+def cached_stage(cache, name, deps, params, compute, *args):
+    """Executa `compute(*args)` ou reaproveita o resultado guardado em `cache`.
+
+    A chave combina o nome da etapa, as chaves das etapas de que ela depende
+    (`deps`) e os seus parâmetros. Retorna (valor, chave); sem cache a chave
+    é None.
+    """
+    if cache is None:
+        return compute(*args), None
+    key = cache.key(name, deps, params)
+    value = cache.get(key)
+    if value is None:
+        value = compute(*args)
+        cache.put(key, value)
+    return value, key
+
+
+def segment_watershed(image, original=None, capture=None, progress=None,
+                      engine="reconstruction", cache=None, blur_ksize=7,
+                      blur_sigma=3, opening_radius=1, dilate_iterations=3,
+                      fg_ratio=0.5, keep_surface=False):
+    """Executa o pipeline de segmentação por watershed sem nenhuma janela.
+
+    `image` é a imagem a segmentar (cinza ou BGR) e `original` a imagem sobre
+    a qual as bordas são desenhadas (por padrão, a própria `image`). Se
+    `capture` for informado, é chamado como `capture(titulo, imagem)` a cada
+    etapa; sem ele, nenhuma imagem intermediária de visualização é gerada.
+    Se `progress` for informado, é chamado como `progress(etapa, total,
+    titulo)` ao fim de cada etapa (ver core.tarefas.Worker). `engine`
+    escolhe o motor de imposição de mínimos (ver ENGINES); com "auto", o
+    escolhido por core.selecao_motor para esta máquina e este tamanho de
+    imagem.
+
+    Com um core.cache.StageCache em `cache`, cada etapa é reaproveitada
+    enquanto a imagem e os parâmetros dela e das etapas anteriores forem os
+    mesmos; mudar só `fg_ratio`, por exemplo, reusa o filtro, o Otsu, a
+    abertura e a transformada de distância.
+
+    Retorna um dicionário com o mapa de rótulos (`labels`), o overlay
+    (`overlay`) e o motor usado (`engine`). Com `keep_surface`, inclui também os marcadores (`markers`)
+    e o gradiente (`gradient`), que o editor de marcadores (core.marcadores)
+    reaproveita para refazer só as bacias editadas; sem ele, os dois são
+    liberados antes do overlay.
+    """
+    if original is None:
+        original = image
+
+    stage = stage_reporter(capture, progress)
+    k_image = cache.image_key(image) if cache is not None else None
+
+    ############################################################
+    # 1. carregar a imagem e converter para escala de cinza
+    ############################################################
+    if len(image.shape) == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+    stage("1. Imagem em Escala de Cinza", gray, np.copy)
+
+    ############################################################
+    # 2. aplicar filtro Gaussiano (Kernel 7x7, sigma=3)
+    ############################################################
+    blurred, k_blur = cached_stage(
+        cache, "blur", [k_image], {"ksize": blur_ksize, "sigma": blur_sigma},
+        lambda: cv2.GaussianBlur(gray, (blur_ksize, blur_ksize), blur_sigma)
+    )
+    stage("2. Filtro Gaussiano", blurred)
+
+    ############################################################
+    # 3. binarização com Otsu invertida
+    ############################################################
+    binary, k_binary = cached_stage(
+        cache, "otsu", [k_blur], {},
+        lambda src: cv2.threshold(src, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1],
+        blurred
+    )
+    stage("3. Binarização Invertida", binary)
+    del blurred
+
+    ############################################################
+    # 4. remoção de ruído com abertura morfológica
+    ############################################################
+    se_disk = morphology.disk(opening_radius)
+    opening_bool, k_opening = cached_stage(
+        cache, "opening", [k_binary], {"radius": opening_radius},
+        lambda src: morphology.opening(src.astype(bool), se_disk), binary
+    )
+    opening_uint8 = opening_bool.astype(np.uint8) * 255
+    stage("4. Abertura Morfológica", opening_uint8)
+    del binary
+
+    ############################################################
+    # 5. determinar área de fundo (sure background) por dilatação (3 iterações)
+    ############################################################
+    kernel_cv2 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    sure_bg, k_sure_bg = cached_stage(
+        cache, "sure_bg", [k_opening], {"iterations": dilate_iterations},
+        lambda src: cv2.dilate(src, kernel_cv2, iterations=dilate_iterations), opening_uint8
+    )
+    stage("5. Área de Fundo (Dilatação)", sure_bg)
+    del opening_uint8
+
+    ############################################################
+    # 6. Calcular a transformada de distância e definir o foreground seguro
+    ############################################################
+    D, k_distance = cached_stage(
+        cache, "distance", [k_opening], {},
+        lambda src: ndi.distance_transform_edt(np.logical_not(src)), opening_bool
+    )
+    del opening_bool
+    stage("6. Transformada de Distância", D,
+          lambda D: cv2.normalize(D, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8))
+    sure_fg = D > fg_ratio * D.max()
+    del D
+    stage("7. Foreground Seguro", sure_fg, lambda fg: fg.astype(np.uint8) * 255)
+
+    ############################################################
+    # 7. Determinar as regiões desconhecidas
+    ############################################################
+    unknown = np.logical_and(sure_bg > 0, ~sure_fg)
+    del sure_bg
+    stage("8. Regiões Desconhecidas", unknown, lambda mask: mask.astype(np.uint8) * 255)
+
+    ############################################################
+    # 8. Rotulagem dos marcadores e criação dos marcadores
+    ############################################################
+    def compute_markers(sure_fg, unknown):
+        markers = measure.label(sure_fg, connectivity=2)
+        markers += 1
+        markers[unknown] = 0
+        return markers
+
+    markers, k_markers = cached_stage(
+        cache, "markers", [k_distance, k_sure_bg], {"fg_ratio": fg_ratio},
+        compute_markers, sure_fg, unknown
+    )
+    del sure_fg, unknown
+    stage("9. Marcadores (Markers)", markers, label_overlay)
+
+    ############################################################
+    # 9. Calcular o gradiente da imagem
+    ############################################################
+    gradmag, k_gradient = cached_stage(
+        cache, "gradient", [k_image], {},
+        lambda: filters.sobel(gray.astype(float) / 255)
+    )
+    stage("10. Gradiente da Imagem", gradmag,
+          lambda g: cv2.normalize(g, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8))
+
+    ############################################################
+    # Passo 10: Impor mínimos e aplicar o Watershed
+    ############################################################
+    if engine == AUTO_ENGINE:
+        from core.selecao_motor import default_selector
+        engine = default_selector().select(gradmag, markers, gray)
+    L_ws, _ = cached_stage(
+        cache, "watershed", [k_markers, k_gradient], {"engine": engine},
+        flood, gradmag, markers, engine, gray
+    )
+    surface = {"markers": markers, "gradient": gradmag} if keep_surface else {}
+    del gradmag, markers
+    stage("11. Segmentação via Watershed", L_ws, label_overlay)
+
+    ############################################################
+    # Passos 11-12: Encontrar bordas da segmentação e sobrepor na imagem original
+    ############################################################
+    I_overlay = draw_boundaries(original, L_ws)
+    stage("12. Segmentação por Watershed (Overlay)", I_overlay)
+
+    return {"labels": L_ws, "overlay": I_overlay, "engine": engine, **surface}
@@ -0,0 +1,227 @@
+"""Escolha automática do motor de watershed por micro-benchmark.
+
+Os motores de core.segmentacao.ENGINES devolvem o mesmo contrato de rótulos,
+mas o tempo de cada um muda muito com a máquina e o tamanho da imagem. A
+calibração roda todos sobre o gradiente e os marcadores de uma imagem
+(recortados no centro, se ela passar de CALIBRATION_PIXELS), mede o menor
+tempo de `repeat` execuções e a concordância pixel a pixel com o motor de
+referência, e fica com o mais rápido cuja concordância não é menor que o
+limiar. A referência sempre se qualifica.
+
+As medições ficam em JSON no disco, por máquina (CPU, núcleos e versões do
+OpenCV e do scikit-image) e por classe de tamanho (potência de 2 do número
+de pixels): a calibração só roda na primeira imagem de cada classe, e mudar
+o limiar reaproveita as medições já feitas. A concordância depende da
+imagem, então calibrar outras imagens da mesma classe (a linha de comando
+abaixo, sobre uma pasta de casos) acumula as medições: vale a menor
+concordância já vista de cada motor e o tempo mais recente.
+
+Uso:
+    python -m core.selecao_motor "Banco de dados PDI" --threshold 0.99
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import skimage
+
+from core.lote import expand_inputs
+from core.segmentacao import ENGINES, IMAGE_ENGINES, flood, segment_watershed
+
+ENGINE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".smashmetrics", "cache", "motores")
+REFERENCE_ENGINE = "reconstruction"
+AGREEMENT_THRESHOLD = 0.99
+CALIBRATION_PIXELS = 4 * 2 ** 20
+REPEAT = 2
+
+
+def agreement(labels, reference):
+    """Fração dos pixels com o mesmo rótulo nos dois mapas."""
+    return float(np.mean(labels == reference))
+
+
+def size_class(shape):
+    """Classe de tamanho da imagem: log2 do número de pixels, arredondado."""
+    return int(round(math.log2(max(shape[0] * shape[1], 1))))
+
+
+def machine_key():
+    """Identifica a máquina e as bibliotecas que influenciam o tempo dos motores."""
+    description = "|".join([platform.machine(), platform.processor(), str(os.cpu_count()),
+                            cv2.__version__, skimage.__version__])
+    return hashlib.blake2b(description.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def center_crop(shape, max_pixels=CALIBRATION_PIXELS):
+    """Fatias do recorte central com no máximo `max_pixels`, na proporção da imagem."""
+    height, width = shape[:2]
+    factor = min(1.0, math.sqrt(max_pixels / (height * width)))
+    crop_h, crop_w = max(1, int(height * factor)), max(1, int(width * factor))
+    top, left = (height - crop_h) // 2, (width - crop_w) // 2
+    return slice(top, top + crop_h), slice(left, left + crop_w)
+
+
+def benchmark_engines(gradmag, markers, gray=None, engines=None, reference=REFERENCE_ENGINE,
+                      repeat=REPEAT, progress=None):
+    """Mede cada motor sobre os mesmos dados; a referência roda primeiro.
+
+    Sem `gray`, os motores que inundam a própria imagem ficam de fora.
+    Retorna uma lista de {"engine", "seconds", "agreement"}, com o menor
+    tempo das `repeat` execuções.
+    """
+    engines = [reference] + [name for name in (engines or ENGINES)
+                             if name != reference and (gray is not None or
+                                                       name not in IMAGE_ENGINES)]
+    results = []
+    reference_labels = None
+    for i, engine in enumerate(engines, start=1):
+        seconds = math.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            labels = flood(gradmag, markers, engine, gray)
+            seconds = min(seconds, time.perf_counter() - start)
+        if reference_labels is None:
+            reference_labels = labels
+        results.append({"engine": engine, "seconds": seconds,
+                        "agreement": agreement(labels, reference_labels)})
+        del labels
+        if progress:
+            progress(i, len(engines), f"Calibrando o motor {engine}")
+    return results
+
+
+def choose_engine(results, threshold=AGREEMENT_THRESHOLD, reference=REFERENCE_ENGINE):
+    """Motor mais rápido com concordância >= `threshold` (a referência sempre vale)."""
+    qualified = [result for result in results
+                 if result["engine"] == reference or result["agreement"] >= threshold]
+    return min(qualified, key=lambda result: result["seconds"])["engine"]
+
+
+class EngineSelector:
+    """Calibra uma vez por classe de tamanho e guarda as medições em disco."""
+
+    def __init__(self, disk_dir=ENGINE_CACHE_DIR, threshold=AGREEMENT_THRESHOLD,
+                 reference=REFERENCE_ENGINE, max_pixels=CALIBRATION_PIXELS):
+        self.disk_dir = disk_dir
+        self.threshold = threshold
+        self.reference = reference
+        self.max_pixels = max_pixels
+        self.path = os.path.join(disk_dir, f"{machine_key()}.json")
+        self._lock = threading.Lock()
+        os.makedirs(disk_dir, exist_ok=True)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        # processos do lote podem calibrar ao mesmo tempo
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def measurements(self, shape):
+        """Medições guardadas para a classe de tamanho de `shape`, ou None."""
+        return self._load().get(str(size_class(shape)))
+
+    def calibrate(self, gradmag, markers, gray=None, progress=None):
+        """Mede todos os motores sobre o recorte central e grava na classe de tamanho."""
+        crop = center_crop(gradmag.shape, self.max_pixels)
+        results = benchmark_engines(gradmag[crop], markers[crop],
+                                    None if gray is None else gray[crop],
+                                    reference=self.reference, progress=progress)
+        key = str(size_class(gradmag.shape))
+        with self._lock:
+            entries = self._load()
+            previous = entries.get(key)
+            if previous is not None:
+                worst = {result["engine"]: result["agreement"] for result in previous["engines"]}
+                for result in results:
+                    result["agreement"] = min(result["agreement"],
+                                              worst.get(result["engine"], 1.0))
+            entry = {"pixels": int(gradmag[crop].size), "engines": results,
+                     "samples": (previous or {}).get("samples", 0) + 1,
+                     "timestamp": time.time()}
+            entries[key] = entry
+            self._save(entries)
+        return entry
+
+    def reset(self):
+        """Descarta as medições desta máquina."""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def select(self, gradmag, markers, gray=None, progress=None):
+        """Motor para esta imagem, calibrando antes se a classe de tamanho for nova.
+
+        Motores registrados depois da última calibração também a disparam.
+        """
+        entry = self.measurements(gradmag.shape)
+        if entry is None or set(ENGINES) - {result["engine"] for result in entry["engines"]}:
+            entry = self.calibrate(gradmag, markers, gray, progress)
+        available = [result for result in entry["engines"] if result["engine"] in ENGINES]
+        return choose_engine(available, self.threshold, self.reference)
+
+
+_default_selector = None
+_default_lock = threading.Lock()
+
+
+def default_selector():
+    """EngineSelector compartilhado, com o diretório e o limiar padrão."""
+    global _default_selector
+    with _default_lock:
+        if _default_selector is None:
+            _default_selector = EngineSelector()
+        return _default_selector
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Calibra e escolhe o motor de watershed mais rápido para esta máquina."
+    )
+    parser.add_argument("inputs", nargs="+", help="imagens ou pastas de imagens")
+    parser.add_argument("-t", "--threshold", type=float, default=AGREEMENT_THRESHOLD,
+                        help="concordância mínima com o motor de referência")
+    parser.add_argument("--max-pixels", type=int, default=CALIBRATION_PIXELS,
+                        help="tamanho máximo do recorte usado na calibração")
+    parser.add_argument("--reset", action="store_true",
+                        help="descarta as medições anteriores desta máquina")
+    args = parser.parse_args(argv)
+
+    selector = EngineSelector(threshold=args.threshold, max_pixels=args.max_pixels)
+    if args.reset:
+        selector.reset()
+    for path in expand_inputs(args.inputs):
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            print(f"Falha ao carregar a imagem {path}", file=sys.stderr)
+            continue
+        surface = segment_watershed(image, keep_surface=True)
+        entry = selector.calibrate(surface["gradient"], surface["markers"], image)
+        chosen = choose_engine(entry["engines"], args.threshold)
+        print(f"{os.path.basename(path)} ({image.shape[1]}x{image.shape[0]}, "
+              f"classe 2^{size_class(image.shape)}, recorte {entry['pixels'] / 1e6:.1f} MP, "
+              f"{entry['samples']} imagem(ns) medida(s))")
+        for result in entry["engines"]:
+            mark = "*" if result["engine"] == chosen else " "
+            print(f"  {mark} {result['engine']:<18} {result['seconds'] * 1000:>9.1f} ms "
+                  f"{result['agreement']:>9.2%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,378 @@
+"""Ingestão em fluxo de vídeos e sequências de imagens, sem interface gráfica.
+
+Um vídeo (cv2.VideoCapture) ou uma pasta de quadros exportados (em ordem
+natural: quadro_2 antes de quadro_10) vira um pipeline de geradores:
+
+- read_frames decodifica os quadros, pulando `step - 1` a cada um mantido
+  (no vídeo, os pulados só passam por grab(), sem conversão de cor);
+- prefetch decodifica numa thread, no máximo `queue_frames` quadros à frente
+  da segmentação;
+- group_runs junta quadros consecutivos em sequências de `run_length`;
+- stream_segment distribui as sequências num ProcessPoolExecutor, com no
+  máximo `max_pending` em andamento, e devolve os quadros na ordem.
+
+Dentro de uma sequência, só o primeiro quadro passa pelo pipeline completo
+de segment_watershed (com o motor escolhido). Os seguintes partem dos
+rótulos do quadro anterior: o interior de cada região (a mais de `margin`
+pixels da borda) vira marcador e só a faixa em volta das bordas é
+inundada de novo sobre o gradiente, sem Otsu, abertura e transformada de
+distância. Os rótulos mantêm a numeração do quadro-chave,
+então a mesma região tem o mesmo rótulo ao longo da sequência. Um quadro
+que muda demais em relação ao anterior (diferença média de intensidade
+acima de `change_threshold`, como num corte de cena) volta a ser
+quadro-chave.
+
+Uso:
+    python -m core.sequencia camera.mp4 saida --step 3 --workers 4
+    python -m core.sequencia quadros_exportados saida --fps 30
+"""
+import argparse
+import collections
+import csv
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from skimage import filters
+
+from core.lote import IMAGE_EXTENSIONS, init_worker, save_labels
+from core.segmentacao import (AUTO_ENGINE, ENGINES, draw_boundaries, label_boundaries,
+                              reflood, segment_watershed)
+
+VIDEO_EXTENSIONS = (".mp4", ".m4v", ".mov", ".avi", ".mkv", ".wmv", ".asf", ".mpg",
+                    ".mpeg", ".ts", ".3gp")
+RUN_LENGTH = 12
+QUEUE_FRAMES = 32
+SEED_MARGIN = 3
+CHANGE_THRESHOLD = 12.0
+RING_KERNEL = np.ones((3, 3), np.uint8)
+KEYFRAME = "chave"
+TRACKED = "acompanhado"
+
+_END = object()
+
+
+def natural_key(path):
+    """Chave de ordenação que compara os números do nome pelo valor."""
+    return [int(part) if part.isdigit() else part.lower()
+            for part in re.split(r"(\d+)", os.path.basename(path))]
+
+
+def is_video(path):
+    return os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def read_video(path, step=1, start=0, stop=None):
+    """Quadros (índice, segundos, imagem BGR) de um vídeo, um a cada `step`."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Falha ao abrir o vídeo {path}")
+    try:
+        if start:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        index = start
+        while stop is None or index < stop:
+            if (index - start) % step:
+                # quadro descartado: avança o decodificador sem converter a imagem
+                if not capture.grab():
+                    break
+            else:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield index, capture.get(cv2.CAP_PROP_POS_MSEC) / 1000, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def read_sequence(paths, step=1, start=0, stop=None, fps=None):
+    """Quadros (índice, segundos, imagem BGR) de uma lista ordenada de imagens.
+
+    Sem `fps`, o tempo de cada quadro é None.
+    """
+    stop = len(paths) if stop is None else min(stop, len(paths))
+    for index in range(start, stop, step):
+        frame = cv2.imread(paths[index], cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError(f"Falha ao carregar a imagem {paths[index]}")
+        yield index, index / fps if fps else None, frame
+
+
+def read_frames(source, step=1, start=0, stop=None, fps=None):
+    """Gerador de quadros de um arquivo de vídeo ou de uma pasta de imagens."""
+    if step < 1:
+        raise ValueError("O passo entre quadros deve ser pelo menos 1")
+    if is_video(source):
+        return read_video(source, step, start, stop)
+    if os.path.isdir(source):
+        paths = sorted((os.path.join(source, name) for name in os.listdir(source)
+                        if name.lower().endswith(IMAGE_EXTENSIONS)), key=natural_key)
+        return read_sequence(paths, step, start, stop, fps)
+    raise ValueError(f"{source} não é um vídeo nem uma pasta de imagens")
+
+
+def prefetch(frames, maxsize=QUEUE_FRAMES):
+    """Consome `frames` numa thread, guardando no máximo `maxsize` itens à frente.
+
+    Uma exceção do gerador de origem é repassada a quem consome. Se o
+    consumidor parar antes do fim, a thread encerra e fecha a origem.
+    """
+    buffer = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for frame in frames:
+                if not put(frame):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        finally:
+            if hasattr(frames, "close"):
+                frames.close()
+        put(_END)
+
+    thread = threading.Thread(target=produce, name="decodificacao", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def group_runs(frames, run_length=RUN_LENGTH):
+    """Junta quadros consecutivos em listas de até `run_length`."""
+    run = []
+    for frame in frames:
+        run.append(frame)
+        if len(run) == run_length:
+            yield run
+            run = []
+    if run:
+        yield run
+
+
+def temporal_markers(labels, margin=SEED_MARGIN):
+    """Marcadores do quadro seguinte: o interior de cada região de `labels`.
+
+    Os pixels a até `margin` de uma borda ficam 0 (desconhecidos), para que o
+    watershed do novo quadro reposicione as bordas que se moveram. Uma região
+    mais fina que essa faixa fica com os pixels que não são borda.
+    """
+    boundary = label_boundaries(labels)
+    band = cv2.dilate(boundary.view(np.uint8), RING_KERNEL, iterations=margin).view(bool)
+    markers = np.where(band, 0, labels).astype(np.int32, copy=False)
+
+    count = int(labels.max()) + 1
+    lost = (np.bincount(labels.ravel(), minlength=count) > 0) & \
+        (np.bincount(markers.ravel(), minlength=count) == 0)
+    lost[0] = False
+    if lost.any():
+        restore = lost[labels] & ~boundary
+        markers[restore] = labels[restore]
+    return markers
+
+
+def track_frame(gray, previous_labels, margin=SEED_MARGIN):
+    """Segmenta `gray` a partir dos rótulos do quadro anterior, ou None se não sobrar semente.
+
+    Só a faixa em volta das bordas anteriores é inundada
+    (core.segmentacao.reflood, como no editor de marcadores), e o miolo de
+    cada região mantém o rótulo anterior.
+    """
+    markers = temporal_markers(previous_labels, margin)
+    if not markers.any():
+        return None
+    return reflood(filters.sobel(gray.astype(float) / 255), markers)
+
+
+def segment_run(frames, output_dir, engine="reconstruction", margin=SEED_MARGIN,
+                change_threshold=CHANGE_THRESHOLD, save_overlay=True):
+    """Segmenta quadros consecutivos e grava rótulos e overlays. Executado nos workers.
+
+    Retorna um dicionário por quadro com o índice, o tempo no vídeo, o modo
+    (quadro-chave ou acompanhado), a diferença média para o quadro anterior,
+    o motor (só nos quadros-chave), o tempo de processamento e os caminhos
+    gravados.
+    """
+    infos = []
+    labels = previous_gray = None
+    for index, seconds, image in frames:
+        start = time.perf_counter()
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        change = None
+        if previous_gray is not None and previous_gray.shape == gray.shape:
+            change = float(cv2.absdiff(gray, previous_gray).mean())
+        tracked = None
+        if change is not None and change <= change_threshold:
+            tracked = track_frame(gray, labels, margin)
+        if tracked is None:
+            result = segment_watershed(image, engine=engine)
+            labels, used_engine, overlay = result["labels"], result["engine"], result["overlay"]
+            mode = KEYFRAME
+            del result
+        else:
+            labels = tracked
+            overlay = draw_boundaries(image, labels) if save_overlay else None
+            mode = TRACKED
+        previous_gray = gray
+
+        path_base = os.path.join(output_dir, f"quadro_{index:06d}")
+        info = {"frame": index, "time": seconds, "mode": mode, "change": change,
+                "engine": used_engine if mode == KEYFRAME else "",
+                "labels": save_labels(path_base, labels)}
+        if save_overlay:
+            info["overlay"] = path_base + "_overlay.png"
+            cv2.imwrite(info["overlay"], overlay)
+        info["seconds"] = time.perf_counter() - start
+        infos.append(info)
+    return infos
+
+
+def stream_segment(runs, output_dir, workers=None, max_pending=None, **options):
+    """Segmenta as sequências de `runs` em paralelo e devolve os quadros em ordem.
+
+    No máximo `max_pending` sequências (padrão: workers + 1) ficam submetidas
+    ao mesmo tempo: a próxima só é lida de `runs` quando a mais antiga
+    termina, então a memória não cresce com o tamanho do vídeo. Uma
+    sequência que falha gera {"frame", "error"} para cada um dos seus
+    quadros. `options` vai para segment_run.
+    """
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or workers + 1
+    os.makedirs(output_dir, exist_ok=True)
+    pending = collections.deque()
+
+    def finish(future, indices):
+        try:
+            return future.result()
+        except Exception as e:
+            return [{"frame": index, "error": str(e)} for index in indices]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        for run in runs:
+            pending.append((executor.submit(segment_run, run, output_dir, **options),
+                            [frame[0] for frame in run]))
+            del run
+            if len(pending) >= max_pending:
+                yield from finish(*pending.popleft())
+        while pending:
+            yield from finish(*pending.popleft())
+
+
+def ingest(source, output_dir, step=1, start=0, stop=None, fps=None, workers=None,
+           run_length=RUN_LENGTH, queue_frames=QUEUE_FRAMES, **options):
+    """Pipeline completo: decodificação, fila limitada, sequências e segmentação.
+
+    Gerador com um dicionário por quadro processado (ver segment_run).
+    """
+    frames = prefetch(read_frames(source, step, start, stop, fps), queue_frames)
+    return stream_segment(group_runs(frames, run_length), output_dir, workers, **options)
+
+
+def save_frame_table(path, infos):
+    """Grava um CSV com uma linha por quadro."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["quadro", "tempo_s", "modo", "diferenca", "motor", "segundos",
+                         "rotulos", "erro"])
+        for info in infos:
+            writer.writerow([
+                info["frame"],
+                "" if info.get("time") is None else f"{info['time']:.3f}",
+                info.get("mode", ""),
+                "" if info.get("change") is None else f"{info['change']:.2f}",
+                info.get("engine", ""),
+                f"{info['seconds']:.3f}" if "seconds" in info else "",
+                os.path.basename(info.get("labels", "")),
+                info.get("error", ""),
+            ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Segmentação watershed em fluxo de um vídeo ou de uma pasta de quadros."
+    )
+    parser.add_argument("source", help="arquivo de vídeo ou pasta com os quadros exportados")
+    parser.add_argument("output_dir", help="pasta onde rótulos, overlays e quadros.csv "
+                                           "serão gravados")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="número de processos (padrão: número de núcleos)")
+    parser.add_argument("-e", "--engine", choices=[*ENGINES, AUTO_ENGINE], default="reconstruction",
+                        help="motor de imposição de mínimos dos quadros-chave "
+                             "(padrão: reconstruction)")
+    parser.add_argument("--step", type=int, default=1,
+                        help="processa um quadro a cada STEP (padrão: todos)")
+    parser.add_argument("--start", type=int, default=0, help="primeiro quadro")
+    parser.add_argument("--stop", type=int, default=None,
+                        help="quadro onde parar (exclusivo)")
+    parser.add_argument("--fps", type=float, default=None,
+                        help="taxa de quadros de uma pasta de imagens, para o tempo de "
+                             "cada quadro (o vídeo informa a sua)")
+    parser.add_argument("--run-length", type=int, default=RUN_LENGTH,
+                        help="quadros por sequência; cada uma começa num quadro-chave")
+    parser.add_argument("--queue", type=int, default=QUEUE_FRAMES,
+                        help="quadros decodificados à frente da segmentação")
+    parser.add_argument("--margin", type=int, default=SEED_MARGIN,
+                        help="distância (px) às bordas anteriores que fica fora das sementes")
+    parser.add_argument("--change-threshold", type=float, default=CHANGE_THRESHOLD,
+                        help="diferença média de intensidade (0-255) para o quadro "
+                             "anterior que força um novo quadro-chave")
+    parser.add_argument("--no-overlay", action="store_true",
+                        help="grava só os mapas de rótulos")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        infos = list(ingest(args.source, args.output_dir, args.step, args.start, args.stop,
+                            args.fps, args.workers, args.run_length, args.queue,
+                            engine=args.engine, margin=args.margin,
+                            change_threshold=args.change_threshold,
+                            save_overlay=not args.no_overlay))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+
+    table_path = os.path.join(args.output_dir, "quadros.csv")
+    save_frame_table(table_path, infos)
+    failures = [info for info in infos if "error" in info]
+    for info in failures:
+        print(f"Erro no quadro {info['frame']}: {info['error']}", file=sys.stderr)
+    done = [info for info in infos if "error" not in info]
+    for mode, title in ((KEYFRAME, "Quadros-chave"), (TRACKED, "Quadros acompanhados")):
+        frames = [info["seconds"] for info in done if info["mode"] == mode]
+        if frames:
+            print(f"{title}: {len(frames)}, {np.mean(frames) * 1000:.0f} ms por quadro")
+    rate = len(done) / elapsed if elapsed > 0 else 0.0
+    print(f"{len(done)} quadros em {elapsed:.2f} s ({rate:.2f} quadros/s, "
+          f"{args.workers} workers) -> {table_path}")
+    return 0 if not failures else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
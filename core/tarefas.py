@@ -0,0 +1,50 @@
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+
+class TaskCancelled(Exception):
+    """Levantada dentro de uma tarefa quando o usuário pede o cancelamento."""
+
+
+class WorkerSignals(QObject):
+    progress = Signal(int, int, str)
+    finished = Signal(object)
+    failed = Signal(str)
+    cancelled = Signal()
+
+
+class Worker(QRunnable):
+    """Executa `fn(*args, progress=..., **kwargs)` em uma thread do QThreadPool.
+
+    A função recebe um callback `progress(etapa, total, titulo)`; cada chamada
+    é repassada ao sinal `progress` e é também o ponto onde um pedido de
+    cancelamento interrompe a execução.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self._cancel_requested = False
+
+    def cancel(self):
+        self._cancel_requested = True
+
+    def report_progress(self, step, total, title):
+        if self._cancel_requested:
+            raise TaskCancelled()
+        self.signals.progress.emit(step, total, title)
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, progress=self.report_progress, **self.kwargs)
+        except TaskCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            if self._cancel_requested:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
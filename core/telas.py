@@ -1,10 +1,18 @@
+import tracemalloc
+
 from PySide6.QtWidgets import (
     QMainWindow, QVBoxLayout, QHBoxLayout, QWidget,
-    QLabel, QPushButton, QStackedWidget, QTextEdit, QComboBox, QInputDialog
+    QLabel, QPushButton, QStackedWidget, QTextEdit, QComboBox, QInputDialog,
+    QCheckBox, QProgressBar, QMessageBox, QSpinBox
 )
 from PySide6.QtGui import QPixmap
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QThreadPool
 from core.funcionalidades import Funcionalidades
+from core.galeria import StageGallery
+from core.visualizador import ImageViewer
+from core.velocidade import STIFFNESS_PRESETS
+from core.perfil import DEFAULT_STATIONS
+from core.calibracao import aruco_target, checkerboard_target, DEFAULT_PATTERN
 
 
 class SmashMetricsUI(QMainWindow):
@@ -15,13 +23,59 @@ class SmashMetricsUI(QMainWindow):
         self.setWindowTitle("SmashMetrics - Análise Forense de Colisões")
         self.setGeometry(100, 100, 1200, 800)
 
-        self.original_image = None
+        self.image_source = None
+        # hash do arquivo importado; a vista retificada continua sendo a mesma evidência
+        self.image_hash = None
+        # a imagem atual é a vista retificada (core.retificacao)
+        self.rectified = False
+        self.case = None
+        self._original_image = None
         self.processed_image = None
         self.scale_factor = None
+        self.scale_factors = None
+        self.deformation_pixels = None
+        self._labels = None
+        self.surface = None
+        self.crush_profile = None
         self.selected_stiffness = None
+        self.calibration_target = None
+        self.current_task = None
+        self._task_callback = None
 
         self.setup_ui()
 
+    @property
+    def original_image(self):
+        """Imagem em resolução total; decodificada no primeiro acesso (ver core.importacao)."""
+        if self._original_image is None and self.image_source is not None:
+            self._original_image = self.image_source.load()
+        return self._original_image
+
+    @original_image.setter
+    def original_image(self, image):
+        self.image_source = None
+        self.case = None
+        self.rectified = False
+        self._original_image = image
+
+    def set_image_source(self, source):
+        """Associa um core.importacao.LazyImage recém-importado à tela."""
+        self._original_image = None
+        self.image_source = source
+        self.case = None
+        self.rectified = False
+
+    @property
+    def labels(self):
+        """Mapa de rótulos do watershed; num caso aberto, descomprimido no primeiro acesso."""
+        if self._labels is None and self.case is not None and "labels" in self.case:
+            self._labels = self.case.array("labels")
+        return self._labels
+
+    @labels.setter
+    def labels(self, labels):
+        self._labels = labels
+
     def setup_ui(self):
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
@@ -127,13 +181,21 @@ class SmashMetricsUI(QMainWindow):
         title.setStyleSheet("font-size: 28px; color: #ecf0f1; font-weight: bold;")
         layout.addWidget(title)
 
-        self.image_label = QLabel("Nenhuma imagem carregada")
-        self.image_label.setAlignment(Qt.AlignCenter)
+        # Zoom com a roda do mouse, arraste para mover, duplo clique para ajustar
+        self.image_label = ImageViewer("Nenhuma imagem carregada")
         self.image_label.setStyleSheet(
             "background-color: #2c3e50; border: 2px dashed #7f8c8d; min-height: 500px; margin-top: 10px;"
         )
         layout.addWidget(self.image_label)
 
+        # Galeria com as etapas intermediárias da segmentação (modo de depuração)
+        self.stage_gallery = StageGallery()
+        self.stage_gallery.stage_selected.connect(
+            lambda _, image: self.funcionalidades.display_image(self, image)
+        )
+        self.stage_gallery.setVisible(False)
+        layout.addWidget(self.stage_gallery)
+
         button_layout = QHBoxLayout()
         button_layout.setSpacing(15)
 
@@ -142,8 +204,12 @@ class SmashMetricsUI(QMainWindow):
             ("Importar Imagem", self.funcionalidades.import_image),
             ("Converter para 8-bit", self.funcionalidades.convert_to_gray),
             ("Segmentar Deformação", self.funcionalidades.apply_watershed),
-            ("Calibrar Escala", self.funcionalidades.calibrate_image),
+            ("Editar Marcadores", self.funcionalidades.edit_markers),
+            ("Calibrar Escala", self.funcionalidades.calibrate),
             ("Calcular Velocidade", self.funcionalidades.handle_velocity_calculation),
+            ("Perfil Automático", self.funcionalidades.extract_crush_profile),
+            ("Salvar Caso", self.funcionalidades.save_case),
+            ("Abrir Caso", self.funcionalidades.open_case),
         ]
 
         for text, handler in buttons:
@@ -158,9 +224,21 @@ class SmashMetricsUI(QMainWindow):
         self.remove_image_button.clicked.connect(self.remove_image)
         button_layout.addWidget(self.remove_image_button)
 
+        # Alvo da calibração automática; sem alvo, a calibração é manual
+        self.calibration_combo = QComboBox()
+        self.calibration_combo.addItems([
+            "Calibração manual",
+            "Marcador ArUco...",
+            "Tabuleiro de xadrez...",
+        ])
+        self.calibration_combo.setStyleSheet("padding: 10px; font-size: 16px;")
+        self.calibration_combo.currentIndexChanged.connect(self.update_calibration_target)
+        button_layout.addWidget(self.calibration_combo)
+
         # ComboBox para seleção de rigidez
         self.stiffness_combo = QComboBox()
         self.stiffness_combo.addItems([
+            "Método ajustado (F_eff=2.621e6)",
             "Carro Sedan (k=150000 N/m)",
             "Caminhonete (k=250000 N/m)",
             "Personalizado..."
@@ -169,7 +247,73 @@ class SmashMetricsUI(QMainWindow):
         self.stiffness_combo.currentIndexChanged.connect(self.update_stiffness_value)
         button_layout.addWidget(self.stiffness_combo)
 
+        # Estações C1…CN do perfil automático de deformação
+        self.stations_spinbox = QSpinBox()
+        self.stations_spinbox.setRange(2, 20)
+        self.stations_spinbox.setValue(DEFAULT_STATIONS)
+        self.stations_spinbox.setPrefix("Estações: ")
+        self.stations_spinbox.setStyleSheet("padding: 10px; font-size: 16px;")
+        button_layout.addWidget(self.stations_spinbox)
+
+        self.capture_stages_checkbox = QCheckBox("Capturar etapas")
+        self.capture_stages_checkbox.setStyleSheet("font-size: 16px; color: #ecf0f1;")
+        button_layout.addWidget(self.capture_stages_checkbox)
+
+        # Motor do watershed (nomes de core.segmentacao.ENGINES, que só é
+        # importado na primeira segmentação); o automático usa o mais rápido
+        # medido nesta máquina que concorda com o original (core.selecao_motor)
+        self.engine_combo = QComboBox()
+        self.engine_combo.addItem("Motor original", "reconstruction")
+        self.engine_combo.addItem("Motor automático", "auto")
+        self.engine_combo.setToolTip(
+            "O automático mede os motores de watershed na primeira imagem de cada "
+            "tamanho e fica com o mais rápido cuja concordância com o original "
+            "passa de 99%"
+        )
+        self.engine_combo.setStyleSheet("padding: 10px; font-size: 16px;")
+        button_layout.addWidget(self.engine_combo)
+
+        self.pyramid_checkbox = QCheckBox("Modo pirâmide")
+        self.pyramid_checkbox.setToolTip(
+            "Segmenta em resolução reduzida e refina só as bordas em resolução cheia "
+            "(recomendado para fotos muito grandes)"
+        )
+        self.pyramid_checkbox.setStyleSheet("font-size: 16px; color: #ecf0f1;")
+        button_layout.addWidget(self.pyramid_checkbox)
+
+        self.rectify_checkbox = QCheckBox("Retificar perspectiva")
+        self.rectify_checkbox.setToolTip(
+            "Corrige a perspectiva pela homografia da câmera/sessão (alvo de calibração "
+            "ou retângulo marcado) antes da segmentação e das medições; as imagens "
+            "importadas em seguida são retificadas automaticamente"
+        )
+        self.rectify_checkbox.setStyleSheet("font-size: 16px; color: #ecf0f1;")
+        self.rectify_checkbox.toggled.connect(self.update_rectification)
+        button_layout.addWidget(self.rectify_checkbox)
+
+        self.snap_checkbox = QCheckBox("Ajustar à borda")
+        self.snap_checkbox.setToolTip(
+            "Na marcação de pontos, atrai o cursor para a borda mais próxima (Sobel), "
+            "com precisão subpixel"
+        )
+        self.snap_checkbox.setStyleSheet("font-size: 16px; color: #ecf0f1;")
+        button_layout.addWidget(self.snap_checkbox)
+
         layout.addLayout(button_layout)
+
+        # Progresso do processamento em segundo plano
+        progress_layout = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        progress_layout.addWidget(self.progress_bar)
+        self.cancel_button = QPushButton("Cancelar")
+        self.cancel_button.setStyleSheet("padding: 10px 20px; font-size: 16px;")
+        self.cancel_button.clicked.connect(self.cancel_task)
+        progress_layout.addWidget(self.cancel_button)
+        layout.addLayout(progress_layout)
+        self.progress_bar.setVisible(False)
+        self.cancel_button.setVisible(False)
+
         return widget
 
     def create_report_screen(self):
@@ -196,6 +340,28 @@ class SmashMetricsUI(QMainWindow):
         """)
         layout.addWidget(self.report_text)
 
+        buttons_layout = QHBoxLayout()
+        btn_profile = QPushButton("Perfil de desempenho")
+        btn_profile.setStyleSheet("padding: 12px 24px; font-size: 18px;")
+        btn_profile.clicked.connect(lambda: self.funcionalidades.show_profile(self))
+        buttons_layout.addWidget(btn_profile)
+        # tracemalloc: mostra os bytes alocados por etapa, mas deixa tudo mais lento
+        self.trace_allocations_checkbox = QCheckBox("Medir alocações")
+        self.trace_allocations_checkbox.setToolTip(
+            "Liga o tracemalloc para medir a memória alocada por etapa "
+            "(o processamento fica mais lento)"
+        )
+        self.trace_allocations_checkbox.setChecked(tracemalloc.is_tracing())
+        self.trace_allocations_checkbox.setStyleSheet("font-size: 16px; color: #ecf0f1;")
+        self.trace_allocations_checkbox.toggled.connect(
+            lambda checked: self.funcionalidades.set_allocation_tracing(self, checked))
+        buttons_layout.addWidget(self.trace_allocations_checkbox)
+        btn_cases = QPushButton("Resumo dos casos")
+        btn_cases.setStyleSheet("padding: 12px 24px; font-size: 18px;")
+        btn_cases.clicked.connect(lambda: self.funcionalidades.show_case_summary(self))
+        buttons_layout.addWidget(btn_cases)
+        buttons_layout.addStretch()
+
         btn_export = QPushButton("Exportar para PDF")
         btn_export.setStyleSheet("""
             QPushButton {
@@ -209,7 +375,9 @@ class SmashMetricsUI(QMainWindow):
                 background-color: #1e8449;
             }
         """)
-        layout.addWidget(btn_export, alignment=Qt.AlignRight)
+        btn_export.clicked.connect(lambda: self.funcionalidades.export_pdf(self))
+        buttons_layout.addWidget(btn_export)
+        layout.addLayout(buttons_layout)
         return widget
 
     def create_about_screen(self):
@@ -265,28 +433,146 @@ class SmashMetricsUI(QMainWindow):
 
     def remove_image(self):
         self.original_image = None
+        self.image_hash = None
         self.processed_image = None
+        self.labels = None
+        self.surface = None
+        self.crush_profile = None
+        self.image_label.set_tool(None)
         self.image_label.clear()
         self.image_label.setText("Nenhuma imagem carregada")
+        self.stage_gallery.set_stages([])
         self.remove_image_button.setEnabled(False)
 
+    def start_task(self, worker, description, on_finished):
+        """Executa um core.tarefas.Worker no QThreadPool, mostrando o progresso."""
+        if self.current_task is not None:
+            QMessageBox.warning(self, "Aguarde", "Já existe um processamento em andamento.")
+            return
+        self.current_task = worker
+        self._task_callback = on_finished
+        worker.signals.progress.connect(self.on_task_progress)
+        worker.signals.finished.connect(self.on_task_finished)
+        worker.signals.failed.connect(self.on_task_failed)
+        worker.signals.cancelled.connect(self.on_task_cancelled)
+
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setFormat(f"{description}...")
+        self.progress_bar.setVisible(True)
+        self.cancel_button.setEnabled(True)
+        self.cancel_button.setVisible(True)
+        QThreadPool.globalInstance().start(worker)
+
+    def cancel_task(self):
+        if self.current_task is not None:
+            self.current_task.cancel()
+            self.cancel_button.setEnabled(False)
+            self.progress_bar.setFormat("Cancelando...")
+
+    def on_task_progress(self, step, total, title):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(step)
+        self.progress_bar.setFormat(f"{title} ({step}/{total})")
+
+    def on_task_finished(self, result):
+        callback = self._task_callback
+        self.end_task()
+        callback(result)
+
+    def on_task_failed(self, message):
+        self.end_task()
+        QMessageBox.critical(self, "Erro", f"Erro no processamento:\n{message}")
+
+    def on_task_cancelled(self):
+        self.end_task()
+        QMessageBox.information(self, "Cancelado", "Processamento cancelado.")
+
+    def end_task(self):
+        self.current_task = None
+        self._task_callback = None
+        self.progress_bar.setVisible(False)
+        self.cancel_button.setVisible(False)
+
     def update_stiffness_value(self):
         """Atualiza o valor de rigidez com base na seleção do usuário."""
         selection = self.stiffness_combo.currentText()
-        if "Sedan" in selection:
-            self.selected_stiffness = 150000  # exemplo para Sedan
+        if "ajustado" in selection:
+            self.selected_stiffness = None  # F_eff fixo, sem classe de veículo
+        elif "Sedan" in selection:
+            self.selected_stiffness = STIFFNESS_PRESETS["Sedan"]
         elif "Caminhonete" in selection:
-            self.selected_stiffness = 250000  # exemplo para Caminhonete
+            self.selected_stiffness = STIFFNESS_PRESETS["Caminhonete"]
         else:
             value, ok = QInputDialog.getDouble(self, "Rigidez Personalizada",
-                                               "Insira o valor da constante de rigidez (N/m):", decimals=2)
-            self.selected_stiffness = value if ok else None
+                                               "Insira o valor da constante de rigidez (N/m):",
+                                               decimals=2, minValue=0.01, maxValue=1e9)
+            if ok:
+                self.selected_stiffness = value
+            else:
+                self.stiffness_combo.setCurrentIndex(0)
+
+    def update_calibration_target(self):
+        """Pede as dimensões do alvo escolhido (ver core.calibracao)."""
+        selection = self.calibration_combo.currentText()
+        target = None
+        if "ArUco" in selection:
+            size, ok = QInputDialog.getDouble(self, "Marcador ArUco",
+                                              "Insira o lado do marcador (em cm):",
+                                              decimals=2, minValue=0.01, maxValue=1e4)
+            if ok:
+                target = aruco_target(size)
+        elif "xadrez" in selection:
+            default = "{}x{}".format(*DEFAULT_PATTERN)
+            pattern, ok = QInputDialog.getText(self, "Tabuleiro de xadrez",
+                                               "Cantos internos (colunas x linhas):",
+                                               text=default)
+            if ok:
+                size, ok = QInputDialog.getDouble(self, "Tabuleiro de xadrez",
+                                                  "Insira o lado de cada casa (em cm):",
+                                                  decimals=2, minValue=0.01, maxValue=1e4)
+            try:
+                if ok:
+                    target = checkerboard_target(
+                        size, [int(n) for n in pattern.lower().split("x")])
+            except ValueError:
+                QMessageBox.warning(self, "Erro", "Tamanho do tabuleiro inválido.")
+        else:
+            self.calibration_target = None
+            return
+        if target is None:
+            self.calibration_combo.setCurrentIndex(0)
+        else:
+            self.calibration_target = target
+
+    def show_selected_stiffness(self, stiffness):
+        """Sincroniza a caixa de rigidez com um valor restaurado, sem abrir diálogos."""
+        presets = {value: name for name, value in STIFFNESS_PRESETS.items()}
+        if stiffness is None:
+            index = 0
+        elif stiffness in presets:
+            index = next(i for i in range(self.stiffness_combo.count())
+                         if presets[stiffness] in self.stiffness_combo.itemText(i))
+        else:
+            index = self.stiffness_combo.count() - 1
+        self.stiffness_combo.blockSignals(True)
+        self.stiffness_combo.setCurrentIndex(index)
+        self.stiffness_combo.blockSignals(False)
+        self.selected_stiffness = stiffness
+
+    def show_calibration_target(self, target):
+        """Sincroniza a caixa de alvo de calibração com um alvo restaurado."""
+        kinds = {None: 0, "aruco": 1, "checkerboard": 2}
+        self.calibration_combo.blockSignals(True)
+        self.calibration_combo.setCurrentIndex(kinds[target["kind"] if target else None])
+        self.calibration_combo.blockSignals(False)
+        self.calibration_target = target
+
+    def update_rectification(self, checked):
+        # só uma imagem recém-importada: a já retificada não tem mais image_source
+        if checked and self.image_source is not None:
+            self.funcionalidades.rectify_image(self)
 
     def handle_calculate_velocity(self):
-        deformation = self.funcionalidades.measure_deformation(self)
-        if deformation is None:
-            return
-        if self.selected_stiffness is None:
-            self.update_stiffness_value()
-            self.funcionalidades.calculate_energy_and_velocity_campbell(self)
+        # o cálculo usa self.selected_stiffness (ver Funcionalidades.calculate_energy_and_velocity)
+        self.funcionalidades.handle_velocity_calculation(self)
 
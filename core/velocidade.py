@@ -0,0 +1,162 @@
+"""Cálculo vetorizado de energia de deformação e velocidade, caso a caso ou em lote.
+
+Dois modelos de energia, escolhidos pela rigidez de cada caso:
+- sem rigidez (NaN): método ajustado, Edef = F_eff·d² com F_eff = 2.621e6;
+- com rigidez k (N/m), de uma classe de veículo (STIFFNESS_PRESETS) ou
+  informada: modelo de mola de Campbell, Edef = ½·k·d².
+Em ambos, v = sqrt(2·Edef / m).
+
+As funções aceitam escalares ou arrays do NumPy, então milhares de casos
+históricos podem ser reavaliados numa só chamada. Tabelas de casos são lidas
+e gravadas em CSV (ou Parquet, se o pandas com pyarrow estiver instalado).
+
+Uso:
+    python -m core.velocidade casos.csv -o resultados.csv
+"""
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+F_EFF = 2.621e6
+STIFFNESS_PRESETS = {
+    "Sedan": 150000.0,
+    "Caminhonete": 250000.0,
+}
+INPUT_COLUMNS = ("deformation_cm", "mass_kg", "stiffness")
+OUTPUT_COLUMNS = ("stiffness_n_m", "energy_nm", "velocity_kmh", "method")
+
+
+def _parse_stiffness(value):
+    text = str(value).strip()
+    if text.lower() in ("", "none", "ajustado"):
+        return np.nan
+    if text in STIFFNESS_PRESETS:
+        return STIFFNESS_PRESETS[text]
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"Classe de rigidez desconhecida: {text!r}") from None
+
+
+def stiffness_values(stiffness):
+    """Converte classes de veículo e/ou valores de k (N/m) num array float.
+
+    Vazio, None ou "ajustado" viram NaN (método ajustado). Aceita um valor
+    único ou uma sequência; cada valor distinto é interpretado uma só vez.
+    """
+    array = np.asarray(stiffness)
+    if array.dtype.kind in "biuf":
+        return array.astype(np.float64)
+    labels = np.asarray(array, dtype=object).astype(str)
+    uniques, inverse = np.unique(labels, return_inverse=True)
+    parsed = np.array([_parse_stiffness(value) for value in uniques], dtype=np.float64)
+    return parsed[inverse].reshape(array.shape)
+
+
+def energy_coefficient(stiffness=None):
+    """Coeficiente c de Edef = c·d²: F_eff no método ajustado, ½·k no de Campbell."""
+    if stiffness is None:
+        return F_EFF
+    k = stiffness_values(stiffness)
+    return np.where(np.isnan(k), F_EFF, 0.5 * k)
+
+
+def energy_and_velocity(deformation_cm, mass, stiffness=None):
+    """Energia de deformação (N.m) e velocidade (km/h), elemento a elemento.
+
+    `deformation_cm`, `mass` (kg) e `stiffness` seguem as regras de
+    broadcasting do NumPy; sem `stiffness`, todos os casos usam o método
+    ajustado.
+    """
+    deformation_m = np.asarray(deformation_cm, dtype=np.float64) / 100.0
+    mass = np.asarray(mass, dtype=np.float64)
+    if np.any(mass <= 0):
+        raise ValueError("A massa deve ser positiva")
+    Edef = energy_coefficient(stiffness) * deformation_m ** 2
+    velocity_kmh = np.sqrt(2 * Edef / mass) * 3.6
+    return Edef, velocity_kmh
+
+
+def evaluate_cases(table):
+    """Acrescenta a uma tabela de casos (dicionário de colunas) os resultados.
+
+    Colunas de entrada: `deformation_cm`, `mass_kg` e, opcional,
+    `stiffness` (classe ou k em N/m). Colunas acrescentadas: OUTPUT_COLUMNS.
+    """
+    missing = [name for name in INPUT_COLUMNS[:2] if name not in table]
+    if missing:
+        raise ValueError(f"Colunas ausentes: {', '.join(missing)}")
+    deformation = np.asarray(table["deformation_cm"], dtype=np.float64)
+    mass = np.asarray(table["mass_kg"], dtype=np.float64)
+    k = stiffness_values(table.get("stiffness", [None] * len(deformation)))
+    Edef, velocity_kmh = energy_and_velocity(deformation, mass, k)
+    return {
+        **table,
+        "stiffness_n_m": k,
+        "energy_nm": Edef,
+        "velocity_kmh": velocity_kmh,
+        "method": np.where(np.isnan(k), "ajustado", "campbell"),
+    }
+
+
+def _is_parquet(path):
+    return path.lower().endswith((".parquet", ".pq"))
+
+
+def _pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError("Ler e gravar Parquet requer o pandas (com pyarrow)") from None
+    return pandas
+
+
+def read_cases(path):
+    """Lê uma tabela de casos de um CSV ou Parquet como dicionário de colunas."""
+    if _is_parquet(path):
+        frame = _pandas().read_parquet(path)
+        return {name: frame[name].to_numpy() for name in frame.columns}
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        return {}
+    return {name: np.array([row[name] for row in rows], dtype=object) for name in rows[0]}
+
+
+def write_cases(path, table):
+    if _is_parquet(path):
+        _pandas().DataFrame({name: np.asarray(column) for name, column in table.items()}) \
+            .to_parquet(path, index=False)
+        return
+    names = list(table)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*(table[name] for name in names)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reavalia energia e velocidade de uma tabela de casos (CSV ou Parquet)."
+    )
+    parser.add_argument("input", help="tabela com deformation_cm, mass_kg e stiffness")
+    parser.add_argument("-o", "--output", default=None,
+                        help="tabela de saída (padrão: <entrada>_resultados.csv)")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.input)[0] + "_resultados.csv"
+    try:
+        table = evaluate_cases(read_cases(args.input))
+    except (OSError, ValueError, ImportError) as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    write_cases(output, table)
+    print(f"{len(table['velocity_kmh'])} casos -> {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""Visualizador de imagens grandes com zoom, arraste e pirâmide de resolução em cache.
+
+Cada imagem exibida ganha uma MipPyramid: níveis reduzidos pela metade
+(INTER_AREA), criados sob demanda e guardados junto com o QPixmap de cada
+nível. A cada repintura o ImageViewer escolhe o nível mais próximo da escala
+de exibição e desenha só a região visível, então redimensionar a janela,
+trocar de aba ou voltar a uma imagem já exibida não reescala a imagem
+inteira.
+"""
+import math
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PySide6.QtWidgets import QFrame
+from PySide6.QtGui import QPainter, QPixmap, QColor
+from PySide6.QtCore import Qt, QRectF, QPointF
+
+from core.galeria import to_qimage
+
+# Níveis com mais pixels que isso não viram QPixmap inteiro: a cada
+# repintura só o recorte visível é convertido
+MAX_PIXMAP_PIXELS = 16 * 2 ** 20
+MIN_LEVEL_SIDE = 64
+
+
+class MipPyramid:
+    """Níveis 1, 1/2, 1/4... de uma imagem, calculados e convertidos sob demanda."""
+
+    def __init__(self, image):
+        self.image = image
+        self.height, self.width = image.shape[:2]
+        if image.dtype != np.uint8:
+            # normalizado uma vez, para todos os níveis e recortes usarem a mesma faixa
+            image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        count = 1
+        while max(self.height, self.width) >> count >= MIN_LEVEL_SIDE:
+            count += 1
+        self._arrays = [image] + [None] * (count - 1)
+        self._pixmaps = [None] * count
+
+    @property
+    def level_count(self):
+        return len(self._arrays)
+
+    def level_for(self, scale):
+        """Menor nível cuja resolução ainda cobre a escala de exibição `scale`."""
+        if scale >= 1:
+            return 0
+        return min(int(math.floor(math.log2(1 / scale))), self.level_count - 1)
+
+    def array(self, level):
+        if self._arrays[level] is None:
+            previous = self.array(level - 1)
+            h, w = previous.shape[:2]
+            self._arrays[level] = cv2.resize(previous, (max(1, w // 2), max(1, h // 2)),
+                                             interpolation=cv2.INTER_AREA)
+        return self._arrays[level]
+
+    def pixmap(self, level):
+        """QPixmap do nível inteiro, ou None se ele for grande demais para isso."""
+        array = self.array(level)
+        if array.shape[0] * array.shape[1] > MAX_PIXMAP_PIXELS:
+            return None
+        if self._pixmaps[level] is None:
+            self._pixmaps[level] = QPixmap.fromImage(to_qimage(array))
+        return self._pixmaps[level]
+
+    def update_region(self, x0, y0, x1, y1):
+        """Refaz, em cada nível já calculado, só a parte que cobre o retângulo alterado.
+
+        Para quando a imagem do nível 0 é modificada no lugar (ex.: o editor
+        de marcadores redesenhando umas poucas bacias). Os QPixmap existentes
+        recebem só o recorte novo, sem reconverter o nível inteiro.
+        """
+        if self.image.dtype != np.uint8:
+            # a normalização depende da imagem inteira: todos os níveis são refeitos
+            count = self.level_count
+            self._arrays = [cv2.normalize(self.image, None, 0, 255, cv2.NORM_MINMAX,
+                                          dtype=cv2.CV_8U)] + [None] * (count - 1)
+            self._pixmaps = [None] * count
+            return
+        for level in range(self.level_count):
+            array = self._arrays[level]
+            if array is None:
+                break
+            if level:
+                # alinhado aos blocos 2x2 do nível anterior
+                x0, y0 = x0 // 2, y0 // 2
+                x1 = min(-(-x1 // 2), array.shape[1])
+                y1 = min(-(-y1 // 2), array.shape[0])
+                if x1 <= x0 or y1 <= y0:
+                    break
+                previous = self._arrays[level - 1]
+                array[y0:y1, x0:x1] = cv2.resize(
+                    previous[2 * y0:2 * y1, 2 * x0:2 * x1], (x1 - x0, y1 - y0),
+                    interpolation=cv2.INTER_AREA)
+            pixmap = self._pixmaps[level]
+            if pixmap is not None:
+                painter = QPainter(pixmap)
+                painter.drawImage(x0, y0, to_qimage(array[y0:y1, x0:x1]))
+                painter.end()
+
+
+class ImageViewer(QFrame):
+    """Área de exibição com zoom (roda do mouse), arraste e duplo clique para ajustar.
+
+    Mantém as MipPyramid das últimas `cache_size` imagens exibidas. Também
+    aceita `clear()` e `setText()` como o QLabel que substituiu.
+    """
+
+    MAX_PIXEL_SCALE = 32
+
+    def __init__(self, placeholder="", cache_size=4, parent=None):
+        super().__init__(parent)
+        self.placeholder = placeholder
+        self.cache_size = cache_size
+        self._pyramids = OrderedDict()
+        self.pyramid = None
+        self.zoom = 1.0
+        self.center = None
+        self.tool = None
+        self._drag_origin = None
+
+    def setText(self, text):
+        self.placeholder = text
+        self.update()
+
+    def clear(self):
+        self.pyramid = None
+        self.update()
+
+    def forget_cached(self):
+        """Descarta as pirâmides guardadas, menos a exibida (e as imagens que elas seguram)."""
+        for key in [key for key, pyramid in self._pyramids.items() if pyramid is not self.pyramid]:
+            del self._pyramids[key]
+
+    def set_image(self, image, keep_view=False):
+        """Exibe `image`; com `keep_view`, preserva zoom e posição (ex.: overlay novo)."""
+        key = id(image)
+        pyramid = self._pyramids.get(key)
+        if pyramid is None or pyramid.image is not image:
+            pyramid = MipPyramid(image)
+            self._pyramids[key] = pyramid
+            while len(self._pyramids) > self.cache_size:
+                self._pyramids.popitem(last=False)
+        self._pyramids.move_to_end(key)
+
+        same_size = (self.pyramid is not None and
+                     (self.pyramid.width, self.pyramid.height) ==
+                     (pyramid.width, pyramid.height))
+        self.pyramid = pyramid
+        if not (keep_view and same_size):
+            self.reset_view()
+        self.update()
+
+    def refresh_region(self, x0, y0, x1, y1):
+        """Repinta a imagem atual depois que o retângulo (x0, y0)-(x1, y1) mudou no lugar."""
+        if self.pyramid is None:
+            return
+        self.pyramid.update_region(x0, y0, x1, y1)
+        self.update()
+
+    def set_tool(self, tool):
+        """Instala (ou remove, com None) uma ferramenta interativa, ex.: core.medicao.MeasurementTool.
+
+        A ferramenta recebe os eventos de mouse e teclado antes do visualizador
+        (métodos que retornam True consomem o evento) e desenha por cima da
+        imagem em `paint(painter)`.
+        """
+        self.tool = tool
+        self.setMouseTracking(tool is not None)
+        if tool is not None:
+            self.setFocus()
+        self.update()
+
+    def reset_view(self):
+        self.zoom = 1.0
+        self.center = None
+        self.update()
+
+    def viewport(self):
+        """Área útil do widget, descontadas borda e margens da folha de estilo."""
+        return QRectF(self.contentsRect())
+
+    def fit_scale(self):
+        viewport = self.viewport()
+        return min(viewport.width() / self.pyramid.width,
+                   viewport.height() / self.pyramid.height)
+
+    def view_scale(self):
+        return self.fit_scale() * self.zoom
+
+    def _clamped_center(self, scale):
+        """Centro da vista em coordenadas da imagem, sem deixar sobrar borda à toa."""
+        width, height = self.pyramid.width, self.pyramid.height
+        viewport = self.viewport()
+        cx, cy = self.center if self.center is not None else (width / 2, height / 2)
+        half_w = viewport.width() / (2 * scale)
+        half_h = viewport.height() / (2 * scale)
+        cx = width / 2 if half_w * 2 >= width else min(max(cx, half_w), width - half_w)
+        cy = height / 2 if half_h * 2 >= height else min(max(cy, half_h), height - half_h)
+        return cx, cy
+
+    def map_to_image(self, pos):
+        """Converte um ponto do widget para coordenadas da imagem em resolução total."""
+        scale = self.view_scale()
+        cx, cy = self._clamped_center(scale)
+        middle = self.viewport().center()
+        return QPointF(cx + (pos.x() - middle.x()) / scale,
+                       cy + (pos.y() - middle.y()) / scale)
+
+    def map_from_image(self, point):
+        """Inverso de map_to_image."""
+        scale = self.view_scale()
+        cx, cy = self._clamped_center(scale)
+        middle = self.viewport().center()
+        return QPointF((point.x() - cx) * scale + middle.x(),
+                       (point.y() - cy) * scale + middle.y())
+
+    def paintEvent(self, event):
+        super().paintEvent(event)  # fundo e borda definidos na folha de estilo
+        painter = QPainter(self)
+        viewport = self.viewport()
+        if self.pyramid is None or viewport.isEmpty():
+            painter.setPen(QColor("#ecf0f1"))
+            painter.drawText(viewport, Qt.AlignCenter, self.placeholder)
+            painter.end()
+            return
+        # só a parte suja do widget é redesenhada
+        area = viewport.intersected(QRectF(event.rect()))
+        painter.setClipRect(area)
+        self.paint_image(painter, area)
+        if self.tool is not None:
+            self.tool.paint(painter)
+        painter.end()
+
+    def paint_image(self, painter, area):
+        """Desenha a parte da imagem que cai em `area` (coordenadas do widget)."""
+        scale = self.view_scale()
+        top_left = self.map_to_image(area.topLeft())
+        bottom_right = self.map_to_image(area.bottomRight())
+        # região visível, em coordenadas do nível 0, recortada à imagem
+        visible = QRectF(top_left, bottom_right).intersected(
+            QRectF(0, 0, self.pyramid.width, self.pyramid.height))
+        if visible.isEmpty():
+            return
+        target = QRectF(self.map_from_image(visible.topLeft()),
+                        self.map_from_image(visible.bottomRight()))
+
+        level = self.pyramid.level_for(scale)
+        array = self.pyramid.array(level)
+        factor_x = array.shape[1] / self.pyramid.width
+        factor_y = array.shape[0] / self.pyramid.height
+        source = QRectF(visible.left() * factor_x, visible.top() * factor_y,
+                        visible.width() * factor_x, visible.height() * factor_y)
+
+        # ampliado além de 2x, pixels nítidos ajudam a conferir bordas
+        painter.setRenderHint(QPainter.SmoothPixmapTransform,
+                              scale * (1 << level) <= 2)
+        pixmap = self.pyramid.pixmap(level)
+        if pixmap is not None:
+            painter.drawPixmap(target, pixmap, source)
+        else:
+            x0 = int(source.left())
+            y0 = int(source.top())
+            x1 = min(array.shape[1], int(math.ceil(source.right())))
+            y1 = min(array.shape[0], int(math.ceil(source.bottom())))
+            crop = to_qimage(array[y0:y1, x0:x1])
+            painter.drawImage(target, crop, source.translated(-x0, -y0))
+
+    def wheelEvent(self, event):
+        if self.pyramid is None:
+            return
+        anchor = self.map_to_image(event.position())
+        zoom = self.zoom * 1.25 ** (event.angleDelta().y() / 120)
+        max_zoom = self.MAX_PIXEL_SCALE / self.fit_scale()
+        self.zoom = min(max(zoom, 1.0), max(max_zoom, 1.0))
+        # mantém o ponto sob o cursor no mesmo lugar
+        scale = self.view_scale()
+        middle = self.viewport().center()
+        self.center = (anchor.x() - (event.position().x() - middle.x()) / scale,
+                       anchor.y() - (event.position().y() - middle.y()) / scale)
+        self.center = self._clamped_center(scale)
+        self.update()
+        if self.tool is not None:
+            self.tool.cursor_moved(event.position())
+
+    def mousePressEvent(self, event):
+        if self.tool is not None and self.tool.mouse_press(event):
+            return
+        # com uma ferramenta ativa, o botão do meio continua arrastando a imagem
+        if self.pyramid is not None and event.button() in (Qt.LeftButton, Qt.MiddleButton):
+            self._drag_origin = event.position()
+            self.setCursor(Qt.ClosedHandCursor)
+
+    def mouseMoveEvent(self, event):
+        if self._drag_origin is None:
+            if self.tool is not None:
+                self.tool.cursor_moved(event.position())
+            return
+        scale = self.view_scale()
+        cx, cy = self._clamped_center(scale)
+        delta = event.position() - self._drag_origin
+        self._drag_origin = event.position()
+        self.center = (cx - delta.x() / scale, cy - delta.y() / scale)
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        self._drag_origin = None
+        self.unsetCursor()
+
+    def mouseDoubleClickEvent(self, event):
+        if self.tool is not None and self.tool.mouse_press(event):
+            return
+        self.reset_view()
+
+    def keyPressEvent(self, event):
+        if self.tool is not None and self.tool.key_press(event):
+            return
+        super().keyPressEvent(event)
+
+    def leaveEvent(self, event):
+        if self.tool is not None:
+            self.tool.cursor_moved(None)
+        super().leaveEvent(event)
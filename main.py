@@ -1,14 +1,40 @@
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import os
 import sys
-import ctypes
 from PySide6.QtWidgets import QApplication
 from PySide6.QtGui import QIcon
-from core.telas import SmashMetricsUI
-from core.funcionalidades import Funcionalidades
+from core.inicializacao import FIRST_WINDOW, StartupTimer, FirstPaint, preload
 
-if __name__ == "__main__":
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="SmashMetrics - Análise Forense de Colisões")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="mede a inicialização, imprime o tempo de cada fase e sai "
+                             "(sem display, usa a plataforma offscreen do Qt)")
+    return parser.parse_known_args(argv)
+
+
+def set_app_user_model_id():
+    # Só no Windows: agrupa a janela com o ícone do app na barra de tarefas
+    if sys.platform != "win32":
+        return
+    import ctypes
     ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID("SmashMetrics")
-    app = QApplication(sys.argv)
+
+
+if __name__ == "__main__":
+    args, qt_args = parse_args(sys.argv[1:])
+    if (args.startup_report and sys.platform.startswith("linux")
+            and not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY")):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    startup = StartupTimer(STARTED)
+    set_app_user_model_id()
+    app = QApplication(sys.argv[:1] + qt_args)
     icon_path = "logo_smashmetrics_removebg_preview_CD6_icon.ico"
     app.setWindowIcon(QIcon(icon_path))
 
@@ -18,9 +44,21 @@ if __name__ == "__main__":
     except FileNotFoundError:
         print("⚠ Arquivo 'styles.css' não encontrado. O aplicativo usará o estilo padrão.")
 
+    from core.telas import SmashMetricsUI
+    startup.mark("interface importada")
+
     window = SmashMetricsUI()
-    window.funcionalidades = Funcionalidades()
     window.setWindowIcon(QIcon(icon_path))
+    startup.mark("janela criada")
+
+    def on_first_window():
+        startup.mark(FIRST_WINDOW)
+        loader = preload(timer=startup)
+        if args.startup_report:
+            loader.join()
+            print(startup.format_report())
+            app.quit()
 
+    FirstPaint(window, on_first_window)
     window.show()
     sys.exit(app.exec())